@@ -132,8 +132,32 @@ def start_server(server_type, daemon, pid_file, workers, http_socket):
 @start.command('scheduler')
 @click.option('--daemon/--no-daemon', '-d')
 @click.option('--pid-file', '-p', default=None, type=click.Path(writable=True))
-def start_scheduler(daemon, pid_file):
+@click.option('--watch/--no-watch', default=False)
+@click.option('--poll-interval', default=1.0, type=click.FLOAT)
+@click.option('--pipeline/--no-pipeline', default=False)
+@click.option('--monitor-interval', default=1.0, type=click.FLOAT)
+@click.option('--submission-workers', default=8, type=click.INT)
+@click.option('--max-batch-size', default=1000, type=click.INT)
+@click.option('--min-check-interval', default=1.0, type=click.FLOAT)
+@click.option('--max-check-interval', default=300.0, type=click.FLOAT)
+@click.option('--instance-id', default=None)
+@click.option('--lease-duration', default=60.0, type=click.FLOAT)
+@click.option('--metrics-address', default=None)
+@click.option('--metrics-log-interval', default=60.0, type=click.FLOAT)
+@click.option('--queue-notify-address', default=None)
+def start_scheduler(daemon, pid_file, watch, poll_interval,
+                    pipeline, monitor_interval, submission_workers,
+                    max_batch_size, min_check_interval, max_check_interval,
+                    instance_id, lease_duration, metrics_address,
+                    metrics_log_interval, queue_notify_address):
     import slivka
+    if metrics_address is not None:
+        host, _, port = metrics_address.rpartition(':')
+        if not port.isdigit():
+            raise click.BadParameter(
+                'Address must be in the HOST:PORT format.',
+                param_hint='--metrics-address')
+        metrics_address = (host or '0.0.0.0', int(port))
     if daemon:
         slivka.utils.daemonize()
     pid_file_cm = (slivka.utils.PidFile(pid_file)
@@ -158,7 +182,25 @@ def start_scheduler(daemon, pid_file):
         slivka.conf.logging.get_logging_sock(), (handler,)
     )
     with pid_file_cm, listener, closing(handler):
+        import slivka.db
+        from slivka.db.helpers import create_indexes, find_collection_scans
+        create_indexes(slivka.db.database)
+        find_collection_scans(slivka.db.database)
         scheduler = slivka.scheduler.Scheduler()
+        scheduler.watch_changes = watch
+        scheduler.poll_interval = poll_interval
+        scheduler.pipelined = pipeline
+        scheduler.monitor_interval = monitor_interval
+        scheduler.submission_workers = submission_workers
+        scheduler.max_batch_size = max_batch_size
+        scheduler.min_check_interval = min_check_interval
+        scheduler.max_check_interval = max_check_interval
+        if instance_id is not None:
+            scheduler.instance_id = instance_id
+        scheduler.lease_duration = lease_duration
+        scheduler.metrics_address = metrics_address
+        scheduler.metrics_log_interval = metrics_log_interval
+        scheduler.queue_notify_address = queue_notify_address
         for service in settings.services.values():
             scheduler.load_runners(service.name, service.command)
         scheduler.run_forever()
@@ -169,7 +211,14 @@ def start_scheduler(daemon, pid_file):
 @click.option('--workers', '-w', default=2)
 @click.option('--daemon/--no-daemon', '-d')
 @click.option('--pid-file', '-p', default=None, type=click.Path(writable=True))
-def start_local_queue(address, workers, daemon, pid_file):
+@click.option('--journal', '-j', default=None, type=click.Path(writable=True))
+@click.option('--cpus', default=None, type=click.INT)
+@click.option('--memory', default=None, type=click.INT)
+@click.option('--cgroup', default=None, type=click.Path(exists=True))
+@click.option('--agent-address', default=None)
+@click.option('--notify-address', default=None)
+def start_local_queue(address, workers, daemon, pid_file, journal,
+                      cpus, memory, cgroup, agent_address, notify_address):
     import slivka
     if daemon:
         slivka.utils.daemonize()
@@ -179,15 +228,28 @@ def start_local_queue(address, workers, daemon, pid_file):
     import asyncio
     import slivka.conf.logging
     from slivka.conf import settings
-    from slivka.local_queue import LocalQueue
+    from slivka.local_queue import LocalQueue, Coordinator
     slivka.conf.logging.configure_logging()
     os.environ.setdefault('SLIVKA_SECRET', settings.secret_key)
 
     loop = asyncio.get_event_loop()
-    queue = LocalQueue(
-        address=address or settings.slivka_queue_address,
-        workers=workers
-    )
+    if agent_address is not None:
+        queue = Coordinator(
+            address=address or settings.slivka_queue_address,
+            agent_address=agent_address,
+            journal=journal,
+            notify_address=notify_address
+        )
+    else:
+        queue = LocalQueue(
+            address=address or settings.slivka_queue_address,
+            workers=workers,
+            journal=journal,
+            cpus=cpus,
+            memory=memory,
+            cgroup=cgroup,
+            notify_address=notify_address
+        )
     loop.add_signal_handler(signal.SIGTERM, queue.stop)
     loop.add_signal_handler(signal.SIGINT, queue.stop)
     with pid_file_cm, closing(queue):
@@ -196,6 +258,78 @@ def start_local_queue(address, workers, daemon, pid_file):
     loop.close()
 
 
+@start.command('queue-agent')
+@click.option('--coordinator', '-c', required=True)
+@click.option('--name', '-n', default=None)
+@click.option('--workers', '-w', default=2)
+@click.option('--cpus', default=None, type=click.INT)
+@click.option('--memory', default=None, type=click.INT)
+@click.option('--cgroup', default=None, type=click.Path(exists=True))
+@click.option('--daemon/--no-daemon', '-d')
+@click.option('--pid-file', '-p', default=None, type=click.Path(writable=True))
+def start_queue_agent(coordinator, name, workers, cpus, memory, cgroup,
+                      daemon, pid_file):
+    import slivka
+    if daemon:
+        slivka.utils.daemonize()
+    pid_file_cm = (slivka.utils.PidFile(pid_file)
+                   if pid_file else nullcontext())
+
+    import asyncio
+    import slivka.conf.logging
+    from slivka.local_queue import WorkerAgent
+    slivka.conf.logging.configure_logging()
+
+    loop = asyncio.get_event_loop()
+    agent = WorkerAgent(
+        coordinator, name=name, workers=workers,
+        cpus=cpus, memory=memory, cgroup=cgroup
+    )
+    loop.add_signal_handler(signal.SIGTERM, agent.stop)
+    loop.add_signal_handler(signal.SIGINT, agent.stop)
+    with pid_file_cm, closing(agent):
+        agent.run(loop)
+    loop.run_until_complete(loop.shutdown_asyncgens())
+    loop.close()
+
+
+@main.command('benchmark-queue')
+@click.option('--clients', '-c', default=4, type=click.INT)
+@click.option('--jobs', '-n', default=1000, type=click.INT)
+@click.option('--workers', '-w', default=2, type=click.INT)
+@click.option('--batch-size', '-b', default=0, type=click.INT)
+@click.option('--address', '-a', default=None)
+@click.option('--timeout', default=10.0, type=click.FLOAT)
+def benchmark_queue(clients, jobs, workers, batch_size, address, timeout):
+    """Measure the throughput and latency of the local queue."""
+    from slivka.local_queue.benchmark import run_benchmark, format_report
+    result = run_benchmark(
+        clients=clients, jobs=jobs, workers=workers, batch_size=batch_size,
+        address=address, timeout=timeout)
+    click.echo(format_report(result))
+
+
+@main.group('db')
+@click.option('--home', '-h', type=click.Path())
+def db(home):
+    if home is not None:
+        os.environ['SLIVKA_HOME'] = os.path.abspath(home)
+
+
+@db.command('create-indexes')
+@click.option('--check/--no-check', default=True)
+def db_create_indexes(check):
+    """Create database indexes used by slivka."""
+    import slivka.db
+    from slivka.db.helpers import create_indexes, find_collection_scans
+    create_indexes(slivka.db.database)
+    click.echo("Indexes created.")
+    if check:
+        for cls, query, _ in find_collection_scans(slivka.db.database):
+            click.echo("Query %r on %s collection requires a collection scan."
+                       % (query, cls.__collection__), err=True)
+
+
 @start.command('shell',
                help='Set-up slivka and start interactive python console.')
 def start_shell():
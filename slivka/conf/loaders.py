@@ -53,6 +53,7 @@ class SettingsLoaderV10:
             slivka_queue_address=conf['SLIVKA_QUEUE_ADDR'],
             mongodb=conf.get('MONGODB') or conf.get('MONGODB_ADDR'),
             secret_key=conf.get('SECRET_KEY'),
+            client_id_header=conf.get('CLIENT_ID_HEADER'),
         )
 
     @staticmethod
@@ -110,6 +111,7 @@ class SettingsLoaderV11:
             slivka_queue_address=conf['SLIVKA_QUEUE_ADDR'],
             mongodb=conf.get('MONGODB') or conf.get('MONGODB_ADDR'),
             secret_key=conf.get('SECRET_KEY'),
+            client_id_header=conf.get('CLIENT_ID_HEADER'),
         )
 
     @staticmethod
@@ -124,6 +126,12 @@ class SettingsLoaderV11:
             command['runners'] = conf['runners']
             if 'limiter' in conf:
                 command['limiter'] = conf['limiter']
+            if 'ordering' in conf:
+                command['ordering'] = conf['ordering']
+            if 'max-priority' in conf:
+                command['max-priority'] = conf['max-priority']
+            if 'max-concurrent-jobs' in conf:
+                command['max-concurrent-jobs'] = conf['max-concurrent-jobs']
             if 'test' in conf:
                 command['test'] = conf['test']
             yield name, Service(
@@ -184,6 +192,7 @@ class Settings:
     mongodb = attr.ib(converter=_mongodb_converter)
     services = attr.ib()
     secret_key = attr.ib(default=None)
+    client_id_header = attr.ib(default=None)
 
 
 def _form_validator(_obj, _attr, val):
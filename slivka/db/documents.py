@@ -6,6 +6,7 @@ from datetime import datetime
 from uuid import uuid4
 
 import pymongo
+from pymongo import IndexModel, ASCENDING, DESCENDING
 
 from slivka import JobStatus
 from slivka.utils import deprecated
@@ -17,6 +18,7 @@ def b64_uuid4():
 
 class MongoDocument(dict):
     __collection__ = None
+    __indexes__ = ()
 
     def _get_id(self): return self['_id']
     id = property(fget=_get_id)
@@ -62,6 +64,18 @@ class MongoDocument(dict):
 
 class JobRequest(MongoDocument):
     __collection__ = 'requests'
+    __indexes__ = (
+        IndexModel([('uuid', ASCENDING)]),
+        IndexModel([('status', ASCENDING), ('service', ASCENDING),
+                    ('runner', ASCENDING), ('timestamp', ASCENDING)]),
+        IndexModel([('status', ASCENDING), ('service', ASCENDING),
+                    ('runner', ASCENDING), ('priority', DESCENDING),
+                    ('timestamp', ASCENDING)]),
+        IndexModel([('status', ASCENDING), ('service', ASCENDING),
+                    ('runner', ASCENDING), ('client', ASCENDING),
+                    ('timestamp', ASCENDING)]),
+        IndexModel([('lease_owner', ASCENDING), ('status', ASCENDING)]),
+    )
 
     def __init__(self,
                  service,
@@ -69,6 +83,8 @@ class JobRequest(MongoDocument):
                  uuid=None,
                  timestamp=None,
                  status=None,
+                 priority=0,
+                 client=None,
                  **kwargs):
         super().__init__(
             service=service,
@@ -76,6 +92,8 @@ class JobRequest(MongoDocument):
             uuid=uuid if uuid is not None else b64_uuid4(),
             timestamp=timestamp if timestamp is not None else datetime.now(),
             status=status if status is not None else JobStatus.PENDING,
+            priority=priority,
+            client=client,
             **kwargs
         )
 
@@ -83,6 +101,8 @@ class JobRequest(MongoDocument):
     inputs = property(lambda self: self['inputs'])
     uuid = property(lambda self: self['uuid'])
     timestamp = property(lambda self: self['timestamp'])
+    priority = property(lambda self: self['priority'])
+    client = property(lambda self: self['client'])
 
     def _get_state(self): return JobStatus(self['status'])
     def _set_state(self, val): self['status'] = val
@@ -92,6 +112,9 @@ class JobRequest(MongoDocument):
 
 class CancelRequest(MongoDocument):
     __collection__ = 'cancelrequest'
+    __indexes__ = (
+        IndexModel([('uuid', ASCENDING)]),
+    )
 
     def __init__(self, uuid, **kwargs):
         super().__init__(uuid=uuid, **kwargs)
@@ -101,6 +124,13 @@ class CancelRequest(MongoDocument):
 
 class JobMetadata(MongoDocument):
     __collection__ = 'jobs'
+    __indexes__ = (
+        IndexModel([('uuid', ASCENDING)]),
+        IndexModel([('status', ASCENDING), ('runner_class', ASCENDING),
+                    ('next_check', ASCENDING)]),
+        IndexModel([('lease_owner', ASCENDING), ('status', ASCENDING)]),
+        IndexModel([('job_id', ASCENDING), ('runner_class', ASCENDING)]),
+    )
 
     def __init__(self,
                  uuid,
@@ -127,6 +157,7 @@ class JobMetadata(MongoDocument):
     cwd = work_dir
     runner_class = property(lambda self: self['runner_class'])
     job_id = property(lambda self: self['job_id'])
+    usage = property(lambda self: self.get('usage'))
 
     def _get_state(self): return JobStatus(self['status'])
     def _set_state(self, val): self['status'] = val
@@ -136,6 +167,9 @@ class JobMetadata(MongoDocument):
 
 class UploadedFile(MongoDocument):
     __collection__ = 'files'
+    __indexes__ = (
+        IndexModel([('uuid', ASCENDING)]),
+    )
 
     def __init__(self, *,
                  title=None,
@@ -164,6 +198,9 @@ class UploadedFile(MongoDocument):
 
 class ServiceState(MongoDocument):
     __collection__ = 'servicestate'
+    __indexes__ = (
+        IndexModel([('service', ASCENDING), ('runner', ASCENDING)]),
+    )
 
     class State(enum.IntEnum):
         OK = 0
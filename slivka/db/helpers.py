@@ -1,9 +1,15 @@
-from typing import List
+import logging
+from datetime import datetime
+from typing import List, Iterable, Type
 
 import pymongo.database
 from pymongo import ReplaceOne
 
-from .documents import MongoDocument
+from slivka import JobStatus
+from .documents import (MongoDocument, JobRequest, JobMetadata, CancelRequest,
+                        UploadedFile, ServiceState)
+
+log = logging.getLogger(__name__)
 
 
 def insert_one(database: pymongo.database.Database, item: MongoDocument):
@@ -52,3 +58,72 @@ def pull_many(database: pymongo.database.Database, items: List[MongoDocument]):
 def push_many(database: pymongo.database.Database, items: List[MongoDocument]):
     operations = [ReplaceOne({'_id': it.id}, it) for it in items]
     database[items[0].__collection__].bulk_write(operations, ordered=False)
+
+
+def _document_classes(cls=MongoDocument):
+    for subclass in cls.__subclasses__():
+        yield subclass
+        yield from _document_classes(subclass)
+
+
+def create_indexes(database: pymongo.database.Database,
+                   documents: Iterable[Type[MongoDocument]] = None):
+    """Ensures that the indexes declared by the documents exist."""
+    if documents is None:
+        documents = _document_classes()
+    for cls in documents:
+        if cls.__collection__ is None or not cls.__indexes__:
+            continue
+        database[cls.__collection__].create_indexes(list(cls.__indexes__))
+        log.debug("ensured indexes of %s collection", cls.__collection__)
+
+
+# representative filters and sort orders of the frequent queries
+HOT_QUERIES = [
+    (JobRequest, {'uuid': ''}, None),
+    (JobRequest, {'status': JobStatus.PENDING}, None),
+    (JobRequest, {'status': JobStatus.ACCEPTED, 'service': '', 'runner': ''},
+     [('timestamp', pymongo.ASCENDING)]),
+    (JobRequest, {'lease_owner': '', 'status': {'$in': []}}, None),
+    (JobMetadata, {'uuid': ''}, None),
+    (JobMetadata, {'lease_owner': '', 'status': {'$in': []}}, None),
+    (JobMetadata, {'status': {'$in': [JobStatus.QUEUED, JobStatus.RUNNING]},
+                   'runner_class': '',
+                   'next_check': {'$not': {'$gt': datetime.now()}}},
+     None),
+    (JobMetadata, {'job_id': {'$in': []}, 'runner_class': {'$in': []}}, None),
+    (CancelRequest, {'uuid': ''}, None),
+    (UploadedFile, {'uuid': ''}, None),
+    (ServiceState, {'service': '', 'runner': ''}, None),
+]
+
+
+def _is_collection_scan(plan: dict) -> bool:
+    if plan.get('stage') == 'COLLSCAN':
+        return True
+    children = plan.get('inputStages', [])
+    if 'inputStage' in plan:
+        children = [plan['inputStage'], *children]
+    return any(_is_collection_scan(child) for child in children)
+
+
+def find_collection_scans(database: pymongo.database.Database,
+                          queries=None):
+    """Returns the queries which would scan the whole collection.
+
+    :param database: mongo database instance
+    :param queries: list of (document class, filter, sort) tuples,
+        defaults to ``HOT_QUERIES``
+    :return: list of the offending queries
+    """
+    scans = []
+    for cls, query, sort in queries if queries is not None else HOT_QUERIES:
+        cursor = database[cls.__collection__].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = cursor.explain()['queryPlanner']['winningPlan']
+        if _is_collection_scan(plan):
+            log.warning("Query %r on %s collection requires a "
+                        "collection scan.", query, cls.__collection__)
+            scans.append((cls, query, sort))
+    return scans
@@ -1,2 +1,3 @@
-from .client import LocalQueueClient, RequestError
+from .client import LocalQueueClient, LocalQueueSubscriber, RequestError
 from .core import LocalQueue
+from .agent import Coordinator, WorkerAgent
@@ -0,0 +1,285 @@
+import asyncio
+import itertools
+import json
+import math
+import os
+import socket
+import time
+from typing import Dict, List, Set
+
+import attr
+import zmq
+
+from slivka import JobStatus
+from .core import LocalQueue, Job, get_running_loop, _zmq_address
+
+_active_states = (JobStatus.QUEUED, JobStatus.RUNNING)
+
+
+@attr.s(slots=True)
+class AgentInfo:
+    name = attr.ib(type=str)
+    last_seen = attr.ib(factory=time.monotonic, type=float)
+    jobs = attr.ib(factory=set, type=Set[int])
+    cancelled = attr.ib(factory=list, type=List[int])
+
+
+class Coordinator(LocalQueue):
+    """Local queue distributing the jobs to the worker agents.
+
+    Instead of running the jobs, the coordinator keeps them until
+    a worker agent asks for the jobs with a PULL message stating its
+    free cpus and memory. The agents report the state changes of
+    their jobs with STATE messages. Both messages are accepted on the
+    ``agent_address`` in addition to the regular client messages.
+    Each PULL response also carries the ids of the jobs to cancel.
+    Jobs of the agents which did not contact the coordinator for
+    ``agent_timeout`` seconds are considered interrupted.
+    Every PULL lists the jobs the agent holds; the jobs dispatched to
+    the agent but missing from the list, e.g. because the response
+    carrying them was lost, are queued again.
+    """
+
+    def __init__(self, address, agent_address, secret=None, journal=None,
+                 agent_timeout=30, notify_address=None):
+        super().__init__(address, secret=secret, journal=journal,
+                         notify_address=notify_address)
+        self.agent_address = _zmq_address(agent_address)
+        # the capacity is provided by the agents
+        self.cpus = self.free_cpus = math.inf
+        self.agent_timeout = agent_timeout
+        self.agents = {}  # type: Dict[str, AgentInfo]
+        self._assigned = {}  # type: Dict[int, str]
+
+    def _main_tasks(self, loop):
+        tasks = [
+            self.serve_forever(),
+            self.serve_forever(self.agent_address),
+            self._agent_monitor()
+        ]
+        if self.journal is not None:
+            tasks.append(self._compactor())
+        return tasks
+
+    def handle_message(self, message):
+        try:
+            if message['method'] == 'PULL':
+                return self.do_PULL(message)
+            elif message['method'] == 'STATE':
+                return self.do_STATE(message)
+        except Exception:
+            self.logger.exception("Error during message processing")
+            return {'ok': False, 'error': 'invalid-message'}
+        return super().handle_message(message)
+
+    def _get_agent(self, name) -> AgentInfo:
+        agent = self.agents.get(name)
+        if agent is None:
+            self.logger.info('agent %s connected', name)
+            agent = self.agents[name] = AgentInfo(name)
+        agent.last_seen = time.monotonic()
+        return agent
+
+    def _requeue_lost(self, agent, held):
+        """Queue again the jobs dispatched to the agent it does not hold."""
+        lost = [job_id for job_id in agent.jobs if job_id not in held]
+        for job_id in lost:
+            agent.jobs.discard(job_id)
+            self._assigned.pop(job_id, None)
+            job = self.jobs.get(job_id)
+            if job is not None and job.state == JobStatus.RUNNING:
+                self._set_state(job, JobStatus.QUEUED)
+                self._push(job)
+        if lost:
+            self.logger.warning('%d jobs dispatched to %s were lost, '
+                                'queued again', len(lost), agent.name)
+
+    def do_PULL(self, msg):
+        agent = self._get_agent(msg['agent'])
+        if 'held' in msg:
+            self._requeue_lost(agent, set(msg['held']))
+        free_cpus = msg['cpus']
+        free_memory = msg.get('memory')
+        dispatched = []
+        skipped = []
+        try:
+            while len(skipped) < self.backfill_window:
+                entry = self.queue.pop()
+                if entry is None:
+                    break
+                job = entry[1]
+                if job.cpus > free_cpus or (
+                        free_memory is not None and job.memory > free_memory):
+                    skipped.append(entry)
+                    continue
+                free_cpus -= job.cpus
+                if free_memory is not None:
+                    free_memory -= job.memory
+                self._assigned[job.id] = agent.name
+                agent.jobs.add(job.id)
+                self._set_state(job, JobStatus.RUNNING)
+                dispatched.append(job)
+        finally:
+            for entry in skipped:
+                self.queue.push_entry(entry)
+        if dispatched:
+            self.logger.info('dispatched %d jobs to %s',
+                             len(dispatched), agent.name)
+        cancelled, agent.cancelled = agent.cancelled, []
+        return {
+            'ok': True,
+            'jobs': [
+                {'id': job.id, 'cmd': job.cmd, 'cwd': job.cwd, 'env': job.env,
+                 'cpus': job.cpus, 'memory': job.memory, 'limits': job.limits}
+                for job in dispatched
+            ],
+            'cancel': cancelled
+        }
+
+    def do_STATE(self, msg):
+        agent = self._get_agent(msg['agent'])
+        for report in msg['jobs']:
+            job = self.jobs.get(report['id'])
+            # ignore the jobs which were interrupted in the meantime
+            if job is None or job.state != JobStatus.RUNNING:
+                continue
+            state = JobStatus(report['state'])
+            if state in _active_states:
+                continue
+            job.return_code = report['returncode']
+            job.usage = report.get('usage')
+            self._set_state(job, state)
+            self._assigned.pop(job.id, None)
+            agent.jobs.discard(job.id)
+        return {'ok': True}
+
+    def do_CANCEL(self, msg):
+        agent_name = self._assigned.get(msg['id'])
+        if agent_name is not None and agent_name in self.agents:
+            self.agents[agent_name].cancelled.append(msg['id'])
+        return super().do_CANCEL(msg)
+
+    async def _agent_monitor(self):
+        while True:
+            await asyncio.sleep(self.agent_timeout / 3)
+            deadline = time.monotonic() - self.agent_timeout
+            for agent in list(self.agents.values()):
+                if agent.last_seen > deadline:
+                    continue
+                self.logger.warning(
+                    'agent %s is not responding, %d jobs interrupted',
+                    agent.name, len(agent.jobs))
+                for job_id in agent.jobs:
+                    self._assigned.pop(job_id, None)
+                    job = self.jobs.get(job_id)
+                    if job is not None and job.state == JobStatus.RUNNING:
+                        self._set_state(job, JobStatus.INTERRUPTED)
+                del self.agents[agent.name]
+
+
+class WorkerAgent(LocalQueue):
+    """Runs the jobs received from the coordinator on this host.
+
+    The agent runs the jobs the same way as the local queue does,
+    sharing the cpus and memory of the host between them, but
+    instead of accepting jobs from the clients, it pulls as many jobs
+    from the coordinator as fit in its free resources every
+    ``poll_interval`` seconds or as soon as a job finishes.
+    """
+
+    def __init__(self, coordinator_address, name=None, workers=1,
+                 secret=None, cpus=None, memory=None, cgroup=None):
+        super().__init__(coordinator_address, workers=workers, secret=secret,
+                         cpus=cpus, memory=memory, cgroup=cgroup)
+        self.name = name or '%s:%d' % (socket.gethostname(), os.getpid())
+        self.poll_interval = 1.0
+        self.timeout = 5.0
+        self._reports = []
+        self._request_ids = itertools.count(1)
+        self._wakeup = None
+
+    def _main_tasks(self, loop):
+        return [self._agent_loop(), self._consumer(loop)]
+
+    def _set_state(self, job, state):
+        super()._set_state(job, state)
+        if state in _active_states:
+            return
+        self._reports.append({
+            'id': job.id, 'state': job.state,
+            'returncode': job.return_code, 'usage': job.usage
+        })
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _agent_loop(self):
+        self._wakeup = asyncio.Event()
+        sock = self.zmq_ctx.socket(zmq.DEALER)
+        sock.setsockopt(zmq.LINGER, 0)
+        sock.connect(self.address)
+        self.logger.info('agent %s connected to %s', self.name, self.address)
+        try:
+            while True:
+                self._wakeup.clear()
+                try:
+                    await self._exchange(sock)
+                except asyncio.TimeoutError:
+                    self.logger.warning(
+                        'coordinator at %s is not responding', self.address)
+                try:
+                    await asyncio.wait_for(
+                        self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            sock.close(0)
+
+    async def _request(self, sock, message):
+        loop = get_running_loop()
+        request_id = next(self._request_ids)
+        message = dict(message, request_id=request_id)
+        deadline = loop.time() + self.timeout
+        await asyncio.wait_for(
+            sock.send_multipart([b'', json.dumps(message).encode()]),
+            self.timeout)
+        while True:
+            frames = await asyncio.wait_for(
+                sock.recv_multipart(), deadline - loop.time())
+            response = json.loads(frames[-1])
+            # skip the late responses to the requests which timed out
+            if response.get('request_id') == request_id:
+                return response
+
+    async def _exchange(self, sock):
+        """Report the job states and pull new jobs from the coordinator."""
+        if self._reports:
+            reports = self._reports
+            self._reports = []
+            try:
+                await self._request(
+                    sock, {'method': 'STATE', 'agent': self.name,
+                           'jobs': reports})
+            except BaseException:
+                self._reports[:0] = reports
+                raise
+            for report in reports:
+                self.jobs.pop(report['id'], None)
+        queued = [job for job in self.jobs.active()
+                  if job.state == JobStatus.QUEUED]
+        free_cpus = self.free_cpus - sum(job.cpus for job in queued)
+        free_memory = (None if self.memory is None else
+                       self.free_memory - sum(job.memory for job in queued))
+        # includes the finished jobs not reported yet
+        held = [job.id for job in self.jobs.values()]
+        response = await self._request(
+            sock, {'method': 'PULL', 'agent': self.name,
+                   'cpus': free_cpus, 'memory': free_memory, 'held': held})
+        for item in response['jobs']:
+            job = Job(cmd=item['cmd'], cwd=item['cwd'], env=item['env'],
+                      cpus=item['cpus'], memory=item['memory'],
+                      limits=item.get('limits') or {})
+            job.id = item['id']
+            self.jobs[job.id] = job
+            self._push(job)
+        for job_id in response['cancel']:
+            self.do_CANCEL({'id': job_id})
@@ -0,0 +1,224 @@
+"""Load test of the local queue protocol.
+
+The benchmark starts a local queue in a separate process, submits
+trivial jobs to it from multiple concurrent clients and then requests
+the job statuses, measuring the throughput and latency of each phase
+and the memory used by the queue process.
+"""
+import asyncio
+import multiprocessing
+import os
+import signal
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+import zmq
+
+from .client import LocalQueueClient
+
+
+def _serve(address, workers):
+    from .core import LocalQueue
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    queue = LocalQueue(address, workers=workers, secret=b'benchmark')
+    loop.add_signal_handler(signal.SIGTERM, queue.stop)
+    try:
+        queue.run(loop)
+        queue.close(loop)
+    finally:
+        loop.close()
+
+
+def _read_memory(pid) -> Optional[Dict[str, int]]:
+    """Return the current and peak resident memory of the process in kB."""
+    try:
+        with open('/proc/%d/status' % pid) as f:
+            fields = dict(line.split(':', 1) for line in f)
+    except OSError:
+        return None
+    return {
+        'rss': int(fields['VmRSS'].split()[0]),
+        'peak_rss': int(fields['VmHWM'].split()[0])
+    }
+
+
+def percentile(values, q):
+    """Return the ``q``-th percentile of the values (nearest rank)."""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(0, min(len(values) - 1, int(round(q / 100 * len(values))) - 1))
+    return values[rank]
+
+
+def _summarize(latencies, requests, duration) -> dict:
+    return {
+        'requests': requests,
+        'seconds': duration,
+        'throughput': requests / duration if duration else None,
+        'p50': percentile(latencies, 50),
+        'p90': percentile(latencies, 90),
+        'p99': percentile(latencies, 99),
+        'max': max(latencies) if latencies else None
+    }
+
+
+def _run_clients(address, func, chunks, timeout) -> List[float]:
+    """Call the function with a separate client for every chunk at once.
+
+    :return: latencies of all the requests
+    """
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(len(chunks))
+
+    def target(chunk):
+        client = LocalQueueClient(address, secret=b'benchmark',
+                                  timeout=timeout)
+        try:
+            barrier.wait()
+            result = func(client, chunk)
+            with lock:
+                latencies.extend(result)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            client.socket.close(0)
+
+    threads = [threading.Thread(target=target, args=(chunk,))
+               for chunk in chunks]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return latencies
+
+
+def _wait_until_ready(address, timeout):
+    client = LocalQueueClient(address, timeout=0.1)
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                client.get_job_status(0)
+                return
+            except zmq.error.Again:
+                if time.monotonic() > deadline:
+                    raise ConnectionError(
+                        "Queue server at %s is not responding." % address)
+    finally:
+        client.socket.close(0)
+
+
+def run_benchmark(clients=4, jobs=1000, workers=2, batch_size=0,
+                  address=None, timeout=10.0) -> dict:
+    """Measure the submission and status request performance of the queue.
+
+    :param clients: number of concurrent clients
+    :param jobs: total number of jobs submitted
+    :param workers: number of workers of the started queue
+    :param batch_size: number of jobs per BATCH_POST and BATCH_GET
+        request, single job requests are used if 0
+    :param address: address of a running queue to use instead of
+        starting one, the server memory is not measured then
+    :param timeout: seconds to wait for each response
+    :return: dictionary of the ``submit`` and ``status`` phase summaries
+        and the ``memory`` of the queue process in kilobytes
+    """
+    tmp_dir = tempfile.TemporaryDirectory()
+    process = None
+    if address is None:
+        address = 'unix://' + os.path.join(tmp_dir.name, 'queue.sock')
+        # a fresh interpreter so the zmq context is not shared with the fork
+        process = multiprocessing.get_context('spawn').Process(
+            target=_serve, args=(address, workers), daemon=True)
+        process.start()
+    try:
+        _wait_until_ready(address, timeout)
+        cwd = tmp_dir.name
+        chunks = [range(i, jobs, clients) for i in range(clients)]
+        chunks = [chunk for chunk in chunks if len(chunk)]
+        job_ids = []
+
+        def submit(client, chunk):
+            latencies = []
+            if batch_size:
+                for i in range(0, len(chunk), batch_size):
+                    count = len(chunk[i:i + batch_size])
+                    start = time.perf_counter()
+                    responses = client.submit_jobs(
+                        ('true', cwd, {}) for _ in range(count))
+                    latencies.append(time.perf_counter() - start)
+                    job_ids.extend(response.id for response in responses)
+            else:
+                for _ in chunk:
+                    start = time.perf_counter()
+                    response = client.submit_job('true', cwd, {})
+                    latencies.append(time.perf_counter() - start)
+                    job_ids.append(response.id)
+            return latencies
+
+        def check(client, ids):
+            latencies = []
+            if batch_size:
+                for i in range(0, len(ids), batch_size):
+                    start = time.perf_counter()
+                    client.get_job_statuses(ids[i:i + batch_size])
+                    latencies.append(time.perf_counter() - start)
+            else:
+                for job_id in ids:
+                    start = time.perf_counter()
+                    client.get_job_status(job_id)
+                    latencies.append(time.perf_counter() - start)
+            return latencies
+
+        start = time.perf_counter()
+        latencies = _run_clients(address, submit, chunks, timeout)
+        submit_summary = _summarize(
+            latencies, len(latencies), time.perf_counter() - start)
+
+        id_chunks = [job_ids[i::len(chunks)] for i in range(len(chunks))]
+        start = time.perf_counter()
+        latencies = _run_clients(address, check, id_chunks, timeout)
+        status_summary = _summarize(
+            latencies, len(latencies), time.perf_counter() - start)
+
+        memory = _read_memory(process.pid) if process is not None else None
+        return {
+            'clients': len(chunks),
+            'jobs': len(job_ids),
+            'submit': submit_summary,
+            'status': status_summary,
+            'memory': memory
+        }
+    finally:
+        if process is not None:
+            process.terminate()
+            process.join(timeout)
+        tmp_dir.cleanup()
+
+
+def format_report(result) -> str:
+    lines = ['%d jobs submitted by %d clients'
+             % (result['jobs'], result['clients'])]
+    for phase in ('submit', 'status'):
+        summary = result[phase]
+        lines.append(
+            '%-6s %6d requests in %.2fs, %.0f req/s, latency '
+            'p50 %.2fms p90 %.2fms p99 %.2fms max %.2fms' % (
+                phase, summary['requests'], summary['seconds'],
+                summary['throughput'] or 0,
+                *(1000 * (summary[key] or 0)
+                  for key in ('p50', 'p90', 'p99', 'max'))
+            ))
+    memory = result['memory']
+    if memory is not None:
+        lines.append('server memory %d kB, peak %d kB'
+                     % (memory['rss'], memory['peak_rss']))
+    return str.join('\n', lines)
@@ -1,4 +1,9 @@
 import atexit
+import itertools
+import json
+import logging
+import threading
+import time
 from collections import namedtuple
 
 import zmq
@@ -8,58 +13,213 @@ atexit.register(zmq_ctx.destroy, 0)
 
 
 class LocalQueueClient:
-    JobStatusResponse = namedtuple("JobStatus", 'id, state, returncode')
+    JobStatusResponse = namedtuple(
+        "JobStatus", 'id, state, returncode, usage', defaults=(None,))
 
-    def __init__(self, address, secret=None):
+    def __init__(self, address, secret=None, timeout=5.0):
+        """
+        :param address: address of the queue server
+        :param secret: shared secret
+        :param timeout: seconds to wait for the response
+        """
         if address.startswith('unix://'):
             self.address = str.replace(address, 'unix', 'ipc', 1)
         else:
             self.address = 'tcp://' + address
         self.secret = secret
-        self.socket = zmq_ctx.socket(zmq.REQ)
-        self.socket.setsockopt(zmq.RCVTIMEO, 100)
-        self.socket.setsockopt(zmq.REQ_RELAXED, 1)
+        self.timeout = timeout
+        self.socket = zmq_ctx.socket(zmq.DEALER)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.setsockopt(zmq.SNDTIMEO, int(timeout * 1000))
         self.socket.connect(self.address)
+        # zmq sockets must not be used from multiple threads at once
+        self._lock = threading.Lock()
+        self._request_ids = itertools.count(1)
+        self._responses = {}
+        self._abandoned = set()
 
-    def submit_job(self, cmd, cwd, env):
+    def send(self, message, flags=0):
+        """Send the message without waiting for the response.
+
+        Multiple requests can be sent before their responses are
+        collected with :meth:`receive`.
+
+        :return: request id to collect the response with
+        """
+        request_id = next(self._request_ids)
+        message = dict(message, request_id=request_id)
+        with self._lock:
+            # the empty delimiter frame keeps the envelope REQ-compatible
+            self.socket.send_multipart(
+                [b'', json.dumps(message).encode()], flags=flags)
+        return request_id
+
+    def receive(self, request_id, timeout=None):
+        """Wait for the response to the request.
+
+        Responses to the other requests arriving in the meantime are
+        kept until requested, possibly by other threads.
+
+        :raise zmq.error.Again: response not received within the timeout
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                if request_id in self._responses:
+                    response = self._responses.pop(request_id)
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._abandoned.add(request_id)
+                    raise zmq.error.Again()
+                # poll shortly so other threads can use the socket
+                if self.socket.poll(min(remaining, 0.01) * 1000):
+                    response = json.loads(self.socket.recv_multipart()[-1])
+                    response_id = response.pop('request_id', None)
+                    if response_id == request_id:
+                        break
+                    if response_id in self._abandoned:
+                        self._abandoned.discard(response_id)
+                    else:
+                        self._responses[response_id] = response
+        if response.pop('ok'):
+            return response
+        else:
+            raise RequestError(response['error'])
+
+    def _request(self, message, flags=0):
+        return self.receive(self.send(message, flags))
+
+    def submit_job(self, cmd, cwd, env, cpus=1, memory=0, limits=None,
+                   priority=0):
+        """Submit the job to the queue.
+
+        :param cmd: shell command
+        :param cwd: working directory of the job
+        :param env: environment variables
+        :param cpus: number of cpus used by the job
+        :param memory: megabytes of memory used by the job
+        :param limits: dictionary of ``cpu_time`` and ``wall_time``
+            in seconds and ``memory`` in megabytes the job is
+            terminated after exceeding
+        :param priority: jobs with higher priority are started first
+        """
         try:
-            self.socket.send_json(
-                {'method': 'POST', 'cmd': cmd, 'cwd': cwd, 'env': env},
+            response = self._request(
+                {'method': 'POST', 'cmd': cmd, 'cwd': cwd, 'env': env,
+                 'cpus': cpus, 'memory': memory, 'limits': limits,
+                 'priority': priority},
                 flags=zmq.NOBLOCK
             )
-            response = self.socket.recv_json()
         except zmq.error.Again:
             raise ConnectionError(
                 "Queue server at %s is not responding." % self.address
             ) from None
-        if response.pop('ok'):
-            return self.JobStatusResponse(**response)
-        else:
-            raise RequestError(response['error'])
+        return self.JobStatusResponse(**response)
+
+    def submit_jobs(self, jobs, cpus=1, memory=0, limits=None, priority=0):
+        """Submit multiple jobs in a single request.
+
+        :param jobs: iterable of (cmd, cwd, env) tuples
+        :param cpus: number of cpus used by each job
+        :param memory: megabytes of memory used by each job
+        :param limits: resource limits of each job, see :meth:`submit_job`
+        :param priority: priority of each job
+        :return: list of job statuses in the order of submission
+        """
+        try:
+            response = self._request(
+                {'method': 'BATCH_POST',
+                 'jobs': [{'cmd': cmd, 'cwd': cwd, 'env': env,
+                           'cpus': cpus, 'memory': memory, 'limits': limits,
+                           'priority': priority}
+                          for cmd, cwd, env in jobs]},
+                flags=zmq.NOBLOCK
+            )
+        except zmq.error.Again:
+            raise ConnectionError(
+                "Queue server at %s is not responding." % self.address
+            ) from None
+        return [self.JobStatusResponse(**job) for job in response['jobs']]
 
     def get_job_status(self, id):
-        self.socket.send_json({'method': 'GET', 'id': id})
-        response = self.socket.recv_json()
-        if response.pop('ok'):
-            return self.JobStatusResponse(**response)
-        else:
-            raise RequestError(response['error'])
+        response = self._request({'method': 'GET', 'id': id})
+        return self.JobStatusResponse(**response)
+
+    def get_job_statuses(self, ids):
+        response = self._request({'method': 'BATCH_GET', 'ids': list(ids)})
+        return [self.JobStatusResponse(**job) for job in response['jobs']]
 
     def cancel_job(self, id):
-        self.socket.send_json({'method': 'CANCEL', 'id': id})
-        response = self.socket.recv_json()
-        if response.pop('ok'):
-            return True
-        else:
-            raise RequestError(response['error'])
+        self._request({'method': 'CANCEL', 'id': id})
+        return True
 
     def release_job(self, id):
-        self.socket.send_json({'method': 'DELETE', 'id': id})
-        response = self.socket.recv_json()
-        if response.pop('ok'):
-            return True
+        self._request({'method': 'DELETE', 'id': id})
+        return True
+
+    def cancel_jobs(self, ids):
+        self._request({'method': 'BATCH_CANCEL', 'ids': list(ids)})
+        return True
+
+    def release_jobs(self, ids):
+        self._request({'method': 'BATCH_DELETE', 'ids': list(ids)})
+        return True
+
+
+class LocalQueueSubscriber(threading.Thread):
+    """Thread receiving the job state changes published by the queue.
+
+    The state changes received together are passed to the callback
+    at once as a dictionary of job ids and their states. Notifications
+    published while the subscriber is not connected are lost, so they
+    can only complement polling the queue, not replace it.
+    """
+
+    max_batch_size = 1000
+
+    def __init__(self, address, callback, name='LocalQueueSubscriber'):
+        threading.Thread.__init__(self, name=name, daemon=True)
+        self.log = logging.getLogger(__name__)
+        if address.startswith('unix://'):
+            self.address = str.replace(address, 'unix', 'ipc', 1)
         else:
-            raise RequestError(response['error'])
+            self.address = 'tcp://' + address
+        self._callback = callback
+        self._finished = threading.Event()
+
+    def cancel(self):
+        """Stop the subscriber thread."""
+        self._finished.set()
+
+    def run(self) -> None:
+        socket = zmq_ctx.socket(zmq.SUB)
+        socket.setsockopt(zmq.LINGER, 0)
+        socket.setsockopt(zmq.SUBSCRIBE, b'state')
+        socket.connect(self.address)
+        self.log.info('subscribed to the job states at %s', self.address)
+        try:
+            while not self._finished.is_set():
+                if not socket.poll(100):
+                    continue
+                states = {}
+                while len(states) < self.max_batch_size:
+                    try:
+                        frames = socket.recv_multipart(zmq.NOBLOCK)
+                    except zmq.error.Again:
+                        break
+                    try:
+                        message = json.loads(frames[-1])
+                        states[message['id']] = message['state']
+                    except (ValueError, KeyError):
+                        self.log.error("Malformed notification received")
+                try:
+                    self._callback(states)
+                except Exception:
+                    self.log.exception("Processing job states failed.")
+        finally:
+            socket.close(0)
 
 
 class RequestError(RuntimeError):
@@ -1,10 +1,14 @@
 import asyncio
+import contextlib
+import heapq
 import itertools
+import json
 import logging
 import os
+import sys
 import time
 from functools import partial
-from typing import Dict
+from typing import Dict, Optional
 
 import attr
 import zmq
@@ -12,6 +16,9 @@ import zmq.asyncio as aiozmq
 
 from slivka import JobStatus
 from slivka.utils import LimitedSizeDict
+from . import wrapper
+from .jobtable import JobTable
+from .journal import Journal
 
 try:
     get_running_loop = asyncio.get_running_loop
@@ -26,9 +33,19 @@ def _job_id_factory():
     return int(time.time()) << 32 | (next(_id_counter) & 0xffffffff)
 
 
+# environments shared by the jobs, usually identical for each runner
+_environments = LimitedSizeDict(1000)
+
+
 def _job_env_converter(env):
+    env = dict(env)
     env.setdefault("PATH", os.getenv("PATH"))
-    return env
+    key = frozenset(env.items())
+    try:
+        return _environments[key]
+    except KeyError:
+        _environments[key] = env
+        return env
 
 
 @attr.s(slots=True)
@@ -38,67 +55,247 @@ class Job:
     cwd = attr.ib(type=str)
     env = attr.ib(default={}, type=dict, converter=_job_env_converter, repr=False)
     state = attr.ib(default=JobStatus.QUEUED)
+    priority = attr.ib(default=0, type=int)
+    cpus = attr.ib(default=1, type=int)
+    memory = attr.ib(default=0, type=int)
+    limits = attr.ib(factory=dict, type=dict, repr=False)
     return_code = attr.ib(default=255, type=int, init=False)
+    usage = attr.ib(default=None, type=dict, init=False, repr=False)
     worker = attr.ib(default=None, type=asyncio.Task, init=False, repr=False)
 
 
 _null_job = Job('', '', state=JobStatus.UNKNOWN)
 
 
+def _zmq_address(address):
+    if address.startswith('unix://'):
+        return str.replace(address, 'unix', 'ipc', 1)
+    else:
+        return 'tcp://' + address
+
+
+class JobHeap:
+    """Queue of the jobs ordered by priority and submission order.
+
+    Jobs with higher priority come first; jobs of the same priority
+    in the order they were pushed. Removed jobs are only marked as
+    such and skipped when they reach the top of the heap; the heap is
+    rebuilt once the removed entries outnumber the remaining ones.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._entries = {}  # type: Dict[int, list]
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def push(self, job: Job):
+        entry = [(-job.priority, next(self._counter)), job]
+        self._entries[job.id] = entry
+        heapq.heappush(self._heap, entry)
+
+    def pop(self):
+        """Remove and return the entry of the next job, or None if empty.
+
+        The entry can be put back with :meth:`push_entry` preserving
+        the original position of the job.
+        """
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            job = entry[1]
+            if job is None:
+                continue
+            del self._entries[job.id]
+            if job.state == JobStatus.QUEUED:
+                return entry
+        return None
+
+    def push_entry(self, entry):
+        self._entries[entry[1].id] = entry
+        heapq.heappush(self._heap, entry)
+
+    def remove(self, job: Job):
+        entry = self._entries.pop(job.id, None)
+        if entry is None:
+            return
+        entry[1] = None
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [entry for entry in self._heap if entry[1] is not None]
+            heapq.heapify(self._heap)
+
+
 class LocalQueue:
     zmq_ctx = aiozmq.Context()
 
-    def __init__(self, address, workers=1, secret=None):
+    def __init__(self, address, workers=1, secret=None, journal=None,
+                 cpus=None, memory=None, cgroup=None, notify_address=None):
+        """
+        :param address: address the server binds to
+        :param workers: number of single-cpu jobs run at once
+            if ``cpus`` is not given
+        :param secret: shared secret
+        :param journal: path to the journal file
+        :param cpus: number of cpus shared by the running jobs
+        :param memory: megabytes of memory shared by the running jobs,
+            unlimited if not given
+        :param cgroup: path to the cgroup v2 directory delegated to
+            the queue where the job cgroups are created
+        :param notify_address: address the job state changes are
+            published at, not published if not given
+        """
         self.logger = logging.getLogger(__name__)
-        if address.startswith('unix://'):
-            self.address = str.replace(address, 'unix', 'ipc', 1)
-        else:
-            self.address = 'tcp://' + address
+        self.address = _zmq_address(address)
+        self.notify_address = (_zmq_address(notify_address)
+                               if notify_address else None)
+        self._publisher = None
         self.num_workers = workers
+        self.cpus = cpus or workers
+        self.memory = memory
+        self.free_cpus = self.cpus
+        self.free_memory = memory
+        # seconds the first waiting job may be overtaken by smaller ones
+        self.backfill_timeout = 60
+        # number of waiting jobs overtaken at most in one pass
+        self.backfill_window = 100
+        # seconds the terminated jobs have to exit before being killed
+        self.kill_grace = 5.0
+        self._blocked = None
+        self.cgroup = cgroup
         self.secret = secret
         if not secret:
             self.logger.warning('No secret used.')
-        self.queue = asyncio.Queue()
+        self.queue = JobHeap()
+        self._queue_changed = None  # type: Optional[asyncio.Event]
         self.workers = set()
-        self.jobs = LimitedSizeDict(1000000)  # type: Dict[int, Job]
+        self.jobs = JobTable(max_finished=1000000)
+        self._handlers = set()
+        self.journal = Journal(journal) if journal else None
+        self.compaction_interval = 60
         self._main_coro = None
 
+    def _set_state(self, job, state):
+        job.state = state
+        if self.journal is not None:
+            self.journal.record_state(job)
+        if self._publisher is not None:
+            self._publish(job)
+        if state.is_finished():
+            self.jobs.finish(job)
+
+    def _publish(self, job):
+        # PUB sockets drop the messages instead of blocking
+        self._publisher.send_multipart([b'state', json.dumps({
+            'id': job.id, 'state': job.state, 'returncode': job.return_code
+        }).encode()])
+
+    def _create_cgroup(self, job):
+        """Create the cgroup limiting the memory and cpus of the job.
+
+        :return: path to the cgroup or None if it can't be created
+        """
+        path = os.path.join(self.cgroup, 'job-%d' % job.id)
+        try:
+            os.mkdir(path)
+            if job.limits.get('memory'):
+                with open(os.path.join(path, 'memory.max'), 'w') as f:
+                    f.write(str(job.limits['memory'] * 1024 * 1024))
+            with open(os.path.join(path, 'cpu.max'), 'w') as f:
+                f.write('%d 100000' % (job.cpus * 100000))
+        except OSError:
+            self.logger.warning(
+                "Cgroup for %r could not be created", job, exc_info=True)
+            self._remove_cgroup(path)
+            return None
+        return path
+
+    def _remove_cgroup(self, path, usage=None):
+        try:
+            if usage is not None:
+                with open(os.path.join(path, 'memory.peak')) as f:
+                    usage['memory_peak'] = int(f.read())
+        except OSError:
+            pass
+        try:
+            # terminate the processes left behind by the job
+            if os.path.exists(os.path.join(path, 'cgroup.kill')):
+                with open(os.path.join(path, 'cgroup.kill'), 'w') as f:
+                    f.write('1')
+            os.rmdir(path)
+        except OSError:
+            if os.path.exists(path):
+                self.logger.warning("Cgroup %s could not be removed", path)
+
+    def _wrapper_args(self, job, usage_fd, cgroup):
+        args = [sys.executable, wrapper.__file__, '--usage-fd', str(usage_fd),
+                '--kill-grace', str(self.kill_grace)]
+        if job.limits.get('cpu_time'):
+            args += ['--cpu-time', str(job.limits['cpu_time'])]
+        if cgroup is not None:
+            args += ['--cgroup', cgroup]
+        elif job.limits.get('memory'):
+            args += ['--memory', str(job.limits['memory'])]
+        args.append(job.cmd)
+        return args
+
     async def _worker(self, job):
         self.logger.info('executing %r', job)
-        job.state = JobStatus.RUNNING
+        self._set_state(job, JobStatus.RUNNING)
+        cgroup = self._create_cgroup(job) if self.cgroup else None
+        read_fd, usage_write_fd = os.pipe()
+        usage_fd = open(read_fd, 'r')
         try:
             stdout = open(os.path.join(job.cwd, 'stdout'), 'wb')
             stderr = open(os.path.join(job.cwd, 'stderr'), 'wb')
-            proc = await asyncio.create_subprocess_shell(
-                job.cmd,
+            proc = await asyncio.create_subprocess_exec(
+                *self._wrapper_args(job, usage_write_fd, cgroup),
                 stdout=stdout,
                 stderr=stderr,
                 cwd=job.cwd,
-                env=job.env
+                env=job.env,
+                pass_fds=(usage_write_fd,)
             )
         except OSError:
             self.logger.exception(
                 "System error occurred when starting the job %r", job)
-            job.state = JobStatus.ERROR
+            self._set_state(job, JobStatus.ERROR)
+            usage_fd.close()
+            if cgroup is not None:
+                self._remove_cgroup(cgroup)
             raise
         except asyncio.CancelledError:
-            job.state = JobStatus.INTERRUPTED
+            self._set_state(job, JobStatus.INTERRUPTED)
+            usage_fd.close()
+            if cgroup is not None:
+                self._remove_cgroup(cgroup)
             return
+        finally:
+            os.close(usage_write_fd)
         try:
-            return_code = await proc.wait()
+            try:
+                return_code = await asyncio.wait_for(
+                    proc.wait(), job.limits.get('wall_time'))
+            except asyncio.TimeoutError:
+                self.logger.info('%r exceeded the wall time limit', job)
+                job.return_code = await self._terminate(proc)
+                self._record_usage(job, usage_fd, cgroup)
+                self._set_state(job, JobStatus.INTERRUPTED)
+                return
             job.return_code = return_code
-            job.state = (
+            self._record_usage(job, usage_fd, cgroup)
+            self._set_state(job, (
                 JobStatus.COMPLETED if return_code == 0 else
                 JobStatus.ERROR if return_code == 127 else
                 JobStatus.FAILED if return_code > 0 else
                 JobStatus.INTERRUPTED
-            )
+            ))
             self.logger.info('%r completed with status %d', job, return_code)
         except asyncio.CancelledError:
             self.logger.info('terminating a running process')
-            proc.terminate()
-            job.return_code = await proc.wait()
-            job.state = JobStatus.INTERRUPTED
+            job.return_code = await self._terminate(proc)
+            self._record_usage(job, usage_fd, cgroup)
+            self._set_state(job, JobStatus.INTERRUPTED)
         finally:
             try:
                 proc.kill()
@@ -106,60 +303,195 @@ class LocalQueue:
                 pass
             stdout.close()
             stderr.close()
+            if not usage_fd.closed:
+                usage_fd.close()
+                if cgroup is not None:
+                    self._remove_cgroup(cgroup)
 
-    async def _consumer(self, loop):
-        lock = asyncio.BoundedSemaphore(self.num_workers)
-
-        def worker_cleanup(job: Job, fut: asyncio.Future):
-            lock.release()
-            job.worker = None
-            self.workers.remove(fut)
-            if fut.exception() is not None:
-                self.logger.error(
-                    "An exception occurred when running a job %r",
-                    fut.exception()
-                )
+    async def _terminate(self, proc):
+        """Terminate the job and wait for it to exit.
+
+        The wrapper kills the job if it does not exit within the
+        ``kill_grace`` period; the wrapper itself is killed if it
+        does not exit shortly after.
+
+        :return: exit status of the wrapper
+        """
+        with contextlib.suppress(ProcessLookupError):
+            proc.terminate()
+        try:
+            return await asyncio.wait_for(proc.wait(), self.kill_grace + 1)
+        except asyncio.TimeoutError:
+            self.logger.warning('killing the job wrapper %d', proc.pid)
+            with contextlib.suppress(ProcessLookupError):
+                proc.kill()
+            return await proc.wait()
+
+    def _record_usage(self, job, usage_fd, cgroup):
+        """Read the resource usage reported by the wrapper."""
+        with usage_fd:
+            data = usage_fd.read()
+        try:
+            usage = json.loads(data)
+        except ValueError:
+            # wrapper killed before reporting, e.g. by the memory limit
+            usage = {}
+        if cgroup is not None:
+            self._remove_cgroup(cgroup, usage)
+        job.usage = usage
+
+    def _fits(self, job) -> bool:
+        return (job.cpus <= self.free_cpus and
+                (self.memory is None or job.memory <= self.free_memory))
+
+    def _start_pending(self, loop):
+        """Start the queued jobs that fit in the free resources.
+
+        Jobs are started in the order of priority and submission.
+        While the first job waits for the resources, the following
+        jobs which fit in the remaining resources are started ahead
+        of it (backfilled) until it waits longer than
+        ``backfill_timeout``; afterwards the resources are saved for
+        the waiting job.
+        """
+        skipped = []
+        blocked = None
+        try:
+            while len(skipped) < self.backfill_window:
+                entry = self.queue.pop()
+                if entry is None:
+                    break
+                job = entry[1]
+                if self._fits(job):
+                    self._start(job, loop)
+                    continue
+                skipped.append(entry)
+                if blocked is None:
+                    blocked = job
+                    if self._blocked is None or self._blocked[0] is not job:
+                        self._blocked = (job, loop.time())
+                    elif loop.time() - self._blocked[1] > self.backfill_timeout:
+                        break
+        finally:
+            for entry in skipped:
+                self.queue.push_entry(entry)
+        if blocked is None:
+            self._blocked = None
+
+    def _start(self, job, loop):
+        assert job.id in self.jobs
+        self.free_cpus -= job.cpus
+        if self.memory is not None:
+            self.free_memory -= job.memory
+        worker = loop.create_task(self._worker(job))  # type: asyncio.Task
+        self.workers.add(worker)
+        job.worker = worker
+        worker.add_done_callback(partial(self._worker_cleanup, job))
+
+    def _worker_cleanup(self, job: Job, fut: asyncio.Future):
+        self.free_cpus += job.cpus
+        if self.memory is not None:
+            self.free_memory += job.memory
+        job.worker = None
+        self.workers.remove(fut)
+        # wake up the consumer to use the released resources
+        self._wake_consumer()
+        if not fut.cancelled() and fut.exception() is not None:
+            self.logger.error(
+                "An exception occurred when running a job %r",
+                fut.exception()
+            )
+
+    def _wake_consumer(self):
+        if self._queue_changed is not None:
+            self._queue_changed.set()
 
+    def _push(self, job):
+        self.queue.push(job)
+        self._wake_consumer()
+
+    async def _consumer(self, loop):
+        # the event is bound to the running loop when created
+        self._queue_changed = asyncio.Event()
+        self._start_pending(loop)
         while True:
-            await lock.acquire()
-            job = await self.queue.get()
-            if job.state != JobStatus.QUEUED:
-                lock.release()
-                continue
-            assert job.id in self.jobs
-            worker = loop.create_task(self._worker(job))  # type: asyncio.Task
-            self.workers.add(worker)
-            job.worker = worker
-            worker.add_done_callback(partial(worker_cleanup, job))
+            await self._queue_changed.wait()
+            self._queue_changed.clear()
+            self._start_pending(loop)
 
-    async def serve_forever(self):
+    async def serve_forever(self, address=None):
+        """Receive the requests from multiple clients concurrently.
+
+        The ROUTER socket prepends the client identity to each
+        message and routes the reply back to the client based on
+        the same envelope, so any number of REQ or DEALER clients
+        may have requests in flight at once. Each request is handled
+        in its own task and DEALER clients pair the responses with
+        their requests using the ``request_id`` field which is
+        sent back unchanged.
+
+        :param address: zmq address to bind to instead of the queue address
+        """
+        address = address or self.address
         self.logger.info('starting server')
-        socket = self.zmq_ctx.socket(zmq.REP)
-        socket.bind(self.address)
-        self.logger.info('REP socket bound to %s', self.address)
-        while True:
-            message = await socket.recv_json()
-            try:
-                if message['method'] == 'GET':
-                    response = self.do_GET(message)
-                elif message['method'] == 'POST':
-                    response = self.do_POST(message)
-                elif message['method'] == 'CANCEL':
-                    response = self.do_CANCEL(message)
-                elif message['method'] == 'DELETE':
-                    response = self.do_DELETE(message)
-                else:
-                    response = {
-                        'ok': False,
-                        'error': 'invalid-method'
-                    }
-            except Exception:
-                self.logger.exception("Error during message processing")
+        socket = self.zmq_ctx.socket(zmq.ROUTER)
+        socket.bind(address)
+        self.logger.info('ROUTER socket bound to %s', address)
+        loop = get_running_loop()
+        try:
+            while True:
+                frames = await socket.recv_multipart()
+                handler = loop.create_task(self._respond(socket, frames))
+                self._handlers.add(handler)
+                handler.add_done_callback(self._handlers.discard)
+        finally:
+            socket.close(0)
+
+    async def _respond(self, socket, frames):
+        # all frames up to the payload form the routing envelope
+        envelope, payload = frames[:-1], frames[-1]
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            self.logger.error("Malformed message received")
+            message = {}
+            response = {'ok': False, 'error': 'invalid-message'}
+        else:
+            response = self.handle_message(message)
+        if isinstance(message, dict) and 'request_id' in message:
+            response['request_id'] = message['request_id']
+        await socket.send_multipart([*envelope, json.dumps(response).encode()])
+
+    def handle_message(self, message):
+        try:
+            if message['method'] == 'GET':
+                response = self.do_GET(message)
+            elif message['method'] == 'POST':
+                response = self.do_POST(message)
+            elif message['method'] == 'CANCEL':
+                response = self.do_CANCEL(message)
+            elif message['method'] == 'DELETE':
+                response = self.do_DELETE(message)
+            elif message['method'] == 'BATCH_GET':
+                response = self.do_BATCH_GET(message)
+            elif message['method'] == 'BATCH_POST':
+                response = self.do_BATCH_POST(message)
+            elif message['method'] == 'BATCH_CANCEL':
+                response = self.do_BATCH_CANCEL(message)
+            elif message['method'] == 'BATCH_DELETE':
+                response = self.do_BATCH_DELETE(message)
+            else:
                 response = {
                     'ok': False,
-                    'error': 'invalid-message'
+                    'error': 'invalid-method'
                 }
-            socket.send_json(response)
+        except Exception:
+            self.logger.exception("Error during message processing")
+            response = {
+                'ok': False,
+                'error': 'invalid-message'
+            }
+        return response
 
     def do_GET(self, msg):
         job = self.jobs.get(msg['id'], _null_job)
@@ -167,18 +499,39 @@ class LocalQueue:
             'ok': True,
             'id': job.id,
             'state': job.state,
-            'returncode': job.return_code
+            'returncode': job.return_code,
+            'usage': job.usage
         }
 
-    def do_POST(self, msg):
+    def _enqueue(self, msg) -> Job:
+        cpus = msg.get('cpus', 1)
+        memory = msg.get('memory', 0)
+        priority = msg.get('priority', 0)
+        if cpus > self.cpus or (self.memory is not None and memory > self.memory):
+            self.logger.warning(
+                'job requested %d cpus and %d MB of memory exceeding '
+                'the queue capacity', cpus, memory)
+            cpus = min(cpus, self.cpus)
+            if self.memory is not None:
+                memory = min(memory, self.memory)
         job = Job(
             cmd=msg['cmd'],
             cwd=msg['cwd'],
-            env=msg.get('env', {})
+            env=msg.get('env', {}),
+            priority=priority,
+            cpus=cpus,
+            memory=memory,
+            limits=msg.get('limits') or {}
         )
         self.jobs[job.id] = job
-        get_running_loop().call_soon(self.queue.put_nowait, job)
+        if self.journal is not None:
+            self.journal.record_submit(job)
+        get_running_loop().call_soon(self._push, job)
         self.logger.info('queued %r for execution', job)
+        return job
+
+    def do_POST(self, msg):
+        job = self._enqueue(msg)
         return {
             'ok': True,
             'id': job.id,
@@ -189,7 +542,8 @@ class LocalQueue:
     def do_CANCEL(self, msg):
         job = self.jobs.get(msg['id'], _null_job)
         if job.state == JobStatus.QUEUED:
-            job.state = JobStatus.INTERRUPTED
+            self.queue.remove(job)
+            self._set_state(job, JobStatus.INTERRUPTED)
         if job.worker is not None:
             job.worker.cancel()
         return {
@@ -201,16 +555,98 @@ class LocalQueue:
             job = self.jobs[msg['id']]
             job.state = JobStatus.DELETED
             del self.jobs[job.id]
+            if self.journal is not None:
+                self.journal.record_delete(job.id)
         except KeyError:
             pass
         return {
             'ok': True
         }
 
+    def do_BATCH_GET(self, msg):
+        jobs = (self.jobs.get(id, _null_job) for id in msg['ids'])
+        return {
+            'ok': True,
+            'jobs': [
+                {'id': job.id, 'state': job.state,
+                 'returncode': job.return_code, 'usage': job.usage}
+                for job in jobs
+            ]
+        }
+
+    def do_BATCH_POST(self, msg):
+        jobs = [self._enqueue(job) for job in msg['jobs']]
+        return {
+            'ok': True,
+            'jobs': [
+                {'id': job.id, 'state': job.state, 'returncode': None}
+                for job in jobs
+            ]
+        }
+
+    def do_BATCH_CANCEL(self, msg):
+        for id in msg['ids']:
+            self.do_CANCEL({'id': id})
+        return {
+            'ok': True
+        }
+
+    def do_BATCH_DELETE(self, msg):
+        for id in msg['ids']:
+            self.do_DELETE({'id': id})
+        return {
+            'ok': True
+        }
+
+    def restore(self):
+        """Load the jobs from the journal and queue the unfinished ones.
+
+        Jobs which were running when the queue stopped lost their
+        processes and are marked as interrupted.
+        """
+        records = self.journal.replay()
+        for job_id, record in records.items():
+            state = JobStatus(record['state'])
+            if state.is_finished():
+                return_code = record.get('returncode')
+                self.jobs.add_finished(
+                    job_id, state, 255 if return_code is None else return_code,
+                    record.get('usage'))
+                continue
+            job = Job(cmd=record['cmd'], cwd=record['cwd'],
+                      env=record['env'], state=state,
+                      priority=record.get('priority', 0),
+                      cpus=record.get('cpus', 1),
+                      memory=record.get('memory', 0),
+                      limits=record.get('limits') or {})
+            job.id = job_id
+            if record.get('returncode') is not None:
+                job.return_code = record['returncode']
+            job.usage = record.get('usage')
+            self.jobs[job.id] = job
+            if job.state == JobStatus.RUNNING:
+                job.state = JobStatus.INTERRUPTED
+                self.jobs.finish(job)
+            else:
+                self._push(job)
+        self.journal.compact(list(self.jobs.values()))
+        self.journal.open()
+        self.logger.info('restored %d jobs from %s',
+                         len(records), self.journal.path)
+
+    async def _compactor(self):
+        while True:
+            await asyncio.sleep(self.compaction_interval)
+            if self.journal.needs_compaction(len(self.jobs)):
+                await self.journal.compact_async(
+                    list(self.jobs.values()), get_running_loop())
+
     def stop(self):
         self.logger.info("Stopping.")
         for worker in self.workers:
             worker.cancel()
+        for handler in self._handlers:
+            handler.cancel()
         self._main_coro.cancel()
 
     def close(self, loop=None):
@@ -218,6 +654,11 @@ class LocalQueue:
         loop = loop or asyncio.get_event_loop()
         loop.run_until_complete(self.wait_closed())
         self.workers.clear()
+        if self.journal is not None:
+            self.journal.close()
+        if self._publisher is not None:
+            self._publisher.close(0)
+            self._publisher = None
         self._main_coro = None
         self.logger.info('Closed.')
 
@@ -227,13 +668,25 @@ class LocalQueue:
             return_exceptions=True
         )
 
+    def _main_tasks(self, loop):
+        """Return the coroutines running for the lifetime of the queue."""
+        tasks = [self.serve_forever(), self._consumer(loop)]
+        if self.journal is not None:
+            tasks.append(self._compactor())
+        return tasks
+
     def run(self, loop=None):
         if self._main_coro is not None:
             raise RuntimeError("Scheduler is already running.")
         loop = loop or asyncio.get_event_loop()
-        server = loop.create_task(self.serve_forever())
-        consumer = loop.create_task(self._consumer(loop))
-        self._main_coro = asyncio.gather(server, consumer)
+        if self.journal is not None:
+            self.restore()
+        if self.notify_address is not None:
+            self._publisher = self.zmq_ctx.socket(zmq.PUB)
+            self._publisher.bind(self.notify_address)
+            self.logger.info('PUB socket bound to %s', self.notify_address)
+        tasks = [loop.create_task(coro) for coro in self._main_tasks(loop)]
+        self._main_coro = asyncio.gather(*tasks)
         try:
             loop.run_until_complete(self._main_coro)
         except KeyboardInterrupt:
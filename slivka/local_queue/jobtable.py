@@ -0,0 +1,141 @@
+import math
+import struct
+from typing import Dict, Iterator, Optional
+
+import attr
+
+from slivka import JobStatus
+
+
+@attr.s(slots=True)
+class FinishedJob:
+    """Outcome of a finished job retrieved from the :class:`JobTable`."""
+    id = attr.ib(type=int)
+    state = attr.ib(type=JobStatus)
+    return_code = attr.ib(type=int)
+    usage = attr.ib(default=None, type=dict)
+    worker = None
+
+
+class JobTable:
+    """Jobs of the local queue indexed by their ids.
+
+    Queued and running jobs are kept as complete objects. Once the job
+    finishes, only its state, return code and resource usage are
+    packed into a fixed-size record and the job object is released
+    together with its command and environment. Up to ``max_finished``
+    records are kept; the oldest ones are overwritten afterwards.
+    """
+
+    # id, state, usage flags, return code,
+    # wall time, cpu time, max rss, memory peak
+    _record = struct.Struct('<qBBi2d2q')
+    _float_fields = ('wall_time', 'cpu_time')
+    _int_fields = ('max_rss', 'memory_peak')
+    _HAS_USAGE = 0x01
+    _DELETED = -1
+
+    def __init__(self, max_finished=1000000):
+        self.max_finished = max_finished
+        self._active = {}  # type: Dict[int, object]
+        self._records = bytearray()
+        self._index = {}  # type: Dict[int, int]
+        self._next_slot = 0
+
+    def __len__(self):
+        return len(self._active) + len(self._index)
+
+    def __contains__(self, job_id):
+        return job_id in self._active or job_id in self._index
+
+    def __getitem__(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        return job
+
+    def __setitem__(self, job_id, job):
+        if job_id in self._index:
+            self._discard_record(job_id)
+        self._active[job_id] = job
+
+    def __delitem__(self, job_id):
+        if self._active.pop(job_id, None) is None:
+            if job_id not in self._index:
+                raise KeyError(job_id)
+            self._discard_record(job_id)
+
+    def get(self, job_id, default=None):
+        job = self._active.get(job_id)
+        if job is not None:
+            return job
+        slot = self._index.get(job_id)
+        if slot is None:
+            return default
+        return self._unpack(slot)
+
+    def pop(self, job_id, default=None):
+        job = self.get(job_id, default)
+        if job_id in self:
+            del self[job_id]
+        return job
+
+    def active(self) -> Iterator:
+        """Iterate over the queued and running jobs."""
+        return iter(self._active.values())
+
+    def values(self) -> Iterator:
+        yield from self._active.values()
+        for slot in self._index.values():
+            yield self._unpack(slot)
+
+    def finish(self, job):
+        """Replace the finished job with its compact record.
+
+        Jobs which are no longer in the table, e.g. deleted while
+        running, are not added back.
+        """
+        if self._active.pop(job.id, None) is not None:
+            self.add_finished(job.id, job.state, job.return_code, job.usage)
+
+    def add_finished(self, job_id, state, return_code, usage=None):
+        self._active.pop(job_id, None)
+        if job_id in self._index:
+            self._discard_record(job_id)
+        slot = self._next_slot
+        self._next_slot = (slot + 1) % self.max_finished
+        offset = slot * self._record.size
+        if offset == len(self._records):
+            self._records.extend(bytes(self._record.size))
+        else:
+            old_id = self._record.unpack_from(self._records, offset)[0]
+            if self._index.get(old_id) == slot:
+                del self._index[old_id]
+        flags = self._HAS_USAGE if usage is not None else 0
+        usage = usage or {}
+        self._record.pack_into(
+            self._records, offset, job_id, state, flags, return_code,
+            *(float(usage.get(key, math.nan)) for key in self._float_fields),
+            *(int(usage.get(key, -1)) for key in self._int_fields)
+        )
+        self._index[job_id] = slot
+
+    def _discard_record(self, job_id):
+        slot = self._index.pop(job_id)
+        struct.pack_into('<q', self._records, slot * self._record.size,
+                         self._DELETED)
+
+    def _unpack(self, slot) -> FinishedJob:
+        (job_id, state, flags, return_code,
+         *values) = self._record.unpack_from(
+            self._records, slot * self._record.size)
+        usage = None  # type: Optional[dict]
+        if flags & self._HAS_USAGE:
+            usage = {}
+            for key, value in zip(self._float_fields, values[:2]):
+                if not math.isnan(value):
+                    usage[key] = value
+            for key, value in zip(self._int_fields, values[2:]):
+                if value >= 0:
+                    usage[key] = value
+        return FinishedJob(job_id, JobStatus(state), return_code, usage)
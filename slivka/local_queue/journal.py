@@ -0,0 +1,160 @@
+import json
+import logging
+import os
+from typing import Dict, List, Optional
+
+log = logging.getLogger(__name__)
+
+
+class Journal:
+    """Append-only log of the local queue jobs and their state changes.
+
+    Every submission, state change and deletion is appended to the
+    file as a single line of JSON, so the jobs can be restored by
+    replaying the records after the queue is restarted. A record
+    partially written when the process was killed is ignored.
+    The file is periodically compacted by replacing it with the
+    snapshot of the current jobs.
+    """
+
+    def __init__(self, path, compaction_ratio=4, min_compaction_size=10000):
+        """
+        :param path: path to the journal file
+        :param compaction_ratio: compact when the number of records
+            exceeds the number of jobs that many times
+        :param min_compaction_size: do not compact journals smaller
+            than that many records
+        """
+        self.path = path
+        self.compaction_ratio = compaction_ratio
+        self.min_compaction_size = min_compaction_size
+        self._file = None
+        self._records = 0
+        # records appended while compacting in the background
+        self._pending = None  # type: Optional[List[dict]]
+
+    def replay(self) -> Dict[int, dict]:
+        """Read the journal and return the jobs keyed by their ids.
+
+        Each job is a dictionary of the most recent values of
+        ``cmd``, ``cwd``, ``env``, ``priority``, ``cpus``, ``memory``,
+        ``limits``, ``state``, ``returncode`` and ``usage``. Jobs which
+        had finished before the journal was compacted only contain
+        ``state``, ``returncode`` and ``usage``.
+        """
+        jobs = {}
+        self._records = 0
+        if not os.path.exists(self.path):
+            return jobs
+        with open(self.path, 'r') as fp:
+            for num, line in enumerate(fp, 1):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    log.warning("Skipping corrupted journal record %s:%d",
+                                self.path, num)
+                    continue
+                self._records += 1
+                op = record.pop('op')
+                job_id = record.pop('id')
+                if op == 'submit':
+                    jobs[job_id] = record
+                elif op == 'state' and job_id in jobs:
+                    jobs[job_id].update(record)
+                elif op == 'delete':
+                    jobs.pop(job_id, None)
+        return jobs
+
+    def open(self):
+        self._file = open(self.path, 'a')
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _append(self, record):
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        self._records += 1
+        if self._pending is not None:
+            self._pending.append(record)
+
+    @staticmethod
+    def _submit_record(job):
+        if job.state.is_finished():
+            # only the outcome of the finished jobs is kept
+            return {
+                'op': 'submit', 'id': job.id, 'state': job.state,
+                'returncode': job.return_code, 'usage': job.usage
+            }
+        return {
+            'op': 'submit', 'id': job.id, 'cmd': job.cmd, 'cwd': job.cwd,
+            'env': job.env, 'priority': job.priority,
+            'cpus': job.cpus, 'memory': job.memory,
+            'limits': job.limits, 'state': job.state,
+            'returncode': job.return_code, 'usage': job.usage
+        }
+
+    def record_submit(self, job):
+        self._append(self._submit_record(job))
+
+    def record_state(self, job):
+        self._append({
+            'op': 'state', 'id': job.id, 'state': job.state,
+            'returncode': job.return_code, 'usage': job.usage
+        })
+
+    def record_delete(self, job_id):
+        self._append({'op': 'delete', 'id': job_id})
+
+    def needs_compaction(self, num_jobs) -> bool:
+        return (self._records > self.min_compaction_size and
+                self._records > num_jobs * self.compaction_ratio)
+
+    def compact(self, jobs):
+        """Replace the journal with the submission records of the jobs."""
+        tmp_path = self.path + '.tmp'
+        records = [self._submit_record(job) for job in jobs]
+        self._write_snapshot(tmp_path, records)
+        self._replace(tmp_path, len(records))
+
+    async def compact_async(self, jobs, loop):
+        """Compact the journal writing the snapshot in the executor.
+
+        The records of the jobs are taken at once, then written to
+        a temporary file and synced without blocking the loop. The
+        records appended in the meantime are added to the new file
+        before it replaces the journal.
+        """
+        tmp_path = self.path + '.tmp'
+        records = [self._submit_record(job) for job in jobs]
+        self._pending = []
+        try:
+            await loop.run_in_executor(
+                None, self._write_snapshot, tmp_path, records)
+            pending = self._pending
+        finally:
+            self._pending = None
+        with open(tmp_path, 'a') as fp:
+            for record in pending:
+                fp.write(json.dumps(record) + '\n')
+        self._replace(tmp_path, len(records) + len(pending))
+
+    @staticmethod
+    def _write_snapshot(path, records):
+        with open(path, 'w') as fp:
+            for record in records:
+                fp.write(json.dumps(record) + '\n')
+            fp.flush()
+            os.fsync(fp.fileno())
+
+    def _replace(self, tmp_path, num_records):
+        reopen = self._file is not None
+        self.close()
+        os.replace(tmp_path, self.path)
+        self._records = num_records
+        if reopen:
+            self.open()
+        log.info("Compacted journal %s to %d records",
+                 self.path, num_records)
@@ -0,0 +1,89 @@
+"""Runs a local queue job under resource limits and reports its usage.
+
+The queue starts this script by its path rather than as a module so
+it does not depend on slivka being importable in the job environment;
+therefore, it must only use the standard library.
+
+The command runs in its own process group so the signals reach all
+the processes it started. The group is killed if it does not exit
+within the grace period after being terminated and any processes
+left behind are killed once the command exits.
+"""
+import argparse
+import json
+import os
+import resource
+import signal
+import subprocess
+import sys
+import time
+
+
+def _set_limits(cpu_time, memory):
+    if cpu_time:
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_time, cpu_time + 5))
+    if memory:
+        limit = memory * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _kill_group(pgid, signum):
+    try:
+        os.killpg(pgid, signum)
+    except ProcessLookupError:
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--usage-fd', type=int, required=True)
+    parser.add_argument('--cpu-time', type=int, default=None)
+    parser.add_argument('--memory', type=int, default=None)
+    parser.add_argument('--cgroup', default=None)
+    parser.add_argument('--kill-grace', type=float, default=5.0)
+    parser.add_argument('cmd')
+    args = parser.parse_args(argv)
+
+    if args.cgroup:
+        # children inherit the cgroup of the wrapper
+        with open(os.path.join(args.cgroup, 'cgroup.procs'), 'w') as f:
+            f.write(str(os.getpid()))
+    _set_limits(args.cpu_time, args.memory)
+    start = time.monotonic()
+    proc = subprocess.Popen(args.cmd, shell=True, start_new_session=True)
+
+    def forward(signum, _frame):
+        _kill_group(proc.pid, signum)
+        if signal.getitimer(signal.ITIMER_REAL)[0] == 0:
+            signal.setitimer(signal.ITIMER_REAL, args.kill_grace)
+
+    def kill(_signum, _frame):
+        _kill_group(proc.pid, signal.SIGKILL)
+    signal.signal(signal.SIGALRM, kill)
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(signum, forward)
+
+    while True:
+        try:
+            _, status, rusage = os.wait4(proc.pid, 0)
+            break
+        except InterruptedError:
+            continue
+    signal.setitimer(signal.ITIMER_REAL, 0)
+    _kill_group(proc.pid, signal.SIGKILL)
+    usage = {
+        'wall_time': time.monotonic() - start,
+        'cpu_time': rusage.ru_utime + rusage.ru_stime,
+        'max_rss': rusage.ru_maxrss  # kilobytes on linux
+    }
+    with os.fdopen(args.usage_fd, 'w') as f:
+        json.dump(usage, f)
+    if os.WIFSIGNALED(status):
+        signum = os.WTERMSIG(status)
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+    return os.WEXITSTATUS(status)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,2 +1,3 @@
-from .core import Scheduler, Limiter, DefaultLimiter
+from .core import (Scheduler, Limiter, DefaultLimiter, OrderingPolicy,
+                   FifoOrdering, PriorityOrdering, FairShareOrdering)
 from .runners.runner import Runner, RunInfo
@@ -1,25 +1,33 @@
+import itertools
 import logging
+import math
+import socket
 import threading
-from collections import defaultdict, namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from collections import defaultdict, namedtuple, OrderedDict, Counter
+from datetime import datetime, timedelta
 from functools import partial
 from importlib import import_module
+from itertools import groupby
+from operator import itemgetter
 from typing import (Iterable, Tuple, Dict, List, Any, Type, Union, DefaultDict,
-                    Sequence)
+                    Sequence, Optional)
 
-from pymongo import UpdateOne
+import pymongo
+from pymongo import UpdateOne, UpdateMany
+from pymongo.errors import OperationFailure, PyMongoError
 
 import slivka.db
 from slivka.db.documents import JobRequest, JobMetadata, CancelRequest, ServiceState
 from slivka.db.helpers import insert_many, replace_one
+from slivka.scheduler.metrics import Metrics, MetricsServer
 from slivka.scheduler.runners.runner import RunnerID, Runner
-from slivka.utils import JobStatus, BackoffCounter
+from slivka.utils import JobStatus, BackoffCounter, cached_property
 
 
-def _fetch_pending_requests(database) -> Iterable[JobRequest]:
-    requests = (JobRequest
-                .collection(database)
-                .find({'status': JobStatus.PENDING}))
-    return (JobRequest(**kwargs) for kwargs in requests)
+# fields required to submit the request
+_request_projection = ['service', 'inputs', 'uuid', 'timestamp',
+                       'status', 'runner', 'priority', 'client']
 
 
 def _fetch_cancel_requests(database) -> List[str]:
@@ -42,8 +50,36 @@ class Scheduler:
     def __init__(self):
         self.log = logging.getLogger(__name__)
         self._finished = threading.Event()
+        self._wakeup = threading.Event()
+        self.poll_interval = 1
+        self.monitor_interval = 1
+        self.watch_changes = False
+        self.pipelined = False
+        self._stages = {}  # type: Dict[Any, IntervalThread]
+        self.submission_workers = 8
+        self.submission_timeout = 1
+        self.max_batch_size = 1000
+        self.min_check_interval = 1
+        self.max_check_interval = 300
+        self.check_backoff_factor = 2
+        self.submission_limits = {}  # type: Dict[RunnerID, int]
+        self._submission_slots = {}  # type: Dict[RunnerID, threading.Semaphore]
+        self._submissions = {}
+        self._submissions_lock = threading.Lock()
+        self.runner_job_limits = {}  # type: Dict[RunnerID, int]
+        self.service_job_limits = {}  # type: Dict[str, int]
+        self._active_jobs = None  # type: Counter
+        # held while the counts and the jobs they are based on change
+        self._active_jobs_lock = threading.RLock()
+        self.instance_id = socket.gethostname()
+        self.lease_duration = 60
+        self.metrics = Metrics()
+        self.metrics_address = None  # type: Optional[Tuple[str, int]]
+        self.metrics_log_interval = 60
+        self.queue_notify_address = None  # type: Optional[str]
         self.runners = {}  # type: Dict[RunnerID, Runner]
         self.limiters = defaultdict(DefaultLimiter)  # type: Dict[str, Limiter]
+        self.orderings = defaultdict(FifoOrdering)  # type: Dict[str, OrderingPolicy]
         self._backoff_counters = defaultdict(
             partial(BackoffCounter, max_tries=10)
         )  # type: DefaultDict[Any, BackoffCounter]
@@ -59,6 +95,11 @@ class Scheduler:
         for counter in self._backoff_counters.values():
             counter.max_tries = limit
 
+    @cached_property
+    def _executor(self):
+        return ThreadPoolExecutor(
+            self.submission_workers, thread_name_prefix='submit')
+
     def add_runner(self, runner: Runner):
         self.runners[runner.id] = runner
 
@@ -67,6 +108,16 @@ class Scheduler:
         if limiter_cp is not None:
             mod, attr = limiter_cp.rsplit('.', 1)
             self.limiters[service_name] = getattr(import_module(mod), attr)()
+        if 'max-concurrent-jobs' in conf_dict:
+            self.service_job_limits[service_name] = \
+                conf_dict['max-concurrent-jobs']
+        ordering_cp = conf_dict.get('ordering')
+        if ordering_cp is not None:
+            if '.' in ordering_cp:
+                mod, attr = ordering_cp.rsplit('.', 1)
+            else:
+                mod, attr = 'slivka.scheduler', ordering_cp
+            self.orderings[service_name] = getattr(import_module(mod), attr)()
         for name, conf in conf_dict['runners'].items():
             if '.' in conf['class']:
                 mod, attr = conf['class'].rsplit('.', 1)
@@ -78,25 +129,266 @@ class Scheduler:
             runner = self.runners[runner_id] = cls(
                 conf_dict, id=RunnerID(service_name, name), **kwargs
             )
+            if 'max-concurrent-submissions' in conf:
+                self.submission_limits[runner_id] = \
+                    conf['max-concurrent-submissions']
+            if 'max-concurrent-jobs' in conf:
+                self.runner_job_limits[runner_id] = conf['max-concurrent-jobs']
             self.log.info('loaded runner for service %s: %r', service_name, runner)
 
+    def count_active_jobs(self):
+        """Count queued and running jobs of each runner in the database.
+
+        The jobs of all the schedulers sharing the database are counted
+        together with the jobs being submitted by this scheduler. The
+        counts are kept up to date by this scheduler in between and
+        refreshed on every heartbeat to include the changes made by
+        the other schedulers.
+        """
+        with self._active_jobs_lock:
+            cursor = JobMetadata.collection(slivka.db.database).aggregate([
+                {'$match': {'status': {'$in': [JobStatus.QUEUED,
+                                               JobStatus.RUNNING]}}},
+                {'$group': {
+                    '_id': {'service_name': '$service',
+                            'runner_name': '$runner'},
+                    'count': {'$sum': 1}
+                }}
+            ])
+            counts = Counter({
+                RunnerID(**item['_id']): item['count'] for item in cursor
+            })
+            with self._submissions_lock:
+                for runner, requests in self._submissions.values():
+                    counts[runner.id] += len(requests)
+            self._active_jobs = counts
+
+    def _change_active_jobs(self, runner_id, count):
+        with self._active_jobs_lock:
+            # not counted yet, the database will be queried when needed
+            if self._active_jobs is not None:
+                self._active_jobs[runner_id] += count
+
+    def get_free_slots(self, runner_id) -> Optional[int]:
+        """Number of jobs the runner can accept or None if unlimited."""
+        if self._active_jobs is None:
+            self.count_active_jobs()
+        runner_limit = self.runner_job_limits.get(runner_id)
+        service_limit = self.service_job_limits.get(runner_id.service_name)
+        with self._active_jobs_lock:
+            limits = []
+            if runner_limit is not None:
+                limits.append(runner_limit - self._active_jobs[runner_id])
+            if service_limit is not None:
+                limits.append(service_limit - sum(
+                    count for key, count in self._active_jobs.items()
+                    if key.service_name == runner_id.service_name
+                ))
+        return max(0, min(limits)) if limits else None
+
     def test_runners(self):
         for _id, runner in sorted(self.runners.items()):
             runner.run_test()
 
     def stop(self):
         self._finished.set()
+        self._wakeup.set()
+        for stage in self._stages.values():
+            stage.cancel()
+
+    def wake_up(self):
+        """Process new requests immediately instead of waiting for the poll."""
+        self._wakeup.set()
+        for name in ('intake', 'cancel'):
+            if name in self._stages:
+                self._stages[name].wake()
 
     def run_forever(self):
         if self._finished.is_set():
             raise RuntimeError
         self.reset_service_states()
-        self.log.info('scheduler started')
+        self.count_active_jobs()
+        watcher = None
+        if self.watch_changes:
+            watcher = ChangeWatcher(
+                slivka.db.database, [JobRequest, CancelRequest], self.wake_up
+            )
+            watcher.start()
+        heartbeat = IntervalThread(
+            self.lease_duration / 3, self._run_stage, name='lease',
+            args=(self.heartbeat,))
+        heartbeat.start()
+        metrics_server = None
+        if self.metrics_address is not None:
+            metrics_server = MetricsServer(self.metrics, self.metrics_address)
+            metrics_server.start()
+            self.log.info('serving metrics at %s:%d', *metrics_server.address)
+        metrics_logger = None
+        if self.metrics_log_interval:
+            metrics_logger = IntervalThread(
+                self.metrics_log_interval, self._run_stage,
+                name='metrics', args=(self.log_metrics,))
+            metrics_logger.start()
+        subscriber = self._subscribe_queue_states()
+        self.log.info('scheduler %s started', self.instance_id)
         try:
-            while not self._finished.wait(1):
-                self.run_cycle()
+            if self.pipelined:
+                self._run_pipelined()
+            else:
+                while not self._finished.is_set():
+                    self._wakeup.wait(self.poll_interval)
+                    self._wakeup.clear()
+                    if not self._finished.is_set():
+                        self.run_cycle()
         except KeyboardInterrupt:
             self.stop()
+        finally:
+            heartbeat.cancel()
+            heartbeat.join()
+            if metrics_logger is not None:
+                metrics_logger.cancel()
+                metrics_logger.join()
+            if metrics_server is not None:
+                metrics_server.cancel()
+            if watcher is not None:
+                watcher.cancel()
+                watcher.join()
+            if subscriber is not None:
+                subscriber.cancel()
+                subscriber.join()
+            if '_executor' in self.__dict__:
+                self._executor.shutdown()
+
+    def _run_pipelined(self):
+        """Run each stage of the cycle in its own thread.
+
+        Stages hand the work over by waking up the following stages.
+        The database remains the only source of the request states,
+        so no work is lost if the scheduler is stopped in between.
+        """
+        self.fail_orphaned_requests()
+        stages = self._stages
+        stages['intake'] = IntervalThread(
+            self.poll_interval, self._run_stage, name='intake',
+            args=(self._intake_stage,))
+        stages['cancel'] = IntervalThread(
+            self.poll_interval, self._run_stage, name='cancel',
+            args=(self.process_cancel_requests,))
+        for runner_id in self.runners:
+            stages[runner_id] = IntervalThread(
+                self.poll_interval, self._run_stage,
+                name='submit-%s-%s' % runner_id,
+                args=(self._submission_stage, runner_id))
+        classpaths = sorted({get_classpath(type(runner))
+                             for runner in self.runners.values()})
+        for classpath in classpaths:
+            stages[classpath] = IntervalThread(
+                self.monitor_interval, self._run_stage,
+                name='monitor-%s' % classpath,
+                args=(self.monitor_running_jobs, [classpath]))
+        # jobs of the runner classes not loaded are monitored together
+        # as in the serial mode, e.g. those started before reconfiguration
+        stages['monitor-other'] = IntervalThread(
+            self.monitor_interval, self._run_stage, name='monitor-other',
+            args=(self.monitor_running_jobs, None, classpaths))
+        for stage in stages.values():
+            stage.start()
+        try:
+            self._finished.wait()
+        finally:
+            for stage in stages.values():
+                stage.cancel()
+            for stage in stages.values():
+                stage.join()
+            stages.clear()
+
+    def _run_stage(self, func, *args):
+        name = threading.current_thread().name
+        try:
+            with self.metrics.timer('stage', stage=name):
+                func(*args)
+        except Exception:
+            self.log.exception('Stage %s failed.', name)
+
+    def log_metrics(self):
+        """Log the durations of the operations since the last call."""
+        summary = self.metrics.summary()
+        if summary:
+            self.log.info('scheduler timings:\n%s', summary)
+
+    def _record_backoff(self, runner, counter):
+        """Expose the state of the backoff counter of the runner."""
+        if isinstance(runner, type):
+            name = get_classpath(runner)
+        else:
+            name = '%s/%s' % runner.id
+        self.metrics.set_gauge('backoff_delay', counter.current, runner=name)
+        self.metrics.set_gauge('backoff_failures', counter.tries, runner=name)
+
+    def _intake_stage(self):
+        for runner in self.process_new_requests():
+            self._stages[runner.id].wake()
+
+    def _submission_stage(self, runner_id):
+        started = self.start_accepted_requests([runner_id])
+        if started:
+            runner = self.runners[runner_id]
+            self._stages[get_classpath(type(runner))].wake()
+
+    def _lease_condition(self, now):
+        """Query matching documents which can be leased by this scheduler."""
+        return {'$or': [
+            {'lease_owner': self.instance_id},
+            {'lease_owner': None},
+            {'lease_expiry': {'$lt': now}}
+        ]}
+
+    def _claim(self, collection, ids) -> set:
+        """Take over the leases of the documents.
+
+        The documents leased by other schedulers which have not expired
+        yet are left intact.
+
+        :return: ids of the documents leased by this scheduler
+        """
+        if not ids:
+            return set()
+        now = datetime.now()
+        query = {'_id': {'$in': list(ids)}}
+        query.update(self._lease_condition(now))
+        collection.update_many(query, {'$set': {
+            'lease_owner': self.instance_id,
+            'lease_expiry': now + timedelta(seconds=self.lease_duration)
+        }})
+        owned = collection.find(
+            {'_id': {'$in': list(ids)}, 'lease_owner': self.instance_id},
+            projection=['_id']
+        )
+        return {item['_id'] for item in owned}
+
+    def heartbeat(self):
+        self.renew_leases()
+        self.count_active_jobs()
+
+    def renew_leases(self):
+        """Extend the leases of the unfinished requests and jobs owned
+        by this scheduler."""
+        database = slivka.db.database
+        update = {'$set': {'lease_expiry': datetime.now() + timedelta(
+            seconds=self.lease_duration)}}
+        JobRequest.collection(database).update_many(
+            {'lease_owner': self.instance_id,
+             'status': {'$in': [JobStatus.PENDING, JobStatus.ACCEPTED,
+                                JobStatus.QUEUED, JobStatus.RUNNING,
+                                JobStatus.CANCELLING]}},
+            update
+        )
+        JobMetadata.collection(database).update_many(
+            {'lease_owner': self.instance_id,
+             'status': {'$in': [JobStatus.QUEUED, JobStatus.RUNNING,
+                                JobStatus.CANCELLING]}},
+            update
+        )
 
     def reset_service_states(self):
         for service, runner in self.runners.keys():
@@ -107,76 +399,202 @@ class Scheduler:
             )
 
     def run_cycle(self):
-        log = self.log
-        database = slivka.db.database
-        request_operations = []
+        with self.metrics.timer('cycle'):
+            self.process_new_requests()
+            self.process_cancel_requests()
+            self.start_accepted_requests()
+            self.monitor_running_jobs()
+
+    def process_new_requests(self) -> List[Runner]:
+        """Assign pending requests to runners or reject them.
 
-        # fetching new requests
-        new_requests = _fetch_pending_requests(database)
-        grouped = self.group_requests(new_requests)
+        :return: runners which received new requests
+        """
+        database = slivka.db.database
+        metrics = self.metrics
+        collection = JobRequest.collection(database)
+        query = {'status': JobStatus.PENDING}
+        query.update(self._lease_condition(datetime.now()))
+        with metrics.timer('fetch', stage='intake'):
+            pending = list(collection.find(query))
+            owned = self._claim(collection, [kw['_id'] for kw in pending])
+        new_requests = (JobRequest(**kw) for kw in pending if kw['_id'] in owned)
+        with metrics.timer('limit'):
+            grouped = self.group_requests(new_requests)
         rejected = grouped.pop(REJECTED, ())
-        if rejected:
-            JobRequest.collection(database).update_many(
-                {'_id': {'$in': [req.id for req in rejected]}},
-                {'$set': {'status': JobStatus.REJECTED}}
-            )
         error = grouped.pop(ERROR, ())
-        if error:
-            JobRequest.collection(database).update_many(
-                {'_id': {'$in': [req.id for req in error]}},
-                {'$set': {'status': JobStatus.ERROR}}
-            )
-        for runner, requests in grouped.items():
-            JobRequest.collection(database).update_many(
-                {'_id': {'$in': [req.id for req in requests]}},
-                {'$set': {
-                    'status': JobStatus.ACCEPTED,
-                    'runner': runner.name
-                }}
-            )
+        with metrics.timer('db_write', stage='intake'):
+            if rejected:
+                collection.update_many(
+                    {'_id': {'$in': [req.id for req in rejected]}},
+                    {'$set': {'status': JobStatus.REJECTED}}
+                )
+            if error:
+                collection.update_many(
+                    {'_id': {'$in': [req.id for req in error]}},
+                    {'$set': {'status': JobStatus.ERROR}}
+                )
+            for runner, requests in grouped.items():
+                collection.update_many(
+                    {'_id': {'$in': [req.id for req in requests]}},
+                    {'$set': {
+                        'status': JobStatus.ACCEPTED,
+                        'runner': runner.name
+                    }}
+                )
+        metrics.increment('transitions', len(rejected), state='rejected')
+        metrics.increment('transitions', len(error), state='error')
+        metrics.increment(
+            'transitions', sum(map(len, grouped.values())), state='accepted')
+        return list(grouped.keys())
+
+    def process_cancel_requests(self):
+        """Cancel jobs whose cancellation was requested.
 
-        # Fetch cancel requests and update cancelled job states to
-        # DELETED if they were PENDING or ACCEPTED; or CANCELLING if QUEUED or RUNNING
+        Changes request states to DELETED if they were PENDING or ACCEPTED;
+        or CANCELLING if QUEUED or RUNNING.
+        """
+        database = slivka.db.database
         cancel_requests = _fetch_cancel_requests(database)
-        if cancel_requests:
-            JobRequest.collection(database).update_many(
+        if not cancel_requests:
+            return
+        with self.metrics.timer('db_write', stage='cancel'):
+            deleted = JobRequest.collection(database).update_many(
                 {'uuid': {'$in': cancel_requests},
                  'status': {'$in': [JobStatus.PENDING, JobStatus.ACCEPTED]}},
                 {'$set': {'status': JobStatus.DELETED}}
             )
-            JobRequest.collection(database).update_many(
+            cancelling = JobRequest.collection(database).update_many(
                 {'uuid': {'$in': cancel_requests},
                  'status': {'$in': [JobStatus.QUEUED, JobStatus.RUNNING]}},
                 {'$set': {'status': JobStatus.CANCELLING}}
             )
-            cancelled_jobs = JobMetadata.find(
-                database, {'uuid': {'$in': cancel_requests}})
-            for job in cancelled_jobs:
-                runner = self.runners[job.service, job.runner]
-                runner.cancel(job.job_id, job.cwd)
-            CancelRequest.collection(database).delete_many(
-                {'uuid': {'$in': cancel_requests}})
-
-        # starting ACCEPTED requests
-        cursor = JobRequest.collection(database).aggregate([
-            {'$match': {'status': JobStatus.ACCEPTED}},
-            {'$group': {
-                '_id': {'service_name': '$service',
-                        'runner_name': '$runner'},
-                'requests': {'$push': '$$CURRENT'}
-            }}
-        ])
-        for item in cursor:
-            requests = [JobRequest(**kw) for kw in item['requests']]
-            try:
-                runner = self.runners[RunnerID(**item['_id'])]
-            except KeyError:
-                log.exception("Runner not found")
-                failed = requests
+        self.metrics.increment(
+            'transitions', deleted.modified_count, state='deleted')
+        self.metrics.increment(
+            'transitions', cancelling.modified_count, state='cancelling')
+        # jobs leased by other schedulers are cancelled by their owners
+        query = {'uuid': {'$in': cancel_requests}}
+        query.update(self._lease_condition(datetime.now()))
+        cancelled_jobs = JobMetadata.find(database, query)
+        foreign = set(cancel_requests)
+        grouped = defaultdict(list)
+        unloaded = set()
+        for job in cancelled_jobs:
+            foreign.discard(job.uuid)
+            runner = self.runners.get((job.service, job.runner))
+            if runner is not None:
+                grouped[runner].append(job)
             else:
-                started, deferred, failed = self.run_requests(runner, requests)
-                new_jobs = []
-                queued = []
+                unloaded.add(job.uuid)
+        for runner, jobs in grouped.items():
+            runner.batch_cancel(jobs)
+        if unloaded:
+            # kept until a scheduler having the runner loaded cancels them
+            self.log.warning(
+                "Jobs of %d cancelled requests cannot be cancelled, "
+                "their runners are not loaded.", len(unloaded))
+        if foreign:
+            # requests without jobs need no further cancelling
+            foreign = {
+                job['uuid'] for job in JobMetadata.collection(database).find(
+                    {'uuid': {'$in': list(foreign)}}, projection=['uuid'])
+            }
+        kept = foreign | unloaded
+        CancelRequest.collection(database).delete_many(
+            {'uuid': {'$in': [uuid for uuid in cancel_requests
+                              if uuid not in kept]}})
+
+    def start_accepted_requests(self, runner_ids=None) -> int:
+        """Submit accepted requests to their runners.
+
+        Requests of each runner are submitted concurrently in the
+        thread pool and their results are written to the database
+        together. Submissions which do not finish within the
+        ``submission_timeout`` are collected in the subsequent calls.
+        Each runner may have at most as many batches in progress as
+        set in ``submission_limits`` (one by default) and the batch
+        size is limited to ``max_batch_size`` requests chosen by the
+        service's ordering policy. The remaining requests are left for
+        the following cycles.
+
+        :param runner_ids: only start requests of those runners if given
+        :return: number of started jobs
+        """
+        database = slivka.db.database
+        with self._submissions_lock:
+            in_progress = [
+                req.id for (runner, requests) in self._submissions.values()
+                for req in requests
+            ]
+        if runner_ids is None:
+            self.fail_orphaned_requests()
+            runner_ids = list(self.runners)
+        for runner_id in runner_ids:
+            slots = self._submission_slots.get(runner_id)
+            if slots is None:
+                slots = self._submission_slots[runner_id] = threading.Semaphore(
+                    self.submission_limits.get(runner_id, 1))
+            if not slots.acquire(blocking=False):
+                continue
+            free_slots = self.get_free_slots(runner_id)
+            batch_size = (self.max_batch_size if free_slots is None
+                          else min(free_slots, self.max_batch_size))
+            if batch_size == 0:
+                slots.release()
+                continue
+            runner = self.runners[runner_id]
+            query = {'status': JobStatus.ACCEPTED,
+                     'service': runner.service_name,
+                     'runner': runner.name}
+            if in_progress:
+                query['_id'] = {'$nin': in_progress}
+            query.update(self._lease_condition(datetime.now()))
+            collection = JobRequest.collection(database)
+            with self.metrics.timer('fetch', stage='submit',
+                                    runner='%s/%s' % runner_id):
+                cursor = self.orderings[runner.service_name].fetch(
+                    collection, query, _request_projection, batch_size
+                )
+                requests = [JobRequest(**kw) for kw in cursor]
+                owned = self._claim(collection, [req.id for req in requests])
+            requests = [req for req in requests if req.id in owned]
+            if not requests:
+                slots.release()
+                continue
+            # count the submitted jobs as active until they are started
+            with self._active_jobs_lock:
+                self._change_active_jobs(runner_id, len(requests))
+                future = self._executor.submit(
+                    self.run_requests, runner, requests)
+                future.add_done_callback(
+                    lambda _, slots=slots: slots.release())
+                with self._submissions_lock:
+                    self._submissions[future] = (runner, requests)
+
+        with self._submissions_lock:
+            futures = [
+                future for future, (runner, _) in self._submissions.items()
+                if runner.id in runner_ids
+            ]
+        done, _ = wait(futures, timeout=self.submission_timeout)
+        # the started jobs are counted again once they are in the database
+        with self._active_jobs_lock:
+            new_jobs = []
+            queued = []
+            failed = []
+            for future in done:
+                with self._submissions_lock:
+                    runner, requests = self._submissions.pop(future)
+                try:
+                    started, deferred, failed_requests = future.result()
+                except Exception:
+                    self.log.exception("Submission to %s failed.", runner)
+                    self._change_active_jobs(runner.id, -len(requests))
+                    continue
+                failed.extend(failed_requests)
+                self._change_active_jobs(
+                    runner.id, -len(deferred) - len(failed_requests))
                 for request, job in started:
                     queued.append(request)
                     new_jobs.append(JobMetadata(
@@ -186,48 +604,276 @@ class Scheduler:
                         runner_class=get_classpath(type(runner)),
                         job_id=job.id,
                         work_dir=job.cwd,
-                        status=JobStatus.QUEUED
+                        status=JobStatus.QUEUED,
+                        check_interval=self.min_check_interval,
+                        next_check=datetime.now(),
+                        lease_owner=self.instance_id,
+                        lease_expiry=datetime.now() + timedelta(
+                            seconds=self.lease_duration)
                     ))
-                if new_jobs:
-                    insert_many(database, new_jobs)
-                    JobRequest.collection(database).update_many(
-                        {'_id': {'$in': [req.id for req in queued]}},
+            collection = JobRequest.collection(database)
+            with self.metrics.timer('db_write', stage='submit'):
+                insert_many(database, new_jobs)
+                # requests cancelled in the meantime are no longer accepted
+                if queued:
+                    queued_count = collection.update_many(
+                        {'_id': {'$in': [req.id for req in queued]},
+                         'status': JobStatus.ACCEPTED},
                         {'$set': {'status': JobStatus.QUEUED}}
-                    )
-            if failed:
-                JobRequest.collection(database).update_many(
-                    {'_id': {'$in': [req.id for req in failed]}},
-                    {'$set': {'status': JobStatus.ERROR}}
-                )
+                    ).matched_count
+                else:
+                    queued_count = 0
+                if failed:
+                    failed_count = collection.update_many(
+                        {'_id': {'$in': [req.id for req in failed]},
+                         'status': JobStatus.ACCEPTED},
+                        {'$set': {'status': JobStatus.ERROR}}
+                    ).matched_count
+                else:
+                    failed_count = 0
+        if queued_count < len(queued):
+            self._cancel_deleted_jobs(new_jobs)
+        self.metrics.increment('transitions', queued_count, state='queued')
+        self.metrics.increment('transitions', failed_count, state='error')
+        return len(new_jobs)
+
+    def _cancel_deleted_jobs(self, jobs):
+        """Cancel the started jobs whose requests were deleted.
+
+        The cancel requests of the requests deleted while their jobs
+        were being submitted are already consumed, so the jobs are
+        cancelled here instead.
+        """
+        collection = JobRequest.collection(slivka.db.database)
+        deleted = {
+            req['uuid'] for req in collection.find(
+                {'uuid': {'$in': [job.uuid for job in jobs]},
+                 'status': JobStatus.DELETED},
+                projection=['uuid'])
+        }
+        grouped = defaultdict(list)
+        for job in jobs:
+            if job.uuid in deleted:
+                grouped[self.runners[job.service, job.runner]].append(job)
+        for runner, runner_jobs in grouped.items():
+            self.log.info("Cancelling %d jobs of %s deleted during submission.",
+                          len(runner_jobs), runner)
+            runner.batch_cancel(runner_jobs)
+
+    def fail_orphaned_requests(self):
+        """Set accepted requests whose runners are not loaded to ERROR.
+
+        Requests leased by other schedulers are not affected as those
+        may have different runners loaded.
+        """
+        query = {'status': JobStatus.ACCEPTED}
+        query.update(self._lease_condition(datetime.now()))
+        if self.runners:
+            query['$nor'] = [
+                {'service': service, 'runner': runner}
+                for service, runner in self.runners
+            ]
+        collection = JobRequest.collection(slivka.db.database)
+        requests = list(collection.find(query, projection=_request_projection))
+        if not requests:
+            return
+        for request in requests:
+            self.log.error("Runner %s not found for service %s.",
+                           request.get('runner'), request['service'])
+        collection.update_many(
+            {'_id': {'$in': [req['_id'] for req in requests]}},
+            {'$set': {'status': JobStatus.ERROR}}
+        )
+
+    def monitor_running_jobs(self, runner_classes=None, excluded_classes=()):
+        """Check the states of queued and running jobs and update them.
 
-        # monitoring jobs
-        cursor = JobMetadata.collection(database).aggregate([
-            {'$match': {'status': {'$in': (JobStatus.QUEUED, JobStatus.RUNNING)}}},
-            {'$group': {
-                '_id': '$runner_class',
-                'jobs': {'$push': '$$CURRENT'}
-            }}
-        ])
-        for item in cursor:
-            jobs = [JobMetadata(**kw) for kw in item['jobs']]
+        Only the jobs due for a check are fetched. The interval between
+        checks of each job starts from ``min_check_interval`` and is
+        multiplied by ``check_backoff_factor`` every time the job state
+        does not change, up to ``max_check_interval``.
+
+        :param runner_classes: only check jobs of those runner classes if given
+        :param excluded_classes: skip jobs of those runner classes
+        """
+        log = self.log
+        database = slivka.db.database
+        now = datetime.now()
+        query = {
+            'status': {'$in': [JobStatus.QUEUED, JobStatus.RUNNING]},
+            'next_check': {'$not': {'$gt': now}}
+        }
+        query.update(self._lease_condition(now))
+        if runner_classes is not None:
+            query['runner_class'] = {'$in': list(runner_classes)}
+        elif excluded_classes:
+            query['runner_class'] = {'$nin': list(excluded_classes)}
+        collection = JobMetadata.collection(database)
+        cursor = (collection
+                  .find(query)
+                  .sort('runner_class', pymongo.ASCENDING))
+        for classpath, items in groupby(cursor, key=itemgetter('runner_class')):
+            jobs = [JobMetadata(**kw) for kw in items]
+            owned = self._claim(collection, [job.id for job in jobs])
+            jobs = [job for job in jobs if job.id in owned]
+            if not jobs:
+                continue
             try:
-                mod, attr = item['_id'].rsplit('.', 1)
+                mod, attr = classpath.rsplit('.', 1)
                 runner = getattr(import_module(mod), attr)
-            except AttributeError:
+            except (AttributeError, ImportError):
                 log.exception("Runner class cannot be imported")
                 updated = [(job, JobStatus.ERROR) for job in jobs]
+                checked = True
             else:
-                updated = self.monitor_jobs(runner, jobs)
-            if not updated:
-                continue
-            JobRequest.collection(database).bulk_write([
-                UpdateOne({'uuid': job.uuid}, {'$set': {'status': state}})
-                for (job, state) in updated
-            ], ordered=False)
-            JobMetadata.collection(database).bulk_write([
-                UpdateOne({'_id': job.id}, {'$set': {'status': state}})
-                for (job, state) in updated
-            ], ordered=False)
+                with self.metrics.timer('monitor', runner_class=classpath):
+                    updated = self.monitor_jobs(runner, jobs)
+                # the counter is non-zero if the check was skipped or failed
+                checked = self._backoff_counters[runner].current == 0
+                self._store_usage(runner, updated)
+            self._update_jobs(jobs, updated, checked, now)
+
+    def _store_usage(self, runner, updated):
+        """Save the resource usage of the finished jobs on their documents."""
+        finished = [job for job, state in updated if state.is_finished()]
+        if not finished:
+            return
+        try:
+            usages = runner.batch_get_usage(finished)
+        except Exception:
+            self.log.exception("Reading the usage of %s jobs failed.", runner)
+            return
+        operations = [
+            UpdateOne({'_id': job.id}, {'$set': {'usage': usage}})
+            for job, usage in zip(finished, usages) if usage is not None
+        ]
+        if operations:
+            with self.metrics.timer('db_write', stage='monitor'):
+                JobMetadata.collection(slivka.db.database).bulk_write(
+                    operations, ordered=False)
+
+    def _subscribe_queue_states(self):
+        """Start applying the state changes published by the local queue.
+
+        :return: the subscriber thread or None if not subscribed
+        """
+        if self.queue_notify_address is None:
+            return None
+        from slivka.local_queue import LocalQueueSubscriber
+        from slivka.scheduler.runners import SlivkaQueueRunner
+        classpaths = sorted({
+            get_classpath(type(runner)) for runner in self.runners.values()
+            if isinstance(runner, SlivkaQueueRunner)
+        })
+        if not classpaths:
+            return None
+        subscriber = LocalQueueSubscriber(
+            self.queue_notify_address,
+            partial(self.apply_job_states, classpaths))
+        subscriber.start()
+        return subscriber
+
+    def apply_job_states(self, runner_classes, states):
+        """Update the jobs to the states reported by their runner.
+
+        Used for the state changes pushed by the queueing system.
+        Jobs already in the given states or owned by other schedulers
+        are skipped; polling remains responsible for those.
+
+        :param runner_classes: class paths of the runners the job ids
+            belong to
+        :param states: dictionary of the job ids and their states
+        """
+        if not states:
+            return
+        now = datetime.now()
+        query = {
+            'job_id': {'$in': list(states)},
+            'runner_class': {'$in': list(runner_classes)},
+            'status': {'$in': [JobStatus.QUEUED, JobStatus.RUNNING]}
+        }
+        query.update(self._lease_condition(now))
+        collection = JobMetadata.collection(slivka.db.database)
+        jobs = [JobMetadata(**kw) for kw in collection.find(query)]
+        if not jobs:
+            return
+        owned = self._claim(collection, [job.id for job in jobs])
+        updated = []
+        for job in jobs:
+            state = JobStatus(states[job.job_id])
+            if job.id in owned and job.state != state:
+                updated.append((job, state))
+        self._update_jobs(jobs, updated, False, now)
+
+    def _update_jobs(self, jobs, updated, checked, now):
+        """Write the new job states and the times of the next checks.
+
+        The states are only written if the jobs are still in the states
+        they were read in, so the transitions already applied by the
+        state notifications or polling in another thread are neither
+        reverted nor counted again.
+        """
+        database = slivka.db.database
+        transitions = defaultdict(list)
+        for job, state in updated:
+            key = (RunnerID(job.service, job.runner), job.state, state)
+            transitions[key].append(job)
+        job_operations = []
+        if checked:
+            changed = {job.id for job, _ in updated}
+            backed_off = defaultdict(list)
+            for job in jobs:
+                if job.id in changed:
+                    continue
+                interval = min(
+                    job.get('check_interval', self.min_check_interval) *
+                    self.check_backoff_factor,
+                    self.max_check_interval
+                )
+                backed_off[interval].append(job.id)
+            job_operations.extend(
+                UpdateMany({'_id': {'$in': ids}}, {'$set': {
+                    'check_interval': interval,
+                    'next_check': now + timedelta(seconds=interval)
+                }})
+                for interval, ids in backed_off.items()
+            )
+        request_operations = []
+        applied = Counter()
+        with self.metrics.timer('db_write', stage='monitor'):
+            with self._active_jobs_lock:
+                for (runner_id, old_state, state), group in transitions.items():
+                    result = JobMetadata.collection(database).update_many(
+                        {'_id': {'$in': [job.id for job in group]},
+                         'status': old_state},
+                        {'$set': {
+                            'status': state,
+                            'check_interval': self.min_check_interval,
+                            'next_check': now + timedelta(
+                                seconds=self.min_check_interval)
+                        }}
+                    )
+                    if result.modified_count == 0:
+                        continue
+                    applied[state] += result.modified_count
+                    if state not in (JobStatus.QUEUED, JobStatus.RUNNING):
+                        self._change_active_jobs(
+                            runner_id, -result.modified_count)
+                    request_operations.append(UpdateMany(
+                        {'uuid': {'$in': [job.uuid for job in group]},
+                         'status': {'$in': [old_state,
+                                            JobStatus.CANCELLING]}},
+                        {'$set': {'status': state}}
+                    ))
+            if request_operations:
+                JobRequest.collection(database).bulk_write(
+                    request_operations, ordered=False)
+            if job_operations:
+                JobMetadata.collection(database).bulk_write(
+                    job_operations, ordered=False)
+        for state, count in applied.items():
+            self.metrics.increment(
+                'transitions', count, state=JobStatus(state).name.lower())
 
     def group_requests(
             self, requests: Iterable[JobRequest]
@@ -248,9 +894,12 @@ class Scheduler:
         """Run all requests in the list using the runner."""
         counter = self._backoff_counters[runner]
         if not requests or next(counter) > 0:
+            self._record_backoff(runner, counter)
             return RunResult(started=(), deferred=requests, failed=())
         try:
-            jobs = runner.batch_run([req.inputs for req in requests])
+            with self.metrics.timer('submit', runner='%s/%s' % runner.id):
+                jobs = runner.batch_run([req.inputs for req in requests])
+            self._record_backoff(runner, counter)
             service_state = ServiceState(
                 service=runner.service_name, runner=runner.name,
                 state=ServiceState.State.OK)
@@ -262,6 +911,7 @@ class Scheduler:
         except Exception as exc:
             self.log.exception("Running %s requests failed.", runner)
             counter.failure()
+            self._record_backoff(runner, counter)
             if counter.give_up:
                 state = ServiceState.State.DOWN
                 result = RunResult(started=(), deferred=(), failed=requests)
@@ -284,14 +934,17 @@ class Scheduler:
         """Checks status of jobs and returns modified."""
         counter = self._backoff_counters[runner]
         if not jobs or next(counter) > 0:
+            self._record_backoff(runner, counter)
             return ()
         try:
             states = runner.batch_check_status(jobs)
+            self._record_backoff(runner, counter)
             return [(job, state) for (job, state)
                     in zip(jobs, states) if job.state != state]
         except Exception as e:
             self.log.exception("Checking job status for %s failed.", runner)
             counter.failure()
+            self._record_backoff(runner, counter)
             if counter.give_up:
                 return [(job, JobStatus.ERROR) for job in jobs]
             else:
@@ -307,21 +960,73 @@ class IntervalThread(threading.Thread):
         self._kwargs = kwargs or {}
         self.interval = interval
         self._finished = threading.Event()
+        self._wakeup = threading.Event()
 
     def cancel(self):
         """Stop the interval thread."""
         self._finished.set()
+        self._wakeup.set()
+
+    def wake(self):
+        """Call the target immediately without waiting for the interval."""
+        self._wakeup.set()
 
     def run(self) -> None:
         args, kwargs = self._args, self._kwargs
         try:
-            while not self._finished.wait(self.interval):
-                self._target(*args, **kwargs)
+            while not self._finished.is_set():
+                self._wakeup.wait(self.interval)
+                self._wakeup.clear()
+                if not self._finished.is_set():
+                    self._target(*args, **kwargs)
         finally:
             self._finished.set()
             del self._target, self._args, self._kwargs
 
 
+class ChangeWatcher(threading.Thread):
+    """Thread calling the callback whenever documents are inserted.
+
+    Uses the database change stream to detect new documents in
+    the collections of the given document classes. Change streams are
+    only available on replica sets, if the database does not support
+    them, the watcher stops and the scheduler falls back to polling.
+    """
+    def __init__(self, database, documents, callback, name='ChangeWatcher'):
+        threading.Thread.__init__(self, name=name, daemon=True)
+        self.log = logging.getLogger(__name__)
+        self._database = database
+        self._pipeline = [{'$match': {
+            'operationType': 'insert',
+            'ns.coll': {'$in': [doc.__collection__ for doc in documents]}
+        }}]
+        self._callback = callback
+        self._finished = threading.Event()
+
+    def cancel(self):
+        """Stop the watcher thread."""
+        self._finished.set()
+
+    def run(self) -> None:
+        while not self._finished.is_set():
+            try:
+                with self._database.watch(
+                        self._pipeline, max_await_time_ms=1000) as stream:
+                    self.log.info('watching for new requests')
+                    while stream.alive and not self._finished.is_set():
+                        if stream.try_next() is not None:
+                            self._callback()
+            except OperationFailure as e:
+                self.log.warning(
+                    'Change streams are not available (%s). '
+                    'Falling back to polling.', e
+                )
+                self._finished.set()
+            except PyMongoError:
+                self.log.exception('Change stream broken, reconnecting.')
+                self._finished.wait(1)
+
+
 class LimiterMeta(type):
     @classmethod
     def __prepare__(mcs, name, bases):
@@ -357,3 +1062,85 @@ class DefaultLimiter(Limiter):
     # noinspection PyMethodMayBeStatic,PyUnusedLocal
     def limit_default(self, inputs):
         return True
+
+
+class OrderingPolicy:
+    """Selects which accepted requests are submitted first.
+
+    Subclasses implement :meth:`fetch` returning at most ``limit``
+    documents matching the query in the order they should be submitted.
+    The ordering should be backed by an index so that the database does
+    not need to sort the whole backlog.
+    """
+    def fetch(self, collection, query, projection, limit) -> Iterable[dict]:
+        raise NotImplementedError
+
+
+class FifoOrdering(OrderingPolicy):
+    """Submits the requests in the order they were received."""
+    def fetch(self, collection, query, projection, limit):
+        return (collection.find(query, projection=projection)
+                .sort('timestamp', pymongo.ASCENDING)
+                .limit(limit))
+
+
+class PriorityOrdering(OrderingPolicy):
+    """Submits the requests with the highest priority first."""
+    def fetch(self, collection, query, projection, limit):
+        return (collection.find(query, projection=projection)
+                .sort([('priority', pymongo.DESCENDING),
+                       ('timestamp', pymongo.ASCENDING)])
+                .limit(limit))
+
+
+class FairShareOrdering(OrderingPolicy):
+    """Shares the submissions between the clients proportionally to
+    their weights, so a single client cannot starve the others.
+
+    Weights of the clients can be set in the ``weights`` dictionary
+    of the subclass, other clients receive ``default_weight``.
+    Requests with no client are treated as coming from a single
+    client identified by None. The shares the clients cannot fill
+    are given to the other clients until the batch is full.
+    """
+    weights = {}
+    default_weight = 1
+
+    def fetch(self, collection, query, projection, limit):
+        clients = collection.distinct('client', query)
+        # the requests without a client share one queue
+        if (None not in clients and
+                collection.find_one(dict(query, client=None)) is not None):
+            clients.append(None)
+        if not clients:
+            return []
+        weights = {client: self.weights.get(client, self.default_weight)
+                   for client in clients}
+        queues = {client: [] for client in clients}
+        # the capacity unused by the clients with fewer requests than
+        # their shares is distributed between the remaining clients
+        active = list(clients)
+        remaining = limit
+        while active and remaining > 0:
+            total = sum(weights[client] for client in active)
+            available = remaining
+            for client in list(active):
+                quota = max(1, math.ceil(available * weights[client] / total))
+                queue = queues[client]
+                cursor = (collection
+                          .find(dict(query, client=client),
+                                projection=projection)
+                          .sort('timestamp', pymongo.ASCENDING)
+                          .skip(len(queue))
+                          .limit(quota))
+                requests = list(cursor)
+                queue.extend(requests)
+                remaining -= len(requests)
+                if len(requests) < quota:
+                    active.remove(client)
+        # interleave the clients' requests, oldest first within each turn
+        result = []
+        for turn in itertools.zip_longest(*queues.values()):
+            result.extend(sorted(filter(None, turn),
+                                 key=itemgetter('timestamp')))
+        return result[:limit]
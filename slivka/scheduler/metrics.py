@@ -0,0 +1,173 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, str(value).replace('\\', r'\\').replace('"', r'\"'))
+        for key, value in labels
+    )
+
+
+class _Timing:
+    __slots__ = ('count', 'total', 'window_count', 'window_total', 'window_max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.window_count = 0
+        self.window_total = 0.0
+        self.window_max = 0.0
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        self.window_count += 1
+        self.window_total += duration
+        self.window_max = max(self.window_max, duration)
+
+
+class Metrics:
+    """Thread-safe registry of the scheduler measurements.
+
+    Keeps the durations of the timed operations, counters and gauges
+    identified by the metric name and a set of labels. Durations and
+    counters are cumulative and exposed in the Prometheus text format
+    by :meth:`render`; :meth:`summary` describes the durations measured
+    since the previous summary.
+    """
+
+    def __init__(self, prefix='slivka_scheduler'):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._timings = defaultdict(_Timing)  # type: Dict[tuple, _Timing]
+        self._counters = defaultdict(int)  # type: Dict[tuple, float]
+        self._gauges = {}  # type: Dict[tuple, float]
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Measure the duration of the enclosed block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def observe(self, name, duration, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._timings[key].add(duration)
+
+    def increment(self, name, value=1, **labels):
+        if not value:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] += value
+
+    def set_gauge(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def render(self) -> str:
+        """Return the metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            timings = sorted(
+                (key, timing.count, timing.total)
+                for key, timing in self._timings.items())
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+        last_name = None
+        for (name, labels), count, total in timings:
+            metric = '%s_%s_seconds' % (self.prefix, name)
+            if name != last_name:
+                lines.append('# TYPE %s summary' % metric)
+                last_name = name
+            lines.append('%s_count%s %d' % (metric, _format_labels(labels), count))
+            lines.append('%s_sum%s %f' % (metric, _format_labels(labels), total))
+        for (name, labels), value in counters:
+            metric = '%s_%s_total' % (self.prefix, name)
+            if name != last_name:
+                lines.append('# TYPE %s counter' % metric)
+                last_name = name
+            lines.append('%s%s %s' % (metric, _format_labels(labels), value))
+        for (name, labels), value in gauges:
+            metric = '%s_%s' % (self.prefix, name)
+            if name != last_name:
+                lines.append('# TYPE %s gauge' % metric)
+                last_name = name
+            lines.append('%s%s %s' % (metric, _format_labels(labels), value))
+        lines.append('')
+        return '\n'.join(lines)
+
+    def summary(self) -> str:
+        """Describe the durations measured since the last summary,
+        slowest operations first."""
+        entries = []
+        with self._lock:
+            for (name, labels), timing in self._timings.items():
+                if timing.window_count == 0:
+                    continue
+                entries.append((
+                    timing.window_total, name, labels,
+                    timing.window_count, timing.window_max
+                ))
+                timing.window_count = 0
+                timing.window_total = 0.0
+                timing.window_max = 0.0
+        entries.sort(reverse=True)
+        return '\n'.join(
+            '%s%s: %d calls, %.3fs total, %.3fs avg, %.3fs max' % (
+                name, _format_labels(labels), count, total,
+                total / count, max_duration)
+            for total, name, labels, count, max_duration in entries
+        )
+
+
+class MetricsServer(threading.Thread):
+    """Thread serving the metrics over HTTP for Prometheus to scrape."""
+
+    def __init__(self, metrics: Metrics, address: Tuple[str, int]):
+        threading.Thread.__init__(self, name='metrics-server', daemon=True)
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header(
+                    'Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.getLogger(__name__).debug(format, *args)
+
+        self.server = ThreadingHTTPServer(address, Handler)
+
+    @property
+    def address(self):
+        return self.server.server_address
+
+    def run(self):
+        self.server.serve_forever()
+
+    def cancel(self):
+        self.server.shutdown()
+        self.server.server_close()
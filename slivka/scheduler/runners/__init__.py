@@ -2,7 +2,9 @@ from .grid_engine import GridEngineRunner
 from .runner import Runner
 from .shell import ShellRunner
 from .slivka_queue import SlivkaQueueRunner
+from .slurm import SlurmRunner
 
 __all__ = (
-    'Runner', 'GridEngineRunner', 'ShellRunner', 'SlivkaQueueRunner'
+    'Runner', 'GridEngineRunner', 'ShellRunner', 'SlivkaQueueRunner',
+    'SlurmRunner'
 )
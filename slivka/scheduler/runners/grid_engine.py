@@ -1,31 +1,30 @@
 import atexit
+import getpass
 import logging
 import os
 import re
-import shlex
 import subprocess
-import tempfile
-from collections import defaultdict
+import threading
+import time
+from collections import namedtuple
 from concurrent.futures import ThreadPoolExecutor
-from datetime import datetime, timedelta
-from typing import Iterable, Tuple, List
-
-import pkg_resources
+from typing import Iterable, Tuple, List, Dict, IO, Optional
+from xml.etree import ElementTree
 
 from slivka import JobStatus
 from slivka.db.documents import JobMetadata
-from .runner import Runner
+from slivka.utils import LimitedSizeDict
+from .runner import (Runner, RunnerID, FinishedFileWatch, parse_task_ids,
+                     write_array_script, write_run_script)
 
 log = logging.getLogger('slivka.scheduler')
 
 _job_submitted_regex = re.compile(
     rb'Your job (\d+) \(.+\) has been submitted'
 )
-_job_status_regex = re.compile(
-    rb'^\s*(\d+)\s+\d+\.\d*\s+[\w-]+\s+[\w-]+\s+(\w+)',
-    re.MULTILINE
+_array_submitted_regex = re.compile(
+    rb'Your job-array (\d+)\.[\d:-]+ \(.+\) has been submitted'
 )
-_runner_sh_tpl = pkg_resources.resource_string(__name__, "runner.sh.tpl").decode()
 
 
 class _StatusLetterDict(dict):
@@ -51,22 +50,225 @@ _executor = ThreadPoolExecutor()
 atexit.register(_executor.shutdown)
 
 
+def _parse_qstat_xml(stream: IO[bytes]) -> Dict[bytes, JobStatus]:
+    """Return the states of the jobs and array tasks listed by qstat -xml.
+
+    The output is parsed incrementally and each job element is
+    discarded as soon as it is read, so the memory used does not
+    depend on the size of the output. Array tasks are keyed by
+    the ``job_id.task_id`` identifiers.
+    """
+    states = {}
+    parents = []
+    for event, elem in ElementTree.iterparse(stream, ('start', 'end')):
+        if event == 'start':
+            parents.append(elem)
+            continue
+        parents.pop()
+        if elem.tag != 'job_list':
+            continue
+        job_id = elem.findtext('JB_job_number').encode()
+        state = _status_letters[elem.findtext('state').encode()]
+        tasks = elem.findtext('tasks')
+        if tasks:
+            for task_id in parse_task_ids(tasks):
+                states[b'%s.%d' % (job_id, task_id)] = state
+        else:
+            states[job_id] = state
+        parents[-1].remove(elem)
+    return states
+
+
+class QstatSnapshot:
+    """States of the grid engine jobs shared by all the status checks.
+
+    The states are read from qstat at most once every ``max_age``
+    seconds. Callers arriving while qstat is running wait for its
+    result instead of starting their own process. The states are
+    read again after :meth:`invalidate` is called, so the jobs
+    submitted since the last read are not missing from them.
+    """
+
+    def __init__(self, args=None, max_age=1.0):
+        self.args = args or ['qstat', '-xml', '-u', getpass.getuser()]
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._states = None  # type: Dict[bytes, JobStatus]
+        self._timestamp = 0.0
+        self._invalidated = 0.0
+
+    def get(self) -> Dict[bytes, JobStatus]:
+        with self._lock:
+            if (self._states is not None and
+                    self._timestamp > self._invalidated and
+                    time.monotonic() - self._timestamp < self.max_age):
+                return self._states
+            timestamp = time.monotonic()
+            self._states = self._read_states()
+            self._timestamp = timestamp
+            return self._states
+
+    def invalidate(self):
+        """Discard the states read before the call."""
+        self._invalidated = time.monotonic()
+
+    def _read_states(self):
+        proc = subprocess.Popen(self.args, stdout=subprocess.PIPE)
+        try:
+            with proc.stdout:
+                states = _parse_qstat_xml(proc.stdout)
+        except ElementTree.ParseError:
+            # report the failure of qstat rather than its partial output
+            if proc.wait() != 0:
+                raise subprocess.CalledProcessError(
+                    proc.returncode, self.args) from None
+            raise
+        finally:
+            proc.wait()
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, self.args)
+        return states
+
+
+AccountingRecord = namedtuple(
+    'AccountingRecord', 'failed, exit_status, usage')
+
+
+class AccountingFile:
+    """Reader of the finished jobs from the grid engine accounting file.
+
+    Grid engine appends a line to the accounting file when a job or
+    an array task ends. Each call to :meth:`update` reads the lines
+    appended since the previous call so the outcomes of all the jobs
+    which finished in the meantime are obtained at once. The file is
+    read from its end when first opened and from its beginning after
+    it is rotated.
+    """
+
+    # positions of the used fields of the colon-separated records
+    _JOB_NUMBER = 5
+    _FAILED = 11
+    _EXIT_STATUS = 12
+    _WALLCLOCK = 13
+    _UTIME = 14
+    _STIME = 15
+    _MAXRSS = 16
+    _TASK_NUMBER = 35
+    _MAXVMEM = 42
+
+    def __init__(self, path, max_records=100000):
+        self.path = path
+        self.records = LimitedSizeDict(max_records)
+        self._lock = threading.Lock()
+        self._file = None
+        self._inode = None
+        self._partial = b''
+
+    def get(self, job_id) -> Optional[AccountingRecord]:
+        return self.records.get(job_id)
+
+    def update(self):
+        with self._lock:
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                return
+            if self._file is None:
+                self._open(stat, from_end=True)
+            elif (stat.st_ino != self._inode or
+                  stat.st_size < self._file.tell()):
+                self._file.close()
+                self._open(stat, from_end=False)
+            data = self._partial + self._file.read()
+            lines = data.split(b'\n')
+            self._partial = lines.pop()
+            for line in lines:
+                if line and not line.startswith(b'#'):
+                    self._add_record(line)
+
+    def _open(self, stat, from_end):
+        self._file = open(self.path, 'rb')
+        self._inode = stat.st_ino
+        self._partial = b''
+        if from_end:
+            self._file.seek(0, os.SEEK_END)
+
+    def _add_record(self, line):
+        fields = line.split(b':')
+        try:
+            task_number = int(fields[self._TASK_NUMBER])
+            job_id = fields[self._JOB_NUMBER]
+            if task_number:
+                job_id = b'%s.%d' % (job_id, task_number)
+            usage = {
+                'wall_time': float(fields[self._WALLCLOCK]),
+                'cpu_time': (float(fields[self._UTIME]) +
+                             float(fields[self._STIME])),
+                'max_rss': int(float(fields[self._MAXRSS])),
+                'max_vmem': int(float(fields[self._MAXVMEM]))
+            }
+            self.records[job_id] = AccountingRecord(
+                failed=int(fields[self._FAILED]),
+                exit_status=int(fields[self._EXIT_STATUS]),
+                usage=usage
+            )
+        except (IndexError, ValueError):
+            log.warning('Malformed accounting record: %r', line)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+# accounting file readers shared by the runners using the same path
+_accounting_files = {}  # type: Dict[str, AccountingFile]
+# accounting file readers of the runners the jobs are looked up in
+_runner_accounting = {}  # type: Dict[RunnerID, AccountingFile]
+
+
+def _accounting_state(record: AccountingRecord) -> JobStatus:
+    if record.failed == 0 and record.exit_status == 0:
+        return JobStatus.COMPLETED
+    # failures below 100 happen before the job script is started
+    if 0 < record.failed < 100 or record.exit_status == 127:
+        return JobStatus.ERROR
+    # failure 100 and exit statuses above 128 indicate signals
+    if record.failed == 100 or record.exit_status > 128:
+        return JobStatus.INTERRUPTED
+    return JobStatus.FAILED
+
+
 class GridEngineRunner(Runner):
-    finished_job_timestamp = defaultdict(datetime.now)
+    finished_files = FinishedFileWatch()
+    qstat = QstatSnapshot()
 
-    def __init__(self, command_def, id=None, qsub_args=()):
+    def __init__(self, command_def, id=None, qsub_args=(), array_jobs=False,
+                 accounting_file=None):
+        """
+        :param qsub_args: arguments passed to qsub
+        :param array_jobs: submit the batches of jobs as a single
+            array job whose tasks run the jobs
+        :param accounting_file: path to the grid engine accounting file
+            the finished jobs are read from, shared by the runners
+            using the same file
+        """
         super().__init__(command_def, id)
         self.qsub_args = qsub_args
+        self.array_jobs = array_jobs
+        if accounting_file is not None:
+            accounting = _accounting_files.get(accounting_file)
+            if accounting is None:
+                accounting = _accounting_files[accounting_file] = \
+                    AccountingFile(accounting_file)
+            _runner_accounting[self.id] = accounting
         self.env.update(
             (env, os.getenv(env)) for env in os.environ
             if env.startswith('SGE')
         )
 
     def submit(self, cmd, cwd):
-        fd, path = tempfile.mkstemp(prefix='run', suffix='.sh', dir=cwd)
-        cmd = str.join(' ', map(shlex.quote, cmd))
-        with open(fd, 'w') as f:
-            f.write(_runner_sh_tpl.format(cmd=cmd))
+        path = write_run_script(cmd, cwd)
         qsub_cmd = ['qsub', '-V', '-cwd', '-o', 'stdout', '-e', 'stderr',
                     *self.qsub_args, path]
         proc = subprocess.run(
@@ -78,6 +280,7 @@ class GridEngineRunner(Runner):
             universal_newlines=False
         )
         proc.check_returncode()
+        self.qstat.invalidate()
         match = _job_submitted_regex.match(proc.stdout)
         return match.group(1)
 
@@ -86,45 +289,77 @@ class GridEngineRunner(Runner):
         :param commands: iterable of args list and cwd path pairs
         :return: list of identifiers
         """
+        commands = list(commands)
+        if self.array_jobs and len(commands) > 1:
+            return self.submit_array(commands)
         def submit_wrapper(args): return self.submit(*args)
         return list(_executor.map(submit_wrapper, commands))
 
+    def submit_array(self, commands: List[Tuple[List, str]]):
+        """Submit the commands as the tasks of one array job.
+
+        :return: list of ``job_id.task_id`` identifiers
+        """
+        path = write_array_script(commands, 'SGE_TASK_ID')
+        array_dir = commands[0][1]
+        qsub_cmd = ['qsub', '-V', '-cwd', '-t', '1-%d' % len(commands),
+                    '-o', os.devnull, '-e', os.devnull, *self.qsub_args, path]
+        proc = subprocess.run(
+            qsub_cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            cwd=array_dir,
+            env=self.env,
+            universal_newlines=False
+        )
+        proc.check_returncode()
+        self.qstat.invalidate()
+        job_id = _array_submitted_regex.match(proc.stdout).group(1)
+        return [b'%s.%d' % (job_id, task_id)
+                for task_id in range(1, len(commands) + 1)]
+
     @classmethod
     def check_status(cls, job_id, cwd):
         job = dict(job_id=job_id, work_dir=cwd)
         return next(cls.batch_check_status([job]))
 
+    @staticmethod
+    def _get_accounting(job) -> Optional[AccountingFile]:
+        """Return the accounting file of the runner which started the job."""
+        return _runner_accounting.get(
+            RunnerID(job.get('service'), job.get('runner')))
+
     @classmethod
     def batch_check_status(cls, jobs):
-        stdout = subprocess.check_output('qstat')
-        states = {}
-        matches = _job_status_regex.findall(stdout)
-        for job_id, status in matches:
-            states[job_id] = _status_letters[status]
+        jobs = list(jobs)
+        states = cls.qstat.get()
+        for accounting in {cls._get_accounting(job) for job in jobs}:
+            if accounting is not None:
+                accounting.update()
         for job in jobs:
             job_id = job['job_id']
             state = states.get(job_id)
+            accounting = cls._get_accounting(job)
+            record = (accounting.get(job_id)
+                      if state is None and accounting is not None
+                      else None)
             if state is not None:
+                cls.finished_files.discard(job_id)
                 yield state
+            elif record is not None:
+                cls.finished_files.discard(job_id)
+                yield _accounting_state(record)
             else:
-                fn = os.path.join(job['work_dir'], 'finished')
-                try:
-                    with open(fn) as fp:
-                        return_code = int(fp.read())
-                    cls.finished_job_timestamp.pop(job_id, None)
-                    yield (
-                        JobStatus.COMPLETED if return_code == 0 else
-                        JobStatus.ERROR if return_code == 127 else
-                        JobStatus.FAILED
-                    )
-                except FileNotFoundError:
-                    # one minute window for file system synchronization
-                    ts = cls.finished_job_timestamp[job_id]
-                    if datetime.now() - ts < timedelta(minutes=1):
-                        yield JobStatus.RUNNING
-                    else:
-                        del cls.finished_job_timestamp[job_id]
-                        yield JobStatus.INTERRUPTED
+                yield cls.finished_files.get_state(job_id, job['work_dir'])
+
+    @classmethod
+    def batch_get_usage(cls, jobs):
+        usages = []
+        for job in jobs:
+            accounting = cls._get_accounting(job)
+            record = accounting and accounting.get(job['job_id'])
+            usages.append(record.usage if record else None)
+        return usages
 
     @classmethod
     def cancel(cls, job_id, cwd):
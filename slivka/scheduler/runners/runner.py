@@ -9,9 +9,12 @@ import shutil
 import tempfile
 import time
 from collections import ChainMap, namedtuple
-from datetime import datetime
+from datetime import datetime, timedelta
 from functools import partial
-from typing import List, Iterator, Iterable, Tuple, Match
+from typing import (List, Iterator, Iterable, Tuple, Match, Optional, Dict,
+                    Any)
+
+import pkg_resources
 
 import slivka
 from slivka import JobStatus
@@ -181,6 +184,16 @@ class Runner:
     def batch_check_status(cls, jobs: Iterable[JobMetadata]) -> Iterator[JobStatus]:
         return [cls.check_status(job.job_id, job.work_dir) for job in jobs]
 
+    @classmethod
+    def batch_get_usage(cls, jobs: Iterable[JobMetadata]) -> List[Optional[dict]]:
+        """Return the resource usage of the finished jobs.
+
+        The usage is a dictionary of the measurements such as
+        ``wall_time``, ``cpu_time`` and ``max_rss`` or None if not
+        known for the job.
+        """
+        return [None for _ in jobs]
+
     @classmethod
     def cancel(cls, job_id, cwd):
         raise NotImplementedError
@@ -253,3 +266,106 @@ def mklink(src, dst):
             os.link(src, dst)
         except OSError:
             shutil.copyfile(src, dst)
+
+
+_runner_sh_tpl = pkg_resources.resource_string(__name__, "runner.sh.tpl").decode()
+# runs the script listed in the task table line of the array task
+_array_sh_tpl = '''\
+#!/usr/bin/env sh
+script=$(sed -n "${{{task_id_var}}}p" {table})
+cd "$(dirname "$script")" || exit 1
+exec sh "$script" > stdout 2> stderr
+'''
+
+
+def write_run_script(cmd: List[str], cwd) -> str:
+    """Write the script running the command and recording its exit
+    status in the ``finished`` file to the working directory.
+
+    :return: path to the script
+    """
+    fd, path = tempfile.mkstemp(prefix='run', suffix='.sh', dir=cwd)
+    cmd = str.join(' ', map(shlex.quote, cmd))
+    with open(fd, 'w') as f:
+        f.write(_runner_sh_tpl.format(cmd=cmd))
+    return path
+
+
+def write_array_script(commands: List[Tuple[List[str], str]],
+                       task_id_var) -> str:
+    """Write the script running the commands as the tasks of an array job.
+
+    The run script of each command is written to its working
+    directory and the paths of the scripts are listed in the task
+    table, one per line in the order of task ids starting from 1,
+    which is stored together with the array script in the first
+    working directory.
+
+    :param commands: command arguments and working directory pairs
+    :param task_id_var: environment variable containing the task id
+    :return: path to the array script
+    """
+    scripts = [write_run_script(cmd, cwd) for cmd, cwd in commands]
+    array_dir = commands[0][1]
+    fd, table = tempfile.mkstemp(prefix='array', suffix='.tasks', dir=array_dir)
+    with open(fd, 'w') as f:
+        f.writelines(path + '\n' for path in scripts)
+    fd, path = tempfile.mkstemp(prefix='array', suffix='.sh', dir=array_dir)
+    with open(fd, 'w') as f:
+        f.write(_array_sh_tpl.format(
+            task_id_var=task_id_var, table=shlex.quote(table)))
+    return path
+
+
+def parse_task_ids(spec: str) -> Iterable[int]:
+    """Expand the task ids of the array job e.g. ``1-7:2,10``."""
+    for item in spec.split(','):
+        first, _, step = item.partition(':')
+        start, _, stop = first.partition('-')
+        yield from range(int(start), int(stop or start) + 1, int(step or 1))
+
+
+def read_finished_state(cwd) -> Optional[JobStatus]:
+    """Return the state of the job from the exit status written to
+    the ``finished`` file by the run script, or None if not written."""
+    try:
+        with open(os.path.join(cwd, 'finished')) as fp:
+            return_code = int(fp.read())
+    except (FileNotFoundError, ValueError):
+        return None
+    return (
+        JobStatus.COMPLETED if return_code == 0 else
+        JobStatus.ERROR if return_code == 127 else
+        JobStatus.FAILED
+    )
+
+
+class FinishedFileWatch:
+    """States of the jobs which left the queueing system read from
+    their ``finished`` files.
+
+    The file may appear on a shared file system some time after the
+    job ended, so the job is reported running until it does or until
+    ``grace_period`` passes, after which it is considered interrupted.
+    The jobs found in the queueing system must be discarded, so the
+    grace period starts over once they leave it again.
+    """
+
+    def __init__(self, grace_period=timedelta(minutes=1)):
+        self.grace_period = grace_period
+        self._missing_since = {}  # type: Dict[Any, datetime]
+
+    def get_state(self, job_id, cwd) -> JobStatus:
+        state = read_finished_state(cwd)
+        if state is not None:
+            self._missing_since.pop(job_id, None)
+            return state
+        missing_since = self._missing_since.setdefault(job_id, datetime.now())
+        if datetime.now() - missing_since < self.grace_period:
+            return JobStatus.RUNNING
+        del self._missing_since[job_id]
+        return JobStatus.INTERRUPTED
+
+    def discard(self, job_id):
+        """Forget the job whose state was obtained otherwise."""
+        self._missing_since.pop(job_id, None)
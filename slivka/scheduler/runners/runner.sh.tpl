@@ -1,4 +1,8 @@
 #!/usr/bin/env sh
 touch started
 {cmd}
-echo $? > finished
+status=$?
+echo $status > finished
+# grid engine reschedules jobs exiting with 99 and holds those exiting with 100
+case $status in 99|100) exit 1;; esac
+exit $status
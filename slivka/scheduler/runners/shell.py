@@ -1,47 +1,172 @@
 import contextlib
 import logging
 import os
+import select
+import signal
 import subprocess
+import threading
+import time
+from typing import Dict, Optional, Tuple
 
 from slivka import JobStatus
-from .runner import Runner
+from .runner import Runner, read_finished_state, write_run_script
 
 log = logging.getLogger('slivka.scheduler')
 
 
+def _read_start_time(pid) -> Optional[int]:
+    """Return the start time of the process in clock ticks since boot.
+
+    :return: start time or None if the process does not exist or
+        is a zombie
+    """
+    try:
+        with open('/proc/%d/stat' % pid) as f:
+            stat = f.read()
+    except (OSError, ValueError):
+        return None
+    # the command name may contain spaces and parentheses
+    fields = stat[stat.rindex(')') + 2:].split()
+    if fields[0] == 'Z':
+        return None
+    return int(fields[19])
+
+
+def _parse_job_id(job_id) -> Tuple[int, Optional[int]]:
+    """Split the ``pid:start_time`` job id.
+
+    Job ids consisting of the pid alone have no start time.
+    """
+    pid, _, start_time = str(job_id).partition(':')
+    return int(pid), int(start_time) if start_time else None
+
+
+class _ChildWatcher:
+    """Reaps the exited job processes in a background thread.
+
+    The processes are watched through their pid file descriptors
+    so the thread only wakes up when one of them exits. Where those
+    are not supported, the processes are polled once a second.
+    """
+
+    poll_interval = 1.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._procs = {}  # type: Dict[int, subprocess.Popen]
+        self._pidfds = {}  # type: Dict[int, int]
+        self._poll = None
+        self._wakeup = None
+        self._thread = None
+
+    def __contains__(self, pid):
+        return pid in self._procs
+
+    def add(self, proc: subprocess.Popen):
+        with self._lock:
+            if self._thread is None:
+                self._start()
+            self._procs[proc.pid] = proc
+            pidfd_open = getattr(os, 'pidfd_open', None)
+            if pidfd_open is not None and self._poll is not None:
+                try:
+                    fd = pidfd_open(proc.pid)
+                except OSError:
+                    pass
+                else:
+                    self._pidfds[fd] = proc.pid
+                    self._poll.register(fd, select.POLLIN)
+            if self._wakeup is not None:
+                os.write(self._wakeup[1], b'\0')
+
+    def _start(self):
+        if hasattr(os, 'pidfd_open'):
+            self._poll = select.poll()
+            self._wakeup = os.pipe()
+            self._poll.register(self._wakeup[0], select.POLLIN)
+        self._thread = threading.Thread(
+            target=self._run, name='ShellRunnerChildWatcher', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            if self._poll is None:
+                time.sleep(self.poll_interval)
+                with self._lock:
+                    pids = list(self._procs)
+            else:
+                events = self._poll.poll(self.poll_interval * 1000)
+                with self._lock:
+                    pids = []
+                    for fd, _ in events:
+                        if fd == self._wakeup[0]:
+                            os.read(fd, 4096)
+                        elif fd in self._pidfds:
+                            pids.append(self._pidfds.pop(fd))
+                            self._poll.unregister(fd)
+                            os.close(fd)
+                    # processes which could not be given a pidfd
+                    watched = set(self._pidfds.values())
+                    pids.extend(pid for pid in self._procs
+                                if pid not in watched)
+            self._reap(pids)
+
+    def _reap(self, pids):
+        for pid in pids:
+            proc = self._procs.get(pid)
+            if proc is not None and proc.poll() is not None:
+                with self._lock:
+                    del self._procs[pid]
+
+
 class ShellRunner(Runner):
-    procs = {}
+    """Runs the jobs as the child processes of the scheduler.
+
+    Each job is started in its own session using the runner script
+    which writes the exit status of the command to the ``finished``
+    file. The job id combines the pid and the start time of the
+    process, so the jobs started before the scheduler was restarted
+    are found in ``/proc`` and recycled pids are not mistaken for them.
+    """
+
+    watcher = _ChildWatcher()
 
     def submit(self, cmd, cwd):
-        proc = subprocess.Popen(
-            cmd,
-            stdout=open(os.path.join(cwd, 'stdout'), 'wb'),
-            stderr=open(os.path.join(cwd, 'stderr'), 'wb'),
-            cwd=cwd,
-            env=self.env,
-            shell=True
-        )
-        self.procs[proc.pid] = proc
-        return proc.pid
+        path = write_run_script(cmd, cwd)
+        with open(os.path.join(cwd, 'stdout'), 'wb') as stdout, \
+                open(os.path.join(cwd, 'stderr'), 'wb') as stderr:
+            proc = subprocess.Popen(
+                ['sh', path],
+                stdout=stdout,
+                stderr=stderr,
+                cwd=cwd,
+                env=self.env,
+                start_new_session=True
+            )
+        self.watcher.add(proc)
+        start_time = _read_start_time(proc.pid)
+        if start_time is None:
+            return str(proc.pid)
+        return '%d:%d' % (proc.pid, start_time)
+
+    @classmethod
+    def _is_running(cls, pid, start_time) -> bool:
+        if start_time is None:
+            return pid in cls.watcher
+        return _read_start_time(pid) == start_time
 
     @classmethod
-    def check_status(cls, pid, cwd):
-        try:
-            return_code = cls.procs[pid].poll()
-        except KeyError:
-            return JobStatus.INTERRUPTED
-        if return_code is None:
+    def check_status(cls, job_id, cwd):
+        pid, start_time = _parse_job_id(job_id)
+        if cls._is_running(pid, start_time):
             return JobStatus.RUNNING
-        if return_code == 0:
-            return JobStatus.COMPLETED
-        if return_code == 127:
-            return JobStatus.ERROR
-        if return_code > 0:
-            return JobStatus.FAILED
-        if return_code < 0:
-            return JobStatus.INTERRUPTED
+        # the process is gone without writing the file if it was killed
+        return read_finished_state(cwd) or JobStatus.INTERRUPTED
 
     @classmethod
-    def cancel(cls, pid, cwd):
-        with contextlib.suppress(OSError, KeyError):
-            cls.procs[pid].terminate()
+    def cancel(cls, job_id, cwd):
+        pid, start_time = _parse_job_id(job_id)
+        if cls._is_running(pid, start_time):
+            # the process leads its own group which includes the command
+            with contextlib.suppress(OSError):
+                os.killpg(pid, signal.SIGTERM)
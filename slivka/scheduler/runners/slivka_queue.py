@@ -13,8 +13,13 @@ log = logging.getLogger('slivka.scheduler')
 class SlivkaQueueRunner(Runner):
     client = None  # type: LocalQueueClient
 
-    def __init__(self, command_def, id=None):
+    def __init__(self, command_def, id=None, cpus=1, memory=0, limits=None,
+                 priority=0):
         super().__init__(command_def, id)
+        self.cpus = cpus
+        self.memory = memory
+        self.limits = limits
+        self.priority = priority
         if self.client is None:
             SlivkaQueueRunner.client = LocalQueueClient(
                 slivka.settings.slivka_queue_address
@@ -24,15 +29,37 @@ class SlivkaQueueRunner(Runner):
         response = self.client.submit_job(
             cmd=str.join(' ', map(shlex.quote, cmd)),
             cwd=cwd,
-            env=self.env
+            env=self.env,
+            cpus=self.cpus,
+            memory=self.memory,
+            limits=self.limits,
+            priority=self.priority
         )
         return response.id
 
+    def batch_submit(self, commands):
+        responses = self.client.submit_jobs(
+            ((str.join(' ', map(shlex.quote, cmd)), cwd, self.env)
+             for cmd, cwd in commands),
+            cpus=self.cpus, memory=self.memory, limits=self.limits,
+            priority=self.priority
+        )
+        return [response.id for response in responses]
+
     @classmethod
     def check_status(cls, identifier, cwd):
         response = cls.client.get_job_status(identifier)
         return JobStatus(response.state)
 
+    @classmethod
+    def batch_check_status(cls, jobs):
+        responses = cls.client.get_job_statuses(job.job_id for job in jobs)
+        return [JobStatus(response.state) for response in responses]
+
     @classmethod
     def cancel(cls, job_id, cwd):
         cls.client.cancel_job(job_id)
+
+    @classmethod
+    def batch_cancel(cls, jobs):
+        cls.client.cancel_jobs(job['job_id'] for job in jobs)
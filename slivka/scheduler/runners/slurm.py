@@ -0,0 +1,233 @@
+import atexit
+import getpass
+import json
+import logging
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Tuple, List, Dict, Optional
+
+from slivka import JobStatus
+from slivka.db.documents import JobMetadata
+from .runner import (Runner, FinishedFileWatch, parse_task_ids,
+                     write_array_script, write_run_script)
+
+log = logging.getLogger('slivka.scheduler')
+
+# states of the jobs which did not finish yet as reported by squeue
+_active_states = {
+    'PENDING': JobStatus.QUEUED,
+    'CONFIGURING': JobStatus.QUEUED,
+    'REQUEUED': JobStatus.QUEUED,
+    'REQUEUE_FED': JobStatus.QUEUED,
+    'REQUEUE_HOLD': JobStatus.QUEUED,
+    'RESV_DEL_HOLD': JobStatus.QUEUED,
+    'RUNNING': JobStatus.RUNNING,
+    'COMPLETING': JobStatus.RUNNING,
+    'RESIZING': JobStatus.RUNNING,
+    'SIGNALING': JobStatus.RUNNING,
+    'STAGE_OUT': JobStatus.RUNNING,
+    'SUSPENDED': JobStatus.RUNNING,
+    'STOPPED': JobStatus.RUNNING,
+}
+
+# states of the finished jobs as reported by sacct
+_final_states = {
+    'COMPLETED': JobStatus.COMPLETED,
+    'FAILED': JobStatus.FAILED,
+    'OUT_OF_MEMORY': JobStatus.FAILED,
+    'CANCELLED': JobStatus.INTERRUPTED,
+    'DEADLINE': JobStatus.INTERRUPTED,
+    'PREEMPTED': JobStatus.INTERRUPTED,
+    'TIMEOUT': JobStatus.INTERRUPTED,
+    'BOOT_FAIL': JobStatus.ERROR,
+    'NODE_FAIL': JobStatus.ERROR,
+    'REVOKED': JobStatus.ERROR,
+}
+
+_executor = ThreadPoolExecutor()
+atexit.register(_executor.shutdown)
+
+
+def _number(value):
+    """Unwrap the numbers which newer slurm versions put in objects."""
+    if isinstance(value, dict):
+        return value.get('number') if value.get('set', True) else None
+    return value
+
+
+def _parse_squeue_json(data: dict) -> Dict[str, JobStatus]:
+    """Return the states of the jobs and array tasks listed by squeue.
+
+    Array tasks are keyed by the ``job_id_task_id`` identifiers.
+    """
+    states = {}
+    for job in data.get('jobs', []):
+        state = job.get('job_state')
+        if isinstance(state, list):
+            state = state[0] if state else None
+        state = _active_states.get(state)
+        if state is None:
+            # finished jobs are looked up in the accounting
+            continue
+        array_job_id = _number(job.get('array_job_id'))
+        task_id = _number(job.get('array_task_id'))
+        tasks = (job.get('array_task_string') or '').strip('[]')
+        if array_job_id and task_id is not None:
+            states['%d_%d' % (array_job_id, task_id)] = state
+        elif array_job_id and tasks:
+            # pending tasks are listed together, e.g. 1-9%2
+            for task_id in parse_task_ids(tasks.partition('%')[0]):
+                states['%d_%d' % (array_job_id, task_id)] = state
+        else:
+            states[str(_number(job['job_id']))] = state
+    return states
+
+
+def _parse_sacct(stdout: str) -> Dict[str, JobStatus]:
+    """Return the final states of the jobs listed by sacct.
+
+    The lines are expected in the ``JobID|State|ExitCode`` format.
+    Job steps and the jobs which did not finish are skipped.
+    """
+    states = {}
+    for line in stdout.splitlines():
+        try:
+            job_id, state, exit_code = line.split('|')[:3]
+        except ValueError:
+            continue
+        if '.' in job_id:
+            continue
+        # e.g. "CANCELLED by 1000"
+        state = _final_states.get(state.split(' ')[0])
+        if state is None:
+            continue
+        if state == JobStatus.FAILED and exit_code.split(':')[0] == '127':
+            state = JobStatus.ERROR
+        states[job_id] = state
+    return states
+
+
+class SlurmRunner(Runner):
+    finished_files = FinishedFileWatch()
+    # number of job ids passed to a single sacct call
+    sacct_batch_size = 1000
+    # whether the failure of sacct was logged already
+    _sacct_failed = False
+
+    def __init__(self, command_def, id=None, sbatch_args=(), array_jobs=False):
+        """
+        :param sbatch_args: arguments passed to sbatch
+        :param array_jobs: submit the batches of jobs as a single
+            array job whose tasks run the jobs
+        """
+        super().__init__(command_def, id)
+        self.sbatch_args = sbatch_args
+        self.array_jobs = array_jobs
+        self.env.update(
+            (env, os.getenv(env)) for env in os.environ
+            if env.startswith('SLURM')
+        )
+
+    def _sbatch(self, args, cwd) -> str:
+        proc = subprocess.run(
+            ['sbatch', '--parsable', '--export=ALL', *args],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            cwd=cwd,
+            env=self.env,
+            universal_newlines=True
+        )
+        proc.check_returncode()
+        # the output is "job_id" or "job_id;cluster"
+        return proc.stdout.strip().split(';')[0]
+
+    def submit(self, cmd, cwd):
+        path = write_run_script(cmd, cwd)
+        return self._sbatch(
+            ['--chdir', cwd, '--output', 'stdout', '--error', 'stderr',
+             *self.sbatch_args, path],
+            cwd
+        )
+
+    def batch_submit(self, commands: Iterable[Tuple[List, str]]):
+        """
+        :param commands: iterable of args list and cwd path pairs
+        :return: list of identifiers
+        """
+        commands = list(commands)
+        if self.array_jobs and len(commands) > 1:
+            return self.submit_array(commands)
+        def submit_wrapper(args): return self.submit(*args)
+        return list(_executor.map(submit_wrapper, commands))
+
+    def submit_array(self, commands: List[Tuple[List, str]]):
+        """Submit the commands as the tasks of one array job.
+
+        :return: list of ``job_id_task_id`` identifiers
+        """
+        path = write_array_script(commands, 'SLURM_ARRAY_TASK_ID')
+        array_dir = commands[0][1]
+        job_id = self._sbatch(
+            ['--chdir', array_dir, '--array', '1-%d' % len(commands),
+             '--output', os.devnull, '--error', os.devnull,
+             *self.sbatch_args, path],
+            array_dir
+        )
+        return ['%s_%d' % (job_id, task_id)
+                for task_id in range(1, len(commands) + 1)]
+
+    @classmethod
+    def check_status(cls, job_id, cwd):
+        job = dict(job_id=job_id, work_dir=cwd)
+        return next(iter(cls.batch_check_status([job])))
+
+    @classmethod
+    def batch_check_status(cls, jobs):
+        jobs = list(jobs)
+        proc = subprocess.run(
+            ['squeue', '--json', '--user', getpass.getuser()],
+            stdout=subprocess.PIPE, check=True, universal_newlines=True
+        )
+        states = _parse_squeue_json(json.loads(proc.stdout))
+        missing = [job['job_id'] for job in jobs
+                   if job['job_id'] not in states]
+        for i in range(0, len(missing), cls.sacct_batch_size):
+            try:
+                proc = subprocess.run(
+                    ['sacct', '--noheader', '--parsable2',
+                     '--format', 'JobID,State,ExitCode',
+                     '--jobs',
+                     str.join(',', missing[i:i + cls.sacct_batch_size])],
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                    check=True, universal_newlines=True
+                )
+            except (subprocess.CalledProcessError, OSError) as e:
+                if not cls._sacct_failed:
+                    cls._sacct_failed = True
+                    log.warning(
+                        "sacct failed, the states of the finished slurm "
+                        "jobs are read from the finished files: %s",
+                        getattr(e, 'stderr', None) or e)
+                break
+            states.update(_parse_sacct(proc.stdout))
+        return [cls._job_state(job, states.get(job['job_id']))
+                for job in jobs]
+
+    @classmethod
+    def _job_state(cls, job, state: Optional[JobStatus]) -> JobStatus:
+        if state is None:
+            # not accounted yet or the accounting is disabled
+            return cls.finished_files.get_state(job['job_id'], job['work_dir'])
+        cls.finished_files.discard(job['job_id'])
+        return state
+
+    @classmethod
+    def cancel(cls, job_id, cwd):
+        subprocess.run(['scancel', job_id])
+
+    @classmethod
+    def batch_cancel(cls, jobs: Iterable[JobMetadata]):
+        job_ids = [job['job_id'] for job in jobs]
+        if job_ids:
+            subprocess.run(['scancel', *job_ids])
@@ -28,6 +28,9 @@ class PrefixMiddleware:
 def init():
     """Initializes server configuration from settings."""
     FormLoader().read_settings()
+    import slivka.db
+    from slivka.db.helpers import create_indexes
+    create_indexes(slivka.db.database)
 
 
 def create_app(prefix=None):
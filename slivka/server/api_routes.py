@@ -14,6 +14,7 @@ from slivka.db import database, documents
 from slivka.db.helpers import insert_one
 from . import JsonResponse
 from .forms import FormLoader
+from .forms.fields import IntegerField, ValidationError
 from ..db.documents import ServiceState
 
 bp = flask.Blueprint('api', __name__, url_prefix='/api/v1')
@@ -79,8 +80,23 @@ def post_service_form(service):
         raise abort(404)
     form_cls = FormLoader.instance[service]
     form = form_cls(request.form, request.files)
+    max_priority = slivka.settings.services[service].command.get(
+        'max-priority', 0)
+    priority_field = IntegerField(
+        'priority', min=0, max=max_priority, default=0, required=False)
+    try:
+        priority = priority_field.validate(request.args.get('priority'))
+    except ValidationError as error:
+        return JsonResponse({
+            'statuscode': 420,
+            'error': 'Invalid data',
+            'errors': [{'field': 'priority',
+                        'message': error.message,
+                        'errorCode': error.code}]
+        }, status=420)
     if form.is_valid():
-        request_doc = form.save(database)
+        request_doc = form.save(
+            database, priority=priority, client=_client_id())
         resource_location = url_for('.get_job_status', uuid=request_doc.uuid)
         return JsonResponse(
             {
@@ -104,6 +120,21 @@ def post_service_form(service):
         }, status=420)
 
 
+def _client_id():
+    """Identify the client submitting the request.
+
+    The value of the header set in ``CLIENT_ID_HEADER`` is used if
+    present, taking the first entry of comma-separated lists such as
+    ``X-Forwarded-For``; otherwise the remote address.
+    """
+    header = slivka.settings.client_id_header
+    if header is not None:
+        value = request.headers.get(header)
+        if value:
+            return value.split(',')[0].strip()
+    return request.remote_addr
+
+
 @bp.route('/servicemonitor', methods=['GET'])
 def service_monitor():
     states = ServiceState.find(slivka.db.database)
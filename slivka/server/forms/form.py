@@ -101,12 +101,13 @@ class BaseForm(metaclass=DeclarativeFormMetaclass):
     def __getitem__(self, item):
         return self.fields[item]
 
-    def save(self, database) -> JobRequest:
+    def save(self, database, **kwargs) -> JobRequest:
         """
         If the form is valid, saves a new request to the database containing
         the cleaned input data.
 
         :param database: mongo database instance
+        :param kwargs: additional fields of the request e.g. client
         :return: created request
         """
         if not self.is_valid():
@@ -115,7 +116,7 @@ class BaseForm(metaclass=DeclarativeFormMetaclass):
         for name, field in self.fields.items():
             value = self.cleaned_data[name]
             inputs[name] = field.serialize_value(value)
-        request = JobRequest(service=self.service, inputs=inputs)
+        request = JobRequest(service=self.service, inputs=inputs, **kwargs)
         request.insert(database)
         return request
 
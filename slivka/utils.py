@@ -90,6 +90,11 @@ class BackoffCounter:
         """ Indicates whether the max attempts has been reached. """
         return self._tries >= self.max_tries
 
+    @property
+    def tries(self):
+        """ Number of consecutive failures. """
+        return self._tries
+
     def next(self):
         """
         Returns the remaining delay
@@ -0,0 +1,49 @@
+import mongomock
+from nose.tools import assert_in, assert_true, assert_false
+
+from slivka.db.documents import JobRequest, JobMetadata, ServiceState
+from slivka.db.helpers import create_indexes, _is_collection_scan
+
+
+def test_indexes_created():
+    database = mongomock.MongoClient().slivkadb
+    create_indexes(database)
+    indexes = database[JobRequest.__collection__].index_information()
+    assert_in('uuid_1', indexes)
+    assert_in('status_1_service_1_runner_1_timestamp_1', indexes)
+    indexes = database[ServiceState.__collection__].index_information()
+    assert_in('service_1_runner_1', indexes)
+
+
+def test_selected_documents_indexed():
+    database = mongomock.MongoClient().slivkadb
+    create_indexes(database, [JobMetadata])
+    assert_in('uuid_1', database[JobMetadata.__collection__].index_information())
+    assert_false(database.list_collection_names().count(JobRequest.__collection__))
+
+
+def test_create_indexes_idempotent():
+    database = mongomock.MongoClient().slivkadb
+    create_indexes(database)
+    create_indexes(database)
+
+
+def test_collection_scan_detected():
+    plan = {'stage': 'FETCH', 'inputStage': {'stage': 'COLLSCAN'}}
+    assert_true(_is_collection_scan(plan))
+
+
+def test_index_scan_not_detected():
+    plan = {
+        'stage': 'SORT',
+        'inputStage': {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN'}}
+    }
+    assert_false(_is_collection_scan(plan))
+
+
+def test_collection_scan_in_or_branch():
+    plan = {'stage': 'SUBPLAN', 'inputStage': {
+        'stage': 'OR',
+        'inputStages': [{'stage': 'IXSCAN'}, {'stage': 'COLLSCAN'}]
+    }}
+    assert_true(_is_collection_scan(plan))
@@ -0,0 +1,147 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+
+from nose.tools import (assert_equal, assert_list_equal, assert_in,
+                        assert_not_in)
+
+from slivka import JobStatus
+from slivka.local_queue import LocalQueueClient, Coordinator, WorkerAgent
+from slivka.local_queue.core import Job
+
+
+def create_coordinator():
+    return Coordinator('localhost:0', 'localhost:0', secret=b'secret')
+
+
+def queue_jobs(coordinator, *jobs):
+    for job in jobs:
+        coordinator.jobs[job.id] = job
+        coordinator.queue.push(job)
+
+
+def test_pull_jobs_fitting_agent():
+    coordinator = create_coordinator()
+    jobs = [Job('', '', cpus=2), Job('', '', cpus=4), Job('', '', cpus=1)]
+    queue_jobs(coordinator, *jobs)
+    response = coordinator.do_PULL({'agent': 'a', 'cpus': 3, 'memory': None})
+    assert_list_equal(
+        [item['id'] for item in response['jobs']], [jobs[0].id, jobs[2].id])
+    assert_equal(jobs[0].state, JobStatus.RUNNING)
+    assert_equal(jobs[1].state, JobStatus.QUEUED)
+
+
+def test_pull_limited_by_memory():
+    coordinator = create_coordinator()
+    jobs = [Job('', '', memory=500), Job('', '', memory=500)]
+    queue_jobs(coordinator, *jobs)
+    response = coordinator.do_PULL({'agent': 'a', 'cpus': 4, 'memory': 800})
+    assert_equal(len(response['jobs']), 1)
+
+
+def test_state_reported():
+    coordinator = create_coordinator()
+    job = Job('', '')
+    queue_jobs(coordinator, job)
+    coordinator.do_PULL({'agent': 'a', 'cpus': 1})
+    coordinator.do_STATE({'agent': 'a', 'jobs': [{
+        'id': job.id, 'state': JobStatus.COMPLETED, 'returncode': 0,
+        'usage': {'cpu_time': 0.1}
+    }]})
+    assert_equal(job.state, JobStatus.COMPLETED)
+    assert_equal(job.return_code, 0)
+    assert_equal(job.usage, {'cpu_time': 0.1})
+    assert_not_in(job.id, coordinator.agents['a'].jobs)
+
+
+def test_cancel_forwarded_to_agent():
+    coordinator = create_coordinator()
+    job = Job('', '')
+    queue_jobs(coordinator, job)
+    coordinator.do_PULL({'agent': 'a', 'cpus': 1})
+    coordinator.do_CANCEL({'id': job.id})
+    response = coordinator.do_PULL({'agent': 'a', 'cpus': 0})
+    assert_in(job.id, response['cancel'])
+
+
+def test_lost_jobs_queued_again():
+    coordinator = create_coordinator()
+    jobs = [Job('', ''), Job('', '')]
+    queue_jobs(coordinator, *jobs)
+    coordinator.do_PULL({'agent': 'a', 'cpus': 2, 'held': []})
+    # the response was lost, the agent only got the first job
+    response = coordinator.do_PULL(
+        {'agent': 'a', 'cpus': 0, 'held': [jobs[0].id]})
+    assert_equal(response['jobs'], [])
+    assert_equal(jobs[0].state, JobStatus.RUNNING)
+    assert_equal(jobs[1].state, JobStatus.QUEUED)
+    assert_not_in(jobs[1].id, coordinator.agents['a'].jobs)
+    response = coordinator.do_PULL(
+        {'agent': 'a', 'cpus': 1, 'held': [jobs[0].id]})
+    assert_list_equal([item['id'] for item in response['jobs']], [jobs[1].id])
+
+
+def test_jobs_of_lost_agent_interrupted():
+    coordinator = create_coordinator()
+    coordinator.agent_timeout = 0.03
+    job = Job('', '')
+    queue_jobs(coordinator, job)
+    coordinator.do_PULL({'agent': 'a', 'cpus': 1})
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(coordinator._agent_monitor())
+    loop.run_until_complete(asyncio.sleep(0.1))
+    task.cancel()
+    loop.run_until_complete(asyncio.gather(task, return_exceptions=True))
+    loop.close()
+    assert_equal(job.state, JobStatus.INTERRUPTED)
+    assert_not_in('a', coordinator.agents)
+
+
+def run_in_thread(queue):
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=queue.run, args=(loop,))
+    thread.start()
+    return loop, thread
+
+
+class TestCoordinatorAgents:
+    def setup(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        address = 'unix://' + os.path.join(self.tmp_dir.name, 'queue.sock')
+        agent_address = 'unix://' + os.path.join(self.tmp_dir.name, 'agents.sock')
+        self.coordinator = Coordinator(address, agent_address, secret=b'secret')
+        self.agents = [
+            WorkerAgent(agent_address, name='agent-%d' % i, secret=b'secret',
+                        cpus=2)
+            for i in range(2)
+        ]
+        for agent in self.agents:
+            agent.poll_interval = 0.05
+        self.threads = [run_in_thread(queue)
+                        for queue in [self.coordinator, *self.agents]]
+        self.client = LocalQueueClient(address, timeout=1)
+
+    def teardown(self):
+        for (loop, thread), queue in zip(
+                self.threads, [self.coordinator, *self.agents]):
+            loop.call_soon_threadsafe(queue.stop)
+            thread.join(5)
+            queue.close(loop)
+            loop.close()
+        self.client.socket.close()
+        self.tmp_dir.cleanup()
+
+    def test_jobs_completed_by_agents(self):
+        jobs = self.client.submit_jobs(
+            ('true', self.tmp_dir.name, {}) for _ in range(6))
+        ids = [job.id for job in jobs]
+        end_time = time.time() + 10
+        while time.time() < end_time:
+            states = [job.state for job in self.client.get_job_statuses(ids)]
+            if all(state == JobStatus.COMPLETED for state in states):
+                break
+            time.sleep(0.05)
+        assert_list_equal(states, [JobStatus.COMPLETED] * 6)
+        assert_equal(set(self.coordinator.agents), {'agent-0', 'agent-1'})
@@ -0,0 +1,67 @@
+import asyncio
+import os
+import tempfile
+import threading
+
+from nose.tools import assert_equal, assert_list_equal
+
+from slivka import JobStatus
+from slivka.local_queue import LocalQueueClient
+from slivka.local_queue.core import LocalQueue
+
+
+def run_until_cancelled(loop, task):
+    try:
+        loop.run_until_complete(task)
+    except asyncio.CancelledError:
+        pass
+
+
+class TestBatchMessages:
+    def setup(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        address = 'unix://' + os.path.join(self.tmp_dir.name, 'queue.sock')
+        self.queue = LocalQueue(address, secret=b'secret')
+        self.loop = asyncio.new_event_loop()
+        # only the server is started so the jobs remain queued
+        self.server = self.loop.create_task(self.queue.serve_forever())
+        self.thread = threading.Thread(
+            target=run_until_cancelled, args=(self.loop, self.server))
+        self.thread.start()
+        self.client = LocalQueueClient(address, timeout=1)
+
+    def teardown(self):
+        self.loop.call_soon_threadsafe(self.server.cancel)
+        self.thread.join(5)
+        self.loop.close()
+        self.client.socket.close(0)
+        self.tmp_dir.cleanup()
+
+    def submit(self, count):
+        return self.client.submit_jobs(
+            ('true', self.tmp_dir.name, {}) for _ in range(count))
+
+    def test_submit_jobs(self):
+        responses = self.submit(3)
+        assert_equal(len(responses), 3)
+        assert_equal(len({response.id for response in responses}), 3)
+        assert_equal(len(self.queue.jobs), 3)
+
+    def test_get_job_statuses(self):
+        ids = [response.id for response in self.submit(3)]
+        responses = self.client.get_job_statuses(ids)
+        assert_list_equal([response.id for response in responses], ids)
+        assert_list_equal(
+            [response.state for response in responses], [JobStatus.QUEUED] * 3
+        )
+
+    def test_cancel_jobs(self):
+        ids = [response.id for response in self.submit(2)]
+        self.client.cancel_jobs(ids)
+        states = [response.state for response in self.client.get_job_statuses(ids)]
+        assert_list_equal(states, [JobStatus.INTERRUPTED] * 2)
+
+    def test_release_jobs(self):
+        ids = [response.id for response in self.submit(2)]
+        self.client.release_jobs(ids)
+        assert_equal(len(self.queue.jobs), 0)
@@ -0,0 +1,27 @@
+from nose.tools import assert_equal, assert_is_none, assert_is_not_none
+
+from slivka.local_queue.benchmark import percentile, run_benchmark
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert_equal(percentile(values, 50), 50)
+    assert_equal(percentile(values, 99), 99)
+    assert_equal(percentile(values, 100), 100)
+    assert_equal(percentile([3.0], 90), 3.0)
+    assert_is_none(percentile([], 50))
+
+
+def test_run_benchmark():
+    result = run_benchmark(clients=2, jobs=10, batch_size=0)
+    assert_equal(result['jobs'], 10)
+    assert_equal(result['submit']['requests'], 10)
+    assert_equal(result['status']['requests'], 10)
+    assert_is_not_none(result['submit']['p99'])
+
+
+def test_run_benchmark_batched():
+    result = run_benchmark(clients=2, jobs=10, batch_size=3)
+    assert_equal(result['jobs'], 10)
+    # 5 jobs per client in batches of 3 and 2
+    assert_equal(result['submit']['requests'], 4)
@@ -0,0 +1,80 @@
+from nose.tools import (assert_equal, assert_is, assert_is_none,
+                        assert_not_in, assert_raises)
+
+from slivka import JobStatus
+from slivka.local_queue.core import Job
+from slivka.local_queue.jobtable import JobTable
+
+
+def finished_job(state=JobStatus.COMPLETED, return_code=0, usage=None):
+    job = Job('true', '/tmp', state=state)
+    job.return_code = return_code
+    job.usage = usage
+    return job
+
+
+def test_active_job_kept():
+    table = JobTable()
+    job = Job('true', '/tmp')
+    table[job.id] = job
+    assert_is(table[job.id], job)
+
+
+def test_finished_job_compacted():
+    table = JobTable()
+    job = finished_job(
+        JobStatus.FAILED, 3, {'wall_time': 1.5, 'cpu_time': 0.5, 'max_rss': 2048})
+    table[job.id] = job
+    table.finish(job)
+    record = table[job.id]
+    assert_equal(record.id, job.id)
+    assert_equal(record.state, JobStatus.FAILED)
+    assert_equal(record.return_code, 3)
+    assert_equal(record.usage,
+                 {'wall_time': 1.5, 'cpu_time': 0.5, 'max_rss': 2048})
+
+
+def test_missing_usage_preserved():
+    table = JobTable()
+    job = finished_job(usage=None)
+    table[job.id] = job
+    table.finish(job)
+    assert_is_none(table[job.id].usage)
+
+
+def test_deleted_job_not_finished():
+    table = JobTable()
+    job = finished_job()
+    table[job.id] = job
+    del table[job.id]
+    table.finish(job)
+    assert_not_in(job.id, table)
+    assert_equal(len(table), 0)
+
+
+def test_oldest_records_overwritten():
+    table = JobTable(max_finished=2)
+    jobs = [finished_job() for _ in range(3)]
+    for job in jobs:
+        table[job.id] = job
+        table.finish(job)
+    assert_not_in(jobs[0].id, table)
+    assert_equal(table[jobs[1].id].id, jobs[1].id)
+    assert_equal(table[jobs[2].id].id, jobs[2].id)
+    assert_equal(len(table), 2)
+
+
+def test_delete_record():
+    table = JobTable()
+    job = finished_job()
+    table.add_finished(job.id, job.state, job.return_code)
+    del table[job.id]
+    assert_not_in(job.id, table)
+    with assert_raises(KeyError):
+        del table[job.id]
+
+
+def test_environment_shared():
+    first = Job('true', '/tmp', env={'PATH': '/bin', 'LANG': 'C'})
+    second = Job('false', '/tmp', env={'LANG': 'C', 'PATH': '/bin'})
+    assert_is(first.env, second.env)
@@ -0,0 +1,132 @@
+import asyncio
+import os
+import tempfile
+import threading
+
+from nose.tools import assert_equal, assert_list_equal, assert_not_in
+
+from slivka import JobStatus
+from slivka.local_queue.core import Job, LocalQueue
+from slivka.local_queue.journal import Journal
+
+
+class TestJournal:
+    def setup(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'journal')
+        self.journal = Journal(self.path)
+        self.journal.open()
+
+    def teardown(self):
+        self.journal.close()
+        self.tmp_dir.cleanup()
+
+    def test_replay_submitted(self):
+        job = Job('true', '/tmp', priority=2)
+        self.journal.record_submit(job)
+        jobs = Journal(self.path).replay()
+        assert_equal(jobs[job.id]['cmd'], 'true')
+        assert_equal(jobs[job.id]['priority'], 2)
+        assert_equal(jobs[job.id]['state'], JobStatus.QUEUED)
+
+    def test_replay_state_change(self):
+        job = Job('true', '/tmp')
+        self.journal.record_submit(job)
+        job.state = JobStatus.COMPLETED
+        job.return_code = 0
+        self.journal.record_state(job)
+        jobs = Journal(self.path).replay()
+        assert_equal(jobs[job.id]['state'], JobStatus.COMPLETED)
+        assert_equal(jobs[job.id]['returncode'], 0)
+
+    def test_replay_deleted(self):
+        job = Job('true', '/tmp')
+        self.journal.record_submit(job)
+        self.journal.record_delete(job.id)
+        assert_not_in(job.id, Journal(self.path).replay())
+
+    def test_truncated_record_skipped(self):
+        job = Job('true', '/tmp')
+        self.journal.record_submit(job)
+        self.journal.close()
+        with open(self.path, 'a') as fp:
+            fp.write('{"op": "sta')
+        jobs = Journal(self.path).replay()
+        assert_equal(list(jobs), [job.id])
+
+    def test_compaction(self):
+        job = Job('true', '/tmp')
+        self.journal.record_submit(job)
+        for state in (JobStatus.RUNNING, JobStatus.COMPLETED):
+            job.state = state
+            self.journal.record_state(job)
+        self.journal.compact([job])
+        with open(self.path) as fp:
+            assert_equal(len(fp.readlines()), 1)
+        jobs = Journal(self.path).replay()
+        assert_equal(jobs[job.id]['state'], JobStatus.COMPLETED)
+
+    def test_records_kept_during_compaction(self):
+        jobs = [Job('true', '/tmp') for _ in range(2)]
+        self.journal.record_submit(jobs[0])
+        written = threading.Event()
+        write_snapshot = self.journal._write_snapshot
+
+        def blocking_write(path, records):
+            write_snapshot(path, records)
+            written.wait(5)
+        self.journal._write_snapshot = blocking_write
+
+        async def compact():
+            loop = asyncio.get_event_loop()
+            task = loop.create_task(self.journal.compact_async([jobs[0]], loop))
+            await asyncio.sleep(0.05)
+            jobs[0].state = JobStatus.RUNNING
+            self.journal.record_state(jobs[0])
+            self.journal.record_submit(jobs[1])
+            written.set()
+            await task
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(compact())
+        finally:
+            loop.close()
+        self.journal.record_delete(jobs[1].id)
+        with open(self.path) as fp:
+            assert_equal(len(fp.readlines()), 4)
+        replayed = Journal(self.path).replay()
+        assert_equal(list(replayed), [jobs[0].id])
+        assert_equal(replayed[jobs[0].id]['state'], JobStatus.RUNNING)
+
+
+class TestQueueRestore:
+    def setup(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'journal')
+        journal = Journal(self.path)
+        journal.open()
+        self.jobs = [Job('true', '/tmp') for _ in range(3)]
+        for job in self.jobs:
+            journal.record_submit(job)
+        self.jobs[1].state = JobStatus.RUNNING
+        journal.record_state(self.jobs[1])
+        self.jobs[2].state = JobStatus.COMPLETED
+        journal.record_state(self.jobs[2])
+        journal.close()
+        address = 'unix://' + os.path.join(self.tmp_dir.name, 'queue.sock')
+        self.queue = LocalQueue(address, secret=b'secret', journal=self.path)
+        self.queue.restore()
+
+    def teardown(self):
+        self.queue.journal.close()
+        self.tmp_dir.cleanup()
+
+    def test_states_restored(self):
+        assert_list_equal(
+            [self.queue.jobs[job.id].state for job in self.jobs],
+            [JobStatus.QUEUED, JobStatus.INTERRUPTED, JobStatus.COMPLETED]
+        )
+
+    def test_queued_jobs_resumed(self):
+        assert_equal(len(self.queue.queue), 1)
+        assert_equal(self.queue.queue.pop()[1].id, self.jobs[0].id)
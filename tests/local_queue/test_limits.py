@@ -0,0 +1,99 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+
+from nose.tools import (assert_equal, assert_greater, assert_is_not_none,
+                        assert_less, assert_false)
+
+from slivka import JobStatus
+from slivka.local_queue import LocalQueueClient
+from slivka.local_queue.core import LocalQueue
+
+
+def is_alive(pid):
+    try:
+        with open('/proc/%d/stat' % pid) as f:
+            # killed orphans may be left as zombies until reaped by init
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except FileNotFoundError:
+        return False
+
+
+class TestJobLimits:
+    def setup(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        address = 'unix://' + os.path.join(self.tmp_dir.name, 'queue.sock')
+        self.queue = LocalQueue(address, secret=b'secret', cpus=4)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.queue.run, args=(self.loop,))
+        self.thread.start()
+        self.client = LocalQueueClient(address, timeout=1)
+
+    def teardown(self):
+        self.loop.call_soon_threadsafe(self.queue.stop)
+        self.thread.join(5)
+        self.queue.close(self.loop)
+        self.loop.close()
+        self.client.socket.close()
+        self.tmp_dir.cleanup()
+
+    def wait_finished(self, job_id, timeout=10):
+        end_time = time.time() + timeout
+        while time.time() < end_time:
+            response = self.client.get_job_status(job_id)
+            if response.state not in (JobStatus.QUEUED, JobStatus.RUNNING):
+                return response
+            time.sleep(0.05)
+        raise AssertionError('job did not finish')
+
+    def test_usage_recorded(self):
+        job = self.client.submit_job('echo hello', self.tmp_dir.name, {})
+        response = self.wait_finished(job.id)
+        assert_equal(response.state, JobStatus.COMPLETED)
+        assert_is_not_none(response.usage)
+        assert_greater(response.usage['max_rss'], 0)
+        assert_greater(response.usage['wall_time'], 0)
+        with open(os.path.join(self.tmp_dir.name, 'stdout')) as f:
+            assert_equal(f.read(), 'hello\n')
+
+    def test_return_code_preserved(self):
+        job = self.client.submit_job('exit 3', self.tmp_dir.name, {})
+        response = self.wait_finished(job.id)
+        assert_equal(response.state, JobStatus.FAILED)
+        assert_equal(response.returncode, 3)
+
+    def test_wall_time_limit(self):
+        job = self.client.submit_job(
+            'sleep 5', self.tmp_dir.name, {}, limits={'wall_time': 0.2})
+        response = self.wait_finished(job.id, timeout=3)
+        assert_equal(response.state, JobStatus.INTERRUPTED)
+        assert_is_not_none(response.usage)
+
+    def test_wall_time_limit_enforced_on_ignored_signal(self):
+        self.queue.kill_grace = 0.3
+        start = time.monotonic()
+        job = self.client.submit_job(
+            "trap '' TERM; sleep 4", self.tmp_dir.name, {},
+            limits={'wall_time': 0.3})
+        response = self.wait_finished(job.id, timeout=3)
+        assert_equal(response.state, JobStatus.INTERRUPTED)
+        assert_less(time.monotonic() - start, 2)
+
+    def test_processes_left_behind_killed(self):
+        pid_file = os.path.join(self.tmp_dir.name, 'pid')
+        job = self.client.submit_job(
+            'sleep 10 & echo $! > %s' % pid_file, self.tmp_dir.name, {})
+        self.wait_finished(job.id)
+        with open(pid_file) as f:
+            pid = int(f.read())
+        time.sleep(0.1)
+        assert_false(is_alive(pid))
+
+    def test_cpu_time_limit(self):
+        job = self.client.submit_job(
+            'while :; do :; done', self.tmp_dir.name, {},
+            limits={'cpu_time': 1})
+        response = self.wait_finished(job.id, timeout=10)
+        assert_equal(response.state, JobStatus.INTERRUPTED)
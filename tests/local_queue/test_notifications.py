@@ -0,0 +1,56 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+
+from slivka import JobStatus
+from slivka.local_queue import LocalQueueClient, LocalQueueSubscriber
+from slivka.local_queue.core import LocalQueue
+
+
+class TestStateNotifications:
+    def setup(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        address = 'unix://' + os.path.join(self.tmp_dir.name, 'queue.sock')
+        notify_address = 'unix://' + os.path.join(self.tmp_dir.name, 'pub.sock')
+        self.queue = LocalQueue(address, secret=b'secret',
+                                notify_address=notify_address)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.queue.run, args=(self.loop,))
+        self.thread.start()
+        self.states = []
+        self.subscriber = LocalQueueSubscriber(
+            notify_address, self.states.append)
+        self.subscriber.start()
+        # give the subscriber time to connect before anything is published
+        time.sleep(0.2)
+        self.client = LocalQueueClient(address, timeout=1)
+
+    def teardown(self):
+        self.subscriber.cancel()
+        self.subscriber.join(5)
+        self.loop.call_soon_threadsafe(self.queue.stop)
+        self.thread.join(5)
+        self.queue.close(self.loop)
+        self.loop.close()
+        self.client.socket.close(0)
+        self.tmp_dir.cleanup()
+
+    def wait_for_state(self, job_id, state):
+        end_time = time.time() + 5
+        while time.time() < end_time:
+            if any(batch.get(job_id) == state for batch in self.states):
+                return True
+            time.sleep(0.02)
+        return False
+
+    def test_completion_published(self):
+        job = self.client.submit_job('true', self.tmp_dir.name, {})
+        assert self.wait_for_state(job.id, JobStatus.COMPLETED)
+
+    def test_cancellation_published(self):
+        job = self.client.submit_job('sleep 10', self.tmp_dir.name, {})
+        assert self.wait_for_state(job.id, JobStatus.RUNNING)
+        self.client.cancel_job(job.id)
+        assert self.wait_for_state(job.id, JobStatus.INTERRUPTED)
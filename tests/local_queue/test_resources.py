@@ -0,0 +1,129 @@
+import time
+from types import SimpleNamespace
+
+from nose.tools import assert_equal, assert_list_equal
+
+from slivka import JobStatus
+from slivka.local_queue.core import Job, LocalQueue
+
+
+class QueueStub(LocalQueue):
+    def __init__(self, **kwargs):
+        super().__init__('localhost:0', secret=b'secret', **kwargs)
+        self.loop = SimpleNamespace(time=time.monotonic)
+        self.started = []
+
+    def _start(self, job, loop):
+        self.started.append(job)
+        self.free_cpus -= job.cpus
+        if self.memory is not None:
+            self.free_memory -= job.memory
+
+    def finish(self, job):
+        self.free_cpus += job.cpus
+        if self.memory is not None:
+            self.free_memory += job.memory
+
+    def submit(self, *jobs):
+        for job in jobs:
+            self.jobs[job.id] = job
+            self.queue.push(job)
+        self._start_pending(self.loop)
+
+
+def test_jobs_packed_by_cpus():
+    queue = QueueStub(cpus=4)
+    jobs = [Job('', '', cpus=2), Job('', '', cpus=1), Job('', '', cpus=1),
+            Job('', '', cpus=1)]
+    queue.submit(*jobs)
+    assert_list_equal(queue.started, jobs[:3])
+    assert_equal(len(queue.queue), 1)
+
+
+def test_memory_limited():
+    queue = QueueStub(cpus=8, memory=1000)
+    jobs = [Job('', '', memory=600), Job('', '', memory=600)]
+    queue.submit(*jobs)
+    assert_list_equal(queue.started, jobs[:1])
+
+
+def test_workers_used_as_default_capacity():
+    queue = QueueStub(workers=2)
+    jobs = [Job('', ''), Job('', ''), Job('', '')]
+    queue.submit(*jobs)
+    assert_equal(len(queue.started), 2)
+
+
+def test_small_jobs_backfilled():
+    queue = QueueStub(cpus=4)
+    running = Job('', '', cpus=2)
+    large = Job('', '', cpus=4)
+    small = Job('', '', cpus=1)
+    queue.submit(running, large, small)
+    assert_list_equal(queue.started, [running, small])
+
+
+def test_backfill_stopped_after_timeout():
+    queue = QueueStub(cpus=4)
+    queue.backfill_timeout = 0
+    running = Job('', '', cpus=2)
+    large = Job('', '', cpus=4)
+    queue.submit(running, large)
+    small = Job('', '', cpus=1)
+    queue.submit(small)
+    assert_list_equal(queue.started, [running])
+    queue.finish(running)
+    queue._start_pending(queue.loop)
+    assert_list_equal(queue.started, [running, large])
+
+
+def test_cancelled_jobs_skipped():
+    queue = QueueStub(cpus=1)
+    cancelled = Job('', '', state=JobStatus.INTERRUPTED)
+    job = Job('', '')
+    queue.submit(cancelled, job)
+    assert_list_equal(queue.started, [job])
+    assert_equal(len(queue.queue), 0)
+
+
+def test_higher_priority_started_first():
+    queue = QueueStub(cpus=1)
+    low = Job('', '', priority=0)
+    high = Job('', '', priority=5)
+    queue.submit(low, high)
+    assert_list_equal(queue.started, [high])
+
+
+def test_same_priority_started_in_submission_order():
+    queue = QueueStub(cpus=1)
+    running = Job('', '')
+    queue.submit(running)
+    jobs = [Job('', '', priority=1) for _ in range(3)]
+    queue.submit(*jobs)
+    for expected in jobs:
+        queue.finish(queue.started[-1])
+        queue._start_pending(queue.loop)
+        assert_equal(queue.started[-1], expected)
+
+
+def test_backfill_window_limits_scan():
+    queue = QueueStub(cpus=1)
+    queue.backfill_window = 2
+    jobs = [Job('', '', cpus=2), Job('', '', cpus=2), Job('', '')]
+    queue.submit(*jobs)
+    assert_list_equal(queue.started, [])
+    assert_equal(len(queue.queue), 3)
+
+
+def test_removed_job_not_started():
+    queue = QueueStub(cpus=1)
+    running = Job('', '')
+    queue.submit(running)
+    removed = Job('', '')
+    waiting = Job('', '')
+    queue.submit(removed, waiting)
+    queue.queue.remove(removed)
+    assert_equal(len(queue.queue), 1)
+    queue.finish(running)
+    queue._start_pending(queue.loop)
+    assert_list_equal(queue.started, [running, waiting])
@@ -0,0 +1,90 @@
+import asyncio
+import os
+import tempfile
+import threading
+
+import zmq
+from nose.tools import assert_equal, assert_list_equal, assert_true
+
+from slivka.local_queue import LocalQueueClient
+from slivka.local_queue.core import LocalQueue
+
+
+def run_until_cancelled(loop, task):
+    try:
+        loop.run_until_complete(task)
+    except asyncio.CancelledError:
+        pass
+
+
+class TestRouterServer:
+    def setup(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.address = 'unix://' + os.path.join(self.tmp_dir.name, 'queue.sock')
+        self.queue = LocalQueue(self.address, secret=b'secret')
+        self.loop = asyncio.new_event_loop()
+        self.server = self.loop.create_task(self.queue.serve_forever())
+        self.thread = threading.Thread(
+            target=run_until_cancelled, args=(self.loop, self.server))
+        self.thread.start()
+
+    def teardown(self):
+        self.loop.call_soon_threadsafe(self.server.cancel)
+        self.thread.join(5)
+        self.loop.close()
+        self.tmp_dir.cleanup()
+
+    def test_pipelined_requests(self):
+        client = LocalQueueClient(self.address, timeout=1)
+        request_ids = [
+            client.send({'method': 'POST', 'cmd': 'true',
+                         'cwd': self.tmp_dir.name, 'env': {}})
+            for _ in range(5)
+        ]
+        # collect the responses in the reverse order
+        job_ids = [client.receive(request_id)['id']
+                   for request_id in reversed(request_ids)]
+        assert_equal(len(set(job_ids)), 5)
+        client.socket.close()
+
+    def test_concurrent_clients(self):
+        clients = [LocalQueueClient(self.address, timeout=1) for _ in range(4)]
+        results = []
+
+        def submit(client):
+            for _ in range(10):
+                results.append(client.submit_job('true', self.tmp_dir.name, {}))
+        threads = [threading.Thread(target=submit, args=(client,))
+                   for client in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        assert_equal(len({result.id for result in results}), 40)
+        for client in clients:
+            client.socket.close()
+
+    def test_shared_client_threads(self):
+        client = LocalQueueClient(self.address, timeout=1)
+        job = client.submit_job('true', self.tmp_dir.name, {})
+        states = []
+
+        def check():
+            for _ in range(20):
+                states.append(client.get_job_status(job.id).id)
+        threads = [threading.Thread(target=check) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        assert_list_equal(states, [job.id] * 80)
+        client.socket.close()
+
+    def test_req_client_supported(self):
+        socket = zmq.Context.instance().socket(zmq.REQ)
+        socket.setsockopt(zmq.RCVTIMEO, 1000)
+        socket.connect(self.queue.address)
+        socket.send_json({'method': 'GET', 'id': 0})
+        response = socket.recv_json()
+        socket.close(0)
+        assert_true(response['ok'])
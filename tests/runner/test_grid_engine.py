@@ -0,0 +1,376 @@
+import io
+import os
+import stat
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from textwrap import dedent
+
+from nose.tools import (assert_equal, assert_in, assert_is, assert_is_none,
+                        assert_is_not_none, assert_list_equal, assert_raises)
+
+from slivka import JobStatus
+from slivka.scheduler.runners import grid_engine
+from slivka.scheduler.runners.grid_engine import (
+    AccountingFile, GridEngineRunner, QstatSnapshot, _parse_qstat_xml)
+from slivka.scheduler.runners.runner import FinishedFileWatch, RunnerID
+
+QSTAT_XML = dedent('''\
+    <?xml version='1.0'?>
+    <job_info  xmlns:xsd="http://arc.liv.ac.uk/repos/darcs/sge/source/dist/util/resources/schemas/qstat/qstat.xsd">
+      <queue_info>
+        <job_list state="running">
+          <JB_job_number>11</JB_job_number>
+          <JAT_prio>0.55500</JAT_prio>
+          <JB_name>run3kd9.sh</JB_name>
+          <JB_owner>slivka</JB_owner>
+          <state>r</state>
+          <JAT_start_time>2021-01-01T10:00:00</JAT_start_time>
+          <queue_name>all.q@node1</queue_name>
+          <slots>1</slots>
+        </job_list>
+        <job_list state="running">
+          <JB_job_number>13</JB_job_number>
+          <JAT_prio>0.55500</JAT_prio>
+          <JB_name>array1.sh</JB_name>
+          <JB_owner>slivka</JB_owner>
+          <state>t</state>
+          <JAT_start_time>2021-01-01T10:00:02</JAT_start_time>
+          <queue_name>all.q@node3</queue_name>
+          <slots>1</slots>
+          <tasks>2</tasks>
+        </job_list>
+      </queue_info>
+      <job_info>
+        <job_list state="pending">
+          <JB_job_number>12</JB_job_number>
+          <JAT_prio>0.00000</JAT_prio>
+          <JB_name>run0x1a.sh</JB_name>
+          <JB_owner>slivka</JB_owner>
+          <state>qw</state>
+          <JB_submission_time>2021-01-01T10:00:01</JB_submission_time>
+          <queue_name></queue_name>
+          <slots>1</slots>
+        </job_list>
+        <job_list state="pending">
+          <JB_job_number>13</JB_job_number>
+          <JAT_prio>0.00000</JAT_prio>
+          <JB_name>array1.sh</JB_name>
+          <JB_owner>slivka</JB_owner>
+          <state>qw</state>
+          <JB_submission_time>2021-01-01T10:00:01</JB_submission_time>
+          <queue_name></queue_name>
+          <slots>1</slots>
+          <tasks>3-7:2,10</tasks>
+        </job_list>
+      </job_info>
+    </job_info>
+''').encode()
+
+
+def test_parse_qstat_xml():
+    states = _parse_qstat_xml(io.BytesIO(QSTAT_XML))
+    assert_equal(states, {
+        b'11': JobStatus.RUNNING,
+        b'12': JobStatus.QUEUED,
+        b'13.2': JobStatus.RUNNING,
+        b'13.3': JobStatus.QUEUED,
+        b'13.5': JobStatus.QUEUED,
+        b'13.7': JobStatus.QUEUED,
+        b'13.10': JobStatus.QUEUED,
+    })
+
+
+def write_script(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+    os.chmod(path, stat.S_IRWXU)
+
+
+class TestArraySubmission:
+    def setup(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        bin_dir = os.path.join(self.tmp_dir.name, 'bin')
+        os.mkdir(bin_dir)
+        self.qsub_args = os.path.join(self.tmp_dir.name, 'qsub-args')
+        write_script(os.path.join(bin_dir, 'qsub'), dedent('''\
+            #!/bin/sh
+            echo "$@" > {}
+            echo 'Your job-array 77.1-3:1 ("array.sh") has been submitted'
+            ''').format(self.qsub_args))
+        self._path = os.environ['PATH']
+        os.environ['PATH'] = bin_dir + os.pathsep + self._path
+
+        class Runner(GridEngineRunner):
+            JOBS_DIR = self.tmp_dir.name
+        self.runner = Runner(
+            {'baseCommand': ['echo'], 'inputs': {}, 'outputs': {}},
+            array_jobs=True)
+        self.cwds = [tempfile.mkdtemp(dir=self.tmp_dir.name) for _ in range(3)]
+
+    def teardown(self):
+        os.environ['PATH'] = self._path
+        self.tmp_dir.cleanup()
+
+    def submit(self):
+        return self.runner.batch_submit(
+            (['echo', 'task', str(i)], cwd) for i, cwd in enumerate(self.cwds))
+
+    def test_task_ids_returned(self):
+        assert_list_equal(self.submit(), [b'77.1', b'77.2', b'77.3'])
+
+    def test_single_qsub_call(self):
+        self.submit()
+        with open(self.qsub_args) as f:
+            args = f.read().split()
+        assert_in('-t', args)
+        assert_equal(args[args.index('-t') + 1], '1-3')
+
+    def test_task_runs_own_command(self):
+        self.submit()
+        array_dir = self.cwds[0]
+        script = next(fn for fn in os.listdir(array_dir)
+                      if fn.startswith('array') and fn.endswith('.sh'))
+        env = dict(os.environ, SGE_TASK_ID='2')
+        subprocess.run(['sh', os.path.join(array_dir, script)],
+                       cwd=array_dir, env=env, check=True)
+        with open(os.path.join(self.cwds[1], 'stdout')) as f:
+            assert_equal(f.read(), 'task 1\n')
+        with open(os.path.join(self.cwds[1], 'finished')) as f:
+            assert_equal(f.read().strip(), '0')
+        assert not os.path.exists(os.path.join(self.cwds[0], 'finished'))
+
+
+class TestQstatSnapshot:
+    def setup(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.calls = os.path.join(self.tmp_dir.name, 'calls')
+        output = os.path.join(self.tmp_dir.name, 'qstat.xml')
+        with open(output, 'wb') as f:
+            f.write(QSTAT_XML)
+        self.qstat = os.path.join(self.tmp_dir.name, 'qstat')
+        write_script(self.qstat, dedent('''\
+            #!/bin/sh
+            echo call >> {}
+            sleep 0.2
+            cat {}
+            ''').format(self.calls, output))
+
+    def teardown(self):
+        self.tmp_dir.cleanup()
+
+    def count_calls(self):
+        with open(self.calls) as f:
+            return len(f.readlines())
+
+    def test_concurrent_callers_coalesced(self):
+        snapshot = QstatSnapshot([self.qstat], max_age=10)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(snapshot.get()))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert_equal(self.count_calls(), 1)
+        assert_equal(len(results), 5)
+        assert_equal(results[0][b'11'], JobStatus.RUNNING)
+
+    def test_snapshot_refreshed(self):
+        snapshot = QstatSnapshot([self.qstat], max_age=0)
+        snapshot.get()
+        snapshot.get()
+        assert_equal(self.count_calls(), 2)
+
+    def test_snapshot_invalidated(self):
+        snapshot = QstatSnapshot([self.qstat], max_age=10)
+        snapshot.get()
+        snapshot.invalidate()
+        snapshot.get()
+        assert_equal(self.count_calls(), 2)
+
+    def test_failure_raised(self):
+        snapshot = QstatSnapshot(['false'])
+        with assert_raises(subprocess.CalledProcessError):
+            snapshot.get()
+
+
+def accounting_line(job_number, task_number=0, failed=0, exit_status=0):
+    fields = ['0'] * 45
+    fields[:5] = ['all.q', 'node1', 'users', 'slivka', 'run.sh']
+    fields[5] = str(job_number)
+    fields[11] = str(failed)
+    fields[12] = str(exit_status)
+    fields[13] = '12'
+    fields[14] = '1.5'
+    fields[15] = '0.5'
+    fields[16] = '2048.0'
+    fields[35] = str(task_number)
+    fields[42] = '1048576.0'
+    return (str.join(':', fields) + '\n').encode()
+
+
+class TestAccountingFile:
+    def setup(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'accounting')
+        with open(self.path, 'wb') as f:
+            f.write(b'# Version: 8.1.9\n')
+            f.write(accounting_line(1))
+        self.accounting = AccountingFile(self.path)
+        self.accounting.update()
+
+    def teardown(self):
+        self.accounting.close()
+        self.tmp_dir.cleanup()
+
+    def append(self, data):
+        with open(self.path, 'ab') as f:
+            f.write(data)
+
+    def test_existing_records_skipped(self):
+        assert_is_none(self.accounting.get(b'1'))
+
+    def test_appended_records_read(self):
+        self.append(accounting_line(2) + accounting_line(3, task_number=4))
+        self.accounting.update()
+        record = self.accounting.get(b'2')
+        assert_equal(record.exit_status, 0)
+        assert_equal(record.usage, {'wall_time': 12.0, 'cpu_time': 2.0,
+                                    'max_rss': 2048, 'max_vmem': 1048576})
+        assert_is_not_none(self.accounting.get(b'3.4'))
+
+    def test_partial_line_completed_later(self):
+        line = accounting_line(2)
+        self.append(line[:20])
+        self.accounting.update()
+        assert_is_none(self.accounting.get(b'2'))
+        self.append(line[20:])
+        self.accounting.update()
+        assert_is_not_none(self.accounting.get(b'2'))
+
+    def test_rotated_file_read_from_start(self):
+        os.rename(self.path, self.path + '.0')
+        with open(self.path, 'wb') as f:
+            f.write(accounting_line(5))
+        self.accounting.update()
+        assert_is_not_none(self.accounting.get(b'5'))
+
+
+class QstatStub:
+    def __init__(self, states=()):
+        self.states = dict(states)
+
+    def get(self):
+        return self.states
+
+
+class TestFinishedFileFallback:
+    def setup(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+        class Runner(GridEngineRunner):
+            qstat = QstatStub()
+            finished_files = FinishedFileWatch(
+                grace_period=timedelta(seconds=0.2))
+        self.runner_class = Runner
+
+    def teardown(self):
+        self.tmp_dir.cleanup()
+
+    def check(self, job_id):
+        job = {'job_id': job_id, 'work_dir': self.tmp_dir.name}
+        return list(self.runner_class.batch_check_status([job]))[0]
+
+    def test_grace_period_restarted_when_job_listed_again(self):
+        qstat = self.runner_class.qstat
+        assert_equal(self.check(b'1'), JobStatus.RUNNING)
+        time.sleep(0.3)
+        qstat.states[b'1'] = JobStatus.QUEUED
+        assert_equal(self.check(b'1'), JobStatus.QUEUED)
+        del qstat.states[b'1']
+        assert_equal(self.check(b'1'), JobStatus.RUNNING)
+        time.sleep(0.3)
+        assert_equal(self.check(b'1'), JobStatus.INTERRUPTED)
+
+
+class TestAccountingStatus:
+    def setup(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'accounting')
+        open(self.path, 'wb').close()
+        self._qstat = GridEngineRunner.qstat
+        GridEngineRunner.qstat = QstatStub()
+
+        class Runner(GridEngineRunner):
+            JOBS_DIR = self.tmp_dir.name
+        self.runner_class = Runner
+        self.runner = self.make_runner('runner1', self.path)
+        grid_engine._accounting_files[self.path].update()
+
+    def teardown(self):
+        for accounting in grid_engine._accounting_files.values():
+            accounting.close()
+        grid_engine._accounting_files.clear()
+        grid_engine._runner_accounting.clear()
+        GridEngineRunner.qstat = self._qstat
+        self.tmp_dir.cleanup()
+
+    def make_runner(self, name, accounting_file):
+        return self.runner_class(
+            {'baseCommand': ['echo'], 'inputs': {}, 'outputs': {}},
+            id=RunnerID('stub', name), accounting_file=accounting_file)
+
+    def check(self, job_id, runner=None):
+        runner = runner or self.runner
+        job = {'job_id': job_id, 'work_dir': self.tmp_dir.name,
+               'service': runner.service_name, 'runner': runner.name}
+        return list(GridEngineRunner.batch_check_status([job]))[0]
+
+    def test_states_from_accounting(self):
+        with open(self.path, 'ab') as f:
+            f.write(accounting_line(1))
+            f.write(accounting_line(2, exit_status=1))
+            f.write(accounting_line(3, failed=100, exit_status=137))
+            f.write(accounting_line(4, failed=26, exit_status=0))
+        assert_equal(self.check(b'1'), JobStatus.COMPLETED)
+        assert_equal(self.check(b'2'), JobStatus.FAILED)
+        assert_equal(self.check(b'3'), JobStatus.INTERRUPTED)
+        assert_equal(self.check(b'4'), JobStatus.ERROR)
+
+    def test_usage_from_accounting(self):
+        with open(self.path, 'ab') as f:
+            f.write(accounting_line(1))
+        jobs = [{'job_id': job_id, 'work_dir': self.tmp_dir.name,
+                 'service': 'stub', 'runner': 'runner1'}
+                for job_id in (b'1', b'2')]
+        list(GridEngineRunner.batch_check_status(jobs))
+        assert_list_equal(GridEngineRunner.batch_get_usage(jobs), [
+            {'wall_time': 12.0, 'cpu_time': 2.0,
+             'max_rss': 2048, 'max_vmem': 1048576},
+            None
+        ])
+
+    def test_accounting_files_shared_by_path(self):
+        self.make_runner('runner2', self.path)
+        assert_equal(len(grid_engine._accounting_files), 1)
+        assert_is(grid_engine._runner_accounting['stub', 'runner2'],
+                  grid_engine._runner_accounting['stub', 'runner1'])
+
+    def test_records_read_from_own_accounting_file(self):
+        other_path = os.path.join(self.tmp_dir.name, 'other')
+        open(other_path, 'wb').close()
+        other = self.make_runner('runner2', other_path)
+        grid_engine._accounting_files[other_path].update()
+        with open(other_path, 'ab') as f:
+            f.write(accounting_line(5, exit_status=1))
+        assert_equal(self.check(b'5', other), JobStatus.FAILED)
+        # not finished according to the accounting file of the runner
+        assert_equal(self.check(b'5'), JobStatus.RUNNING)
+
+    def test_unaccounted_job_falls_back_to_finished_file(self):
+        with open(os.path.join(self.tmp_dir.name, 'finished'), 'w') as f:
+            f.write('0\n')
+        assert_equal(self.check(b'9'), JobStatus.COMPLETED)
@@ -0,0 +1,91 @@
+import os
+import subprocess
+import tempfile
+import time
+
+from nose.tools import assert_equal, assert_not_in, assert_regex
+
+from slivka import JobStatus
+from slivka.scheduler.runners.shell import ShellRunner, _read_start_time
+
+
+class TestShellRunner:
+    def setup(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+        class Runner(ShellRunner):
+            JOBS_DIR = self.tmp_dir.name
+        self.runner = Runner(
+            {'baseCommand': ['sh'], 'inputs': {}, 'outputs': {}})
+
+    def teardown(self):
+        self.tmp_dir.cleanup()
+
+    def wait_finished(self, job_id, cwd, timeout=5):
+        deadline = time.monotonic() + timeout
+        while True:
+            state = self.runner.check_status(job_id, cwd)
+            if state.is_finished() or time.monotonic() > deadline:
+                return state
+            time.sleep(0.05)
+
+    def start(self, script):
+        cwd = tempfile.mkdtemp(dir=self.tmp_dir.name)
+        return self.runner.submit(['sh', '-c', script], cwd), cwd
+
+    def test_job_id_contains_start_time(self):
+        job_id, cwd = self.start('true')
+        assert_regex(job_id, r'^\d+:\d+$')
+
+    def test_completed(self):
+        job_id, cwd = self.start('echo hello')
+        assert_equal(self.wait_finished(job_id, cwd), JobStatus.COMPLETED)
+        with open(os.path.join(cwd, 'stdout')) as f:
+            assert_equal(f.read(), 'hello\n')
+
+    def test_failed(self):
+        job_id, cwd = self.start('exit 3')
+        assert_equal(self.wait_finished(job_id, cwd), JobStatus.FAILED)
+
+    def test_command_not_found(self):
+        job_id, cwd = self.start('exit 127')
+        assert_equal(self.wait_finished(job_id, cwd), JobStatus.ERROR)
+
+    def test_exited_process_reaped(self):
+        job_id, cwd = self.start('true')
+        self.wait_finished(job_id, cwd)
+        pid = int(job_id.split(':')[0])
+        deadline = time.monotonic() + 5
+        while pid in self.runner.watcher and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert_not_in(pid, self.runner.watcher)
+
+    def test_cancel(self):
+        job_id, cwd = self.start('sleep 10')
+        assert_equal(self.runner.check_status(job_id, cwd), JobStatus.RUNNING)
+        self.runner.cancel(job_id, cwd)
+        assert_equal(self.wait_finished(job_id, cwd), JobStatus.INTERRUPTED)
+
+    def test_surviving_process_reattached(self):
+        # process which is not a child of the runner, as after a restart
+        proc = subprocess.Popen(['sleep', '10'])
+        try:
+            job_id = '%d:%d' % (proc.pid, _read_start_time(proc.pid))
+            cwd = self.tmp_dir.name
+            assert_equal(self.runner.check_status(job_id, cwd),
+                         JobStatus.RUNNING)
+            # recycled pid of another process
+            job_id = '%d:%d' % (proc.pid, _read_start_time(proc.pid) - 1)
+            assert_equal(self.runner.check_status(job_id, cwd),
+                         JobStatus.INTERRUPTED)
+        finally:
+            proc.kill()
+            proc.wait()
+
+    def test_finished_file_read_after_restart(self):
+        cwd = tempfile.mkdtemp(dir=self.tmp_dir.name)
+        with open(os.path.join(cwd, 'finished'), 'w') as f:
+            f.write('0\n')
+        # pid which is not in use
+        assert_equal(self.runner.check_status('4194304:1', cwd),
+                     JobStatus.COMPLETED)
@@ -0,0 +1,180 @@
+import json
+import os
+import stat
+import subprocess
+import tempfile
+from textwrap import dedent
+
+from nose.tools import assert_equal, assert_in, assert_list_equal
+
+from slivka import JobStatus
+from slivka.scheduler.runners.slurm import (
+    SlurmRunner, _parse_sacct, _parse_squeue_json)
+
+SQUEUE_JSON = {
+    'jobs': [
+        {'job_id': 11, 'job_state': 'RUNNING',
+         'array_job_id': 0, 'array_task_id': None},
+        {'job_id': 12, 'job_state': ['PENDING'],
+         'array_job_id': {'set': False, 'number': 0},
+         'array_task_id': {'set': False, 'number': 0}},
+        {'job_id': 14, 'job_state': ['RUNNING'],
+         'array_job_id': {'set': True, 'number': 13},
+         'array_task_id': {'set': True, 'number': 1}},
+        {'job_id': 13, 'job_state': ['PENDING'],
+         'array_job_id': {'set': True, 'number': 13},
+         'array_task_id': {'set': False, 'number': 0},
+         'array_task_string': '2-4%2'},
+        {'job_id': 10, 'job_state': ['COMPLETED'],
+         'array_job_id': {'set': False, 'number': 0},
+         'array_task_id': {'set': False, 'number': 0}},
+    ]
+}
+
+SACCT_OUTPUT = dedent('''\
+    10|COMPLETED|0:0
+    10.batch|COMPLETED|0:0
+    15|FAILED|1:0
+    16|FAILED|127:0
+    17_1|CANCELLED by 1000|0:15
+    18|RUNNING|0:0
+''')
+
+
+def test_parse_squeue_json():
+    assert_equal(_parse_squeue_json(SQUEUE_JSON), {
+        '11': JobStatus.RUNNING,
+        '12': JobStatus.QUEUED,
+        '13_1': JobStatus.RUNNING,
+        '13_2': JobStatus.QUEUED,
+        '13_3': JobStatus.QUEUED,
+        '13_4': JobStatus.QUEUED,
+    })
+
+
+def test_parse_sacct():
+    assert_equal(_parse_sacct(SACCT_OUTPUT), {
+        '10': JobStatus.COMPLETED,
+        '15': JobStatus.FAILED,
+        '16': JobStatus.ERROR,
+        '17_1': JobStatus.INTERRUPTED,
+    })
+
+
+def write_script(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+    os.chmod(path, stat.S_IRWXU)
+
+
+class TestSlurmRunner:
+    def setup(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        bin_dir = os.path.join(self.tmp_dir.name, 'bin')
+        os.mkdir(bin_dir)
+        self.calls = os.path.join(self.tmp_dir.name, 'calls')
+        squeue_json = os.path.join(self.tmp_dir.name, 'squeue.json')
+        with open(squeue_json, 'w') as f:
+            json.dump(SQUEUE_JSON, f)
+        sacct_output = os.path.join(self.tmp_dir.name, 'sacct.txt')
+        with open(sacct_output, 'w') as f:
+            f.write(SACCT_OUTPUT)
+        for name, output in [('sbatch', 'echo "77;cluster"'),
+                             ('squeue', 'cat %s' % squeue_json),
+                             ('sacct', 'cat %s' % sacct_output),
+                             ('scancel', 'true')]:
+            write_script(os.path.join(bin_dir, name), dedent('''\
+                #!/bin/sh
+                echo {} "$@" >> {}
+                {}
+                ''').format(name, self.calls, output))
+        self.bin_dir = bin_dir
+        self._path = os.environ['PATH']
+        os.environ['PATH'] = bin_dir + os.pathsep + self._path
+
+        class Runner(SlurmRunner):
+            JOBS_DIR = self.tmp_dir.name
+        self.runner_class = Runner
+        self.cwds = [tempfile.mkdtemp(dir=self.tmp_dir.name) for _ in range(3)]
+
+    def teardown(self):
+        os.environ['PATH'] = self._path
+        self.tmp_dir.cleanup()
+
+    def make_runner(self, **kwargs):
+        return self.runner_class(
+            {'baseCommand': ['echo'], 'inputs': {}, 'outputs': {}}, **kwargs)
+
+    def read_calls(self, name):
+        with open(self.calls) as f:
+            return [line.split()[1:] for line in f
+                    if line.split()[0] == name]
+
+    def submit(self, runner):
+        return runner.batch_submit(
+            (['echo', 'task', str(i)], cwd) for i, cwd in enumerate(self.cwds))
+
+    def test_job_ids_returned(self):
+        runner = self.make_runner()
+        assert_list_equal(self.submit(runner), ['77', '77', '77'])
+        assert_equal(len(self.read_calls('sbatch')), 3)
+
+    def test_array_task_ids_returned(self):
+        runner = self.make_runner(array_jobs=True)
+        assert_list_equal(self.submit(runner), ['77_1', '77_2', '77_3'])
+        calls = self.read_calls('sbatch')
+        assert_equal(len(calls), 1)
+        assert_in('1-3', calls[0])
+
+    def test_array_task_runs_own_command(self):
+        runner = self.make_runner(array_jobs=True)
+        self.submit(runner)
+        array_dir = self.cwds[0]
+        script = next(fn for fn in os.listdir(array_dir)
+                      if fn.startswith('array') and fn.endswith('.sh'))
+        env = dict(os.environ, SLURM_ARRAY_TASK_ID='2')
+        subprocess.run(['sh', os.path.join(array_dir, script)],
+                       cwd=array_dir, env=env, check=True)
+        with open(os.path.join(self.cwds[1], 'stdout')) as f:
+            assert_equal(f.read(), 'task 1\n')
+        with open(os.path.join(self.cwds[1], 'finished')) as f:
+            assert_equal(f.read().strip(), '0')
+
+    def test_batch_check_status(self):
+        jobs = [dict(job_id=job_id, work_dir=self.cwds[0])
+                for job_id in ('11', '13_3', '15', '16')]
+        states = list(self.runner_class.batch_check_status(jobs))
+        assert_list_equal(states, [
+            JobStatus.RUNNING, JobStatus.QUEUED,
+            JobStatus.FAILED, JobStatus.ERROR
+        ])
+        assert_equal(len(self.read_calls('squeue')), 1)
+        sacct_calls = self.read_calls('sacct')
+        assert_equal(len(sacct_calls), 1)
+        assert_in('15,16', sacct_calls[0])
+
+    def test_unaccounted_job_falls_back_to_finished_file(self):
+        with open(os.path.join(self.cwds[0], 'finished'), 'w') as f:
+            f.write('0\n')
+        job = dict(job_id='20', work_dir=self.cwds[0])
+        states = list(self.runner_class.batch_check_status([job]))
+        assert_list_equal(states, [JobStatus.COMPLETED])
+
+    def test_accounting_disabled(self):
+        write_script(os.path.join(self.bin_dir, 'sacct'), dedent('''\
+            #!/bin/sh
+            echo "Slurm accounting storage is disabled" >&2
+            exit 1
+            '''))
+        with open(os.path.join(self.cwds[0], 'finished'), 'w') as f:
+            f.write('0\n')
+        jobs = [dict(job_id='11', work_dir=self.cwds[1]),
+                dict(job_id='20', work_dir=self.cwds[0])]
+        states = list(self.runner_class.batch_check_status(jobs))
+        assert_list_equal(states, [JobStatus.RUNNING, JobStatus.COMPLETED])
+
+    def test_batch_cancel(self):
+        jobs = [dict(job_id=job_id, work_dir=cwd)
+                for job_id, cwd in zip(('11', '12', '13_1'), self.cwds)]
+        self.runner_class.batch_cancel(jobs)
+        assert_list_equal(self.read_calls('scancel'), [['11', '12', '13_1']])
@@ -0,0 +1,94 @@
+import itertools
+from datetime import datetime, timedelta
+from typing import Iterator
+
+import mongomock
+from nose.tools import assert_equal, assert_list_equal
+
+import slivka.db
+from slivka.db.documents import JobRequest
+from slivka.db.helpers import insert_many, pull_many
+from slivka.scheduler import Scheduler, Runner
+from slivka.scheduler.runners.runner import RunnerID, RunInfo
+from slivka.utils import JobStatus
+from . import LimiterStub
+
+
+def setup_module():
+    slivka.db.mongo = mongomock.MongoClient()
+    slivka.db.database = slivka.db.mongo.slivkadb
+
+
+def teardown_module():
+    del slivka.db.mongo
+    del slivka.db.database
+
+
+class MockRunner(Runner):
+    next_job_id = itertools.count(0).__next__
+
+    def __init__(self, service, name):
+        self.id = RunnerID(service_name=service, runner_name=name)
+
+    def batch_run(self, inputs_list) -> Iterator[RunInfo]:
+        return [RunInfo(self.submit(None, '/tmp'), '/tmp') for _ in inputs_list]
+
+    def submit(self, cmd, cwd):
+        return self.next_job_id()
+
+    @classmethod
+    def check_status(cls, job_id, cwd) -> JobStatus:
+        return JobStatus.RUNNING
+
+
+class TestBatchSize:
+    def setup(self):
+        slivka.db.mongo.drop_database('slivkadb')
+        self.scheduler = Scheduler()
+        self.scheduler.max_batch_size = 2
+        self.scheduler.add_runner(MockRunner('stub', 'runner1'))
+        self.scheduler.limiters['stub'] = LimiterStub()
+        # inserted in the reverse order of submission
+        self.requests = [
+            JobRequest(service='stub', inputs={'runner': 1},
+                       timestamp=datetime(2020, 1, 1) - timedelta(minutes=i))
+            for i in range(5)
+        ]
+        insert_many(slivka.db.database, self.requests)
+
+    def test_batch_limited(self):
+        self.scheduler.run_cycle()
+        pull_many(slivka.db.database, self.requests)
+        states = [req.state for req in self.requests]
+        assert_equal(states.count(JobStatus.RUNNING), 2)
+        assert_equal(states.count(JobStatus.ACCEPTED), 3)
+
+    def test_remainder_started_next_cycle(self):
+        for _ in range(3):
+            self.scheduler.run_cycle()
+        pull_many(slivka.db.database, self.requests)
+        assert_list_equal(
+            [req.state for req in self.requests], [JobStatus.RUNNING] * 5
+        )
+
+    def test_oldest_started_first(self):
+        self.scheduler.run_cycle()
+        requests = sorted(self.requests, key=lambda req: req.timestamp)
+        pull_many(slivka.db.database, requests)
+        assert_list_equal(
+            [req.state for req in requests],
+            [JobStatus.RUNNING] * 2 + [JobStatus.ACCEPTED] * 3
+        )
+
+
+def test_orphaned_requests_failed():
+    slivka.db.mongo.drop_database('slivkadb')
+    scheduler = Scheduler()
+    scheduler.add_runner(MockRunner('stub', 'runner1'))
+    request = JobRequest(
+        service='stub', inputs={}, status=JobStatus.ACCEPTED, runner='gone'
+    )
+    insert_many(slivka.db.database, [request])
+    scheduler.run_cycle()
+    pull_many(slivka.db.database, [request])
+    assert_equal(request.state, JobStatus.ERROR)
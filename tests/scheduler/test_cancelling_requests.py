@@ -3,7 +3,7 @@ from typing import Iterator
 from unittest import mock
 
 import mongomock
-from nose.tools import assert_equal
+from nose.tools import assert_equal, assert_is_not_none
 
 from slivka import JobStatus
 from slivka.db.documents import JobRequest, CancelRequest, JobMetadata
@@ -28,6 +28,7 @@ class MockRunner(Runner):
         job_id = self.next_job_id()
         return job_id
 
+    @classmethod
     def cancel(cls, job_id, cwd):
         pass
 
@@ -67,6 +68,51 @@ class TestJobCancelling:
         self.scheduler.run_cycle()
         insert_one(slivka.db.database, CancelRequest(uuid=self.request.uuid))
         job = JobMetadata.find_one(slivka.db.database, uuid=self.request.uuid)
-        with mock.patch.object(runner, 'cancel') as mock_cancel:
+        with mock.patch.object(runner, 'batch_cancel') as mock_cancel:
             self.scheduler.run_cycle()
-            mock_cancel.assert_called_once_with(job.job_id, job.cwd)
+            mock_cancel.assert_called_once_with([job])
+
+    def test_jobs_cancelled_in_batch(self):
+        runner = self.scheduler.runners['stub', 'runner1']
+        other = JobRequest(service='stub', inputs={'runner': 1})
+        insert_one(slivka.db.database, other)
+        self.scheduler.run_cycle()
+        insert_one(slivka.db.database, CancelRequest(uuid=self.request.uuid))
+        insert_one(slivka.db.database, CancelRequest(uuid=other.uuid))
+        with mock.patch.object(runner, 'batch_cancel') as mock_cancel, \
+                mock.patch.object(runner, 'cancel') as mock_single_cancel:
+            self.scheduler.run_cycle()
+            mock_cancel.assert_called_once()
+            mock_single_cancel.assert_not_called()
+        (jobs,), _ = mock_cancel.call_args
+        assert_equal(sorted(job.uuid for job in jobs),
+                     sorted([self.request.uuid, other.uuid]))
+
+    def test_cancelled_during_submission(self):
+        runner = self.scheduler.runners['stub', 'runner1']
+        self.scheduler.process_new_requests()
+        batch_run = runner.batch_run
+
+        def cancelling_batch_run(inputs_list):
+            insert_one(slivka.db.database,
+                       CancelRequest(uuid=self.request.uuid))
+            self.scheduler.process_cancel_requests()
+            return batch_run(inputs_list)
+        with mock.patch.object(runner, 'batch_run', cancelling_batch_run), \
+                mock.patch.object(runner, 'batch_cancel') as mock_cancel:
+            self.scheduler.start_accepted_requests()
+        pull_one(slivka.db.database, self.request)
+        assert_equal(self.request.state, JobStatus.DELETED)
+        job = JobMetadata.find_one(slivka.db.database, uuid=self.request.uuid)
+        mock_cancel.assert_called_once()
+        (jobs,), _ = mock_cancel.call_args
+        assert_equal([cancelled.id for cancelled in jobs], [job.id])
+
+    def test_cancel_kept_for_unloaded_runner(self):
+        self.scheduler.run_cycle()
+        insert_one(slivka.db.database, CancelRequest(uuid=self.request.uuid))
+        del self.scheduler.runners['stub', 'runner1']
+        self.scheduler.process_cancel_requests()
+        cancel_request = CancelRequest.find_one(
+            slivka.db.database, uuid=self.request.uuid)
+        assert_is_not_none(cancel_request)
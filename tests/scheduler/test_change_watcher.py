@@ -0,0 +1,63 @@
+import threading
+from unittest import mock
+
+from nose.tools import assert_equal, assert_true
+from pymongo.errors import OperationFailure
+
+from slivka.db.documents import JobRequest, CancelRequest
+from slivka.scheduler.core import ChangeWatcher
+
+
+class StreamStub:
+    def __init__(self, changes):
+        self.changes = list(changes)
+        self.alive = True
+
+    def try_next(self):
+        if self.changes:
+            return self.changes.pop(0)
+        self.alive = False
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+def test_callback_called_on_insert():
+    called = threading.Event()
+    database = mock.MagicMock()
+    stream = StreamStub([{'operationType': 'insert'}])
+    database.watch.return_value = stream
+
+    def callback():
+        called.set()
+        watcher.cancel()
+    watcher = ChangeWatcher(database, [JobRequest, CancelRequest], callback)
+    watcher.start()
+    watcher.join(1)
+    assert_true(called.is_set())
+
+
+def test_watched_collections():
+    database = mock.MagicMock()
+    database.watch.side_effect = OperationFailure('not a replica set')
+    watcher = ChangeWatcher(database, [JobRequest, CancelRequest], mock.Mock())
+    watcher.start()
+    watcher.join(1)
+    (pipeline,), _ = database.watch.call_args
+    assert_equal(
+        pipeline[0]['$match']['ns.coll'], {'$in': ['requests', 'cancelrequest']}
+    )
+
+
+def test_stopped_when_unsupported():
+    database = mock.MagicMock()
+    database.watch.side_effect = OperationFailure('not a replica set')
+    watcher = ChangeWatcher(database, [JobRequest], mock.Mock())
+    watcher.start()
+    watcher.join(1)
+    assert not watcher.is_alive()
+    assert_equal(database.watch.call_count, 1)
@@ -0,0 +1,98 @@
+import itertools
+import threading
+from typing import Iterator
+
+import mongomock
+from nose.tools import assert_equal
+
+import slivka.db
+from slivka.db.documents import JobRequest, JobMetadata
+from slivka.db.helpers import insert_many, pull_many
+from slivka.scheduler import Scheduler, Runner
+from slivka.scheduler.runners.runner import RunnerID, RunInfo
+from slivka.utils import JobStatus
+from . import LimiterStub
+
+
+def setup_module():
+    slivka.db.mongo = mongomock.MongoClient()
+    slivka.db.database = slivka.db.mongo.slivkadb
+
+
+def teardown_module():
+    del slivka.db.mongo
+    del slivka.db.database
+
+
+class MockRunner(Runner):
+    next_job_id = itertools.count(0).__next__
+
+    def __init__(self, service, name):
+        self.id = RunnerID(service_name=service, runner_name=name)
+        self.released = threading.Event()
+        self.released.set()
+        self.batch_count = 0
+
+    def batch_run(self, inputs_list) -> Iterator[RunInfo]:
+        self.batch_count += 1
+        self.released.wait(5)
+        return [RunInfo(self.submit(None, '/tmp'), '/tmp') for _ in inputs_list]
+
+    def submit(self, cmd, cwd):
+        return self.next_job_id()
+
+    @classmethod
+    def check_status(cls, job_id, cwd) -> JobStatus:
+        return JobStatus.QUEUED
+
+
+class TestConcurrentSubmission:
+    def setup(self):
+        slivka.db.mongo.drop_database('slivkadb')
+        self.scheduler = Scheduler()
+        self.scheduler.submission_timeout = 0.1
+        self.slow_runner = MockRunner('stub', 'runner1')
+        self.slow_runner.released.clear()
+        self.fast_runner = MockRunner('stub', 'runner2')
+        self.scheduler.add_runner(self.slow_runner)
+        self.scheduler.add_runner(self.fast_runner)
+        self.scheduler.limiters['stub'] = LimiterStub()
+        self.slow_requests = [
+            JobRequest(service='stub', inputs={'runner': 1}),
+            JobRequest(service='stub', inputs={'runner': 1})
+        ]
+        self.fast_requests = [
+            JobRequest(service='stub', inputs={'runner': 2}),
+            JobRequest(service='stub', inputs={'runner': 2})
+        ]
+        insert_many(slivka.db.database, self.slow_requests + self.fast_requests)
+
+    def teardown(self):
+        self.slow_runner.released.set()
+        self.scheduler._executor.shutdown()
+
+    def test_slow_runner_not_blocking(self):
+        self.scheduler.run_cycle()
+        pull_many(slivka.db.database, self.slow_requests)
+        pull_many(slivka.db.database, self.fast_requests)
+        for request in self.fast_requests:
+            assert_equal(request.state, JobStatus.QUEUED)
+        for request in self.slow_requests:
+            assert_equal(request.state, JobStatus.ACCEPTED)
+
+    def test_slow_submission_collected_later(self):
+        self.scheduler.run_cycle()
+        self.slow_runner.released.set()
+        self.scheduler.run_cycle()
+        pull_many(slivka.db.database, self.slow_requests)
+        for request in self.slow_requests:
+            assert_equal(request.state, JobStatus.QUEUED)
+
+    def test_no_duplicate_submission(self):
+        self.scheduler.run_cycle()
+        self.scheduler.run_cycle()
+        self.slow_runner.released.set()
+        self.scheduler.run_cycle()
+        assert_equal(self.slow_runner.batch_count, 1)
+        jobs = list(JobMetadata.find(slivka.db.database, runner='runner1'))
+        assert_equal(len(jobs), 2)
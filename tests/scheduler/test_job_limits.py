@@ -0,0 +1,136 @@
+import itertools
+import threading
+from typing import Iterator
+from unittest import mock
+
+import mongomock
+from nose.tools import assert_equal
+
+import slivka.db
+from slivka.db.documents import JobRequest, JobMetadata
+from slivka.db.helpers import insert_many, pull_many
+from slivka.scheduler import Scheduler, Runner
+from slivka.scheduler.runners.runner import RunnerID, RunInfo
+from slivka.utils import JobStatus
+from . import LimiterStub
+
+
+def setup_module():
+    slivka.db.mongo = mongomock.MongoClient()
+    slivka.db.database = slivka.db.mongo.slivkadb
+
+
+def teardown_module():
+    del slivka.db.mongo
+    del slivka.db.database
+
+
+class MockRunner(Runner):
+    next_job_id = itertools.count(0).__next__
+    check_status = mock.Mock(return_value=JobStatus.RUNNING)
+
+    def __init__(self, service, name):
+        self.id = RunnerID(service_name=service, runner_name=name)
+
+    def batch_run(self, inputs_list) -> Iterator[RunInfo]:
+        return [RunInfo(self.submit(None, '/tmp'), '/tmp') for _ in inputs_list]
+
+    def submit(self, cmd, cwd):
+        return self.next_job_id()
+
+
+def count_states(requests):
+    pull_many(slivka.db.database, requests)
+    states = [req.state for req in requests]
+    return {state: states.count(state) for state in set(states)}
+
+
+class TestJobLimits:
+    def setup(self):
+        slivka.db.mongo.drop_database('slivkadb')
+        MockRunner.check_status.return_value = JobStatus.RUNNING
+        self.scheduler = Scheduler()
+        self.scheduler.min_check_interval = 0
+        self.scheduler.add_runner(MockRunner('stub', 'runner1'))
+        self.scheduler.add_runner(MockRunner('stub', 'runner2'))
+        self.scheduler.limiters['stub'] = LimiterStub()
+        self.requests = [
+            JobRequest(service='stub', inputs={'runner': 1 + i % 2})
+            for i in range(6)
+        ]
+        insert_many(slivka.db.database, self.requests)
+
+    def test_runner_limit(self):
+        self.scheduler.runner_job_limits[RunnerID('stub', 'runner1')] = 2
+        self.scheduler.run_cycle()
+        self.scheduler.run_cycle()
+        counts = count_states(self.requests[0::2])
+        assert_equal(counts, {JobStatus.RUNNING: 2, JobStatus.ACCEPTED: 1})
+        counts = count_states(self.requests[1::2])
+        assert_equal(counts, {JobStatus.RUNNING: 3})
+
+    def test_service_limit(self):
+        self.scheduler.service_job_limits['stub'] = 4
+        self.scheduler.run_cycle()
+        self.scheduler.run_cycle()
+        counts = count_states(self.requests)
+        assert_equal(counts, {JobStatus.RUNNING: 4, JobStatus.ACCEPTED: 2})
+
+    def test_slots_released_when_finished(self):
+        self.scheduler.service_job_limits['stub'] = 4
+        self.scheduler.run_cycle()
+        MockRunner.check_status.return_value = JobStatus.COMPLETED
+        self.scheduler.run_cycle()
+        self.scheduler.run_cycle()
+        counts = count_states(self.requests)
+        assert_equal(counts, {JobStatus.COMPLETED: 6})
+
+    def test_active_jobs_counted_on_start(self):
+        jobs = [
+            JobMetadata(uuid=str(i), service='stub', runner='runner1',
+                        work_dir='/tmp', runner_class='', job_id=i,
+                        status=JobStatus.RUNNING)
+            for i in range(2)
+        ]
+        insert_many(slivka.db.database, jobs)
+        self.scheduler.runner_job_limits[RunnerID('stub', 'runner1')] = 3
+        self.scheduler.count_active_jobs()
+        assert_equal(
+            self.scheduler.get_free_slots(RunnerID('stub', 'runner1')), 1
+        )
+        assert_equal(
+            self.scheduler.get_free_slots(RunnerID('stub', 'runner2')), None
+        )
+
+    def test_jobs_of_other_schedulers_counted_on_heartbeat(self):
+        runner_id = RunnerID('stub', 'runner1')
+        self.scheduler.runner_job_limits[runner_id] = 3
+        self.scheduler.count_active_jobs()
+        jobs = [
+            JobMetadata(uuid=str(i), service='stub', runner='runner1',
+                        work_dir='/tmp', runner_class='', job_id=i,
+                        status=JobStatus.RUNNING, lease_owner='other')
+            for i in range(2)
+        ]
+        insert_many(slivka.db.database, jobs)
+        assert_equal(self.scheduler.get_free_slots(runner_id), 3)
+        self.scheduler.heartbeat()
+        assert_equal(self.scheduler.get_free_slots(runner_id), 1)
+
+    def test_recount_waits_for_started_jobs(self):
+        runner_id = RunnerID('stub', 'runner1')
+        self.scheduler.runner_job_limits[runner_id] = 3
+        self.scheduler.process_new_requests()
+        self.scheduler.count_active_jobs()
+        recount = threading.Thread(target=self.scheduler.count_active_jobs)
+
+        def recount_insert_many(database, documents):
+            # heartbeat arriving while the started jobs are being saved
+            recount.start()
+            recount.join(0.2)
+            insert_many(database, documents)
+        with mock.patch('slivka.scheduler.core.insert_many',
+                        recount_insert_many):
+            self.scheduler.start_accepted_requests([runner_id])
+        recount.join()
+        assert_equal(self.scheduler.get_free_slots(runner_id), 0)
@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta
+from unittest import mock
+
+import mongomock
+from nose.tools import assert_equal
+
+import slivka.db
+from slivka.db.documents import JobMetadata, JobRequest
+from slivka.db.helpers import insert_one, pull_one
+from slivka.scheduler import Scheduler, Runner
+from slivka.scheduler.core import get_classpath
+from slivka.utils import JobStatus
+
+
+def setup_module():
+    slivka.db.mongo = mongomock.MongoClient()
+    slivka.db.database = slivka.db.mongo.slivkadb
+
+
+def teardown_module():
+    del slivka.db.mongo
+    del slivka.db.database
+
+
+class MockRunner(Runner):
+    check_status = mock.Mock(return_value=JobStatus.RUNNING)
+
+
+class TestAdaptiveMonitoring:
+    def setup(self):
+        slivka.db.mongo.drop_database('slivkadb')
+        MockRunner.check_status.reset_mock()
+        MockRunner.check_status.return_value = JobStatus.RUNNING
+        self.scheduler = Scheduler()
+        self.scheduler.min_check_interval = 10
+        self.scheduler.max_check_interval = 30
+        self.request = JobRequest(service='stub', inputs={},
+                                  status=JobStatus.RUNNING)
+        insert_one(slivka.db.database, self.request)
+
+    def insert_job(self, next_check, check_interval=10):
+        job = JobMetadata(
+            uuid=self.request.uuid, service='stub', work_dir='/tmp',
+            runner_class=get_classpath(MockRunner), job_id=0,
+            status=JobStatus.RUNNING, runner='default',
+            next_check=next_check, check_interval=check_interval
+        )
+        insert_one(slivka.db.database, job)
+        return job
+
+    def test_due_job_checked(self):
+        self.insert_job(datetime.now() - timedelta(seconds=1))
+        self.scheduler.monitor_running_jobs()
+        assert_equal(MockRunner.check_status.call_count, 1)
+
+    def test_job_not_due_skipped(self):
+        self.insert_job(datetime.now() + timedelta(seconds=60))
+        self.scheduler.monitor_running_jobs()
+        assert_equal(MockRunner.check_status.call_count, 0)
+
+    def test_job_without_next_check_checked(self):
+        job = self.insert_job(None)
+        slivka.db.database[JobMetadata.__collection__].update_one(
+            {'_id': job.id}, {'$unset': {'next_check': ''}})
+        self.scheduler.monitor_running_jobs()
+        assert_equal(MockRunner.check_status.call_count, 1)
+
+    def test_interval_increased(self):
+        job = self.insert_job(datetime.now() - timedelta(seconds=1))
+        self.scheduler.monitor_running_jobs()
+        pull_one(slivka.db.database, job)
+        assert_equal(job['check_interval'], 20)
+        assert job['next_check'] > datetime.now() + timedelta(seconds=15)
+
+    def test_interval_bounded(self):
+        job = self.insert_job(datetime.now() - timedelta(seconds=1), 20)
+        self.scheduler.monitor_running_jobs()
+        pull_one(slivka.db.database, job)
+        assert_equal(job['check_interval'], 30)
+
+    def test_interval_reset_on_change(self):
+        MockRunner.check_status.return_value = JobStatus.COMPLETED
+        job = self.insert_job(datetime.now() - timedelta(seconds=1), 20)
+        self.scheduler.monitor_running_jobs()
+        pull_one(slivka.db.database, job)
+        assert_equal(job.state, JobStatus.COMPLETED)
+        assert_equal(job['check_interval'], 10)
+        pull_one(slivka.db.database, self.request)
+        assert_equal(self.request.state, JobStatus.COMPLETED)
+
+    def test_interval_kept_on_failure(self):
+        MockRunner.check_status.side_effect = RuntimeError
+        try:
+            job = self.insert_job(datetime.now() - timedelta(seconds=1))
+            self.scheduler.monitor_running_jobs()
+        finally:
+            MockRunner.check_status.side_effect = None
+        pull_one(slivka.db.database, job)
+        assert_equal(job['check_interval'], 10)
+
+    def test_usage_stored_when_finished(self):
+        MockRunner.check_status.return_value = JobStatus.COMPLETED
+        job = self.insert_job(datetime.now() - timedelta(seconds=1))
+        usage = {'wall_time': 12.0, 'cpu_time': 2.0, 'max_rss': 2048}
+        with mock.patch.object(MockRunner, 'batch_get_usage',
+                               return_value=[usage]):
+            self.scheduler.monitor_running_jobs()
+        pull_one(slivka.db.database, job)
+        assert_equal(job.usage, usage)
@@ -0,0 +1,120 @@
+import itertools
+from typing import Iterator
+
+import mongomock
+from nose.tools import assert_equal, assert_in
+
+import slivka.db
+from slivka.db.documents import JobRequest, JobMetadata
+from slivka.db.helpers import insert_many
+from slivka.scheduler import Scheduler, Runner
+from slivka.scheduler.core import get_classpath
+from slivka.scheduler.runners.runner import RunnerID, RunInfo
+from slivka.utils import JobStatus
+from . import LimiterStub
+
+
+def setup_module():
+    slivka.db.mongo = mongomock.MongoClient()
+    slivka.db.database = slivka.db.mongo.slivkadb
+
+
+def teardown_module():
+    del slivka.db.mongo
+    del slivka.db.database
+
+
+class MockRunner(Runner):
+    next_job_id = itertools.count(0).__next__
+
+    def __init__(self, service, name):
+        self.id = RunnerID(service_name=service, runner_name=name)
+
+    def batch_run(self, inputs_list) -> Iterator[RunInfo]:
+        return [RunInfo(self.submit(None, '/tmp'), '/tmp') for _ in inputs_list]
+
+    def submit(self, cmd, cwd):
+        return self.next_job_id()
+
+    @classmethod
+    def check_status(cls, job_id, cwd) -> JobStatus:
+        return JobStatus.QUEUED
+
+
+class TestApplyJobStates:
+    def setup(self):
+        slivka.db.mongo.drop_database('slivkadb')
+        self.scheduler = Scheduler()
+        self.scheduler.add_runner(MockRunner('stub', 'runner1'))
+        self.scheduler.limiters['stub'] = LimiterStub()
+        self.request = JobRequest(service='stub', inputs={'runner': 1})
+        insert_many(slivka.db.database, [self.request])
+        self.scheduler.run_cycle()
+        self.job = JobMetadata.find_one(slivka.db.database)
+        self.classpaths = [get_classpath(MockRunner)]
+
+    def test_state_applied(self):
+        self.scheduler.apply_job_states(
+            self.classpaths, {self.job.job_id: JobStatus.COMPLETED})
+        job = JobMetadata.find_one(slivka.db.database, uuid=self.job.uuid)
+        request = JobRequest.find_one(slivka.db.database,
+                                      uuid=self.request.uuid)
+        assert_equal(job.state, JobStatus.COMPLETED)
+        assert_equal(request.state, JobStatus.COMPLETED)
+
+    def test_other_runner_class_ignored(self):
+        self.scheduler.apply_job_states(
+            ['other.Runner'], {self.job.job_id: JobStatus.COMPLETED})
+        job = JobMetadata.find_one(slivka.db.database, uuid=self.job.uuid)
+        assert_equal(job.state, JobStatus.QUEUED)
+
+    def test_foreign_job_ignored(self):
+        other = Scheduler()
+        other.instance_id = 'other'
+        other.apply_job_states(
+            self.classpaths, {self.job.job_id: JobStatus.COMPLETED})
+        job = JobMetadata.find_one(slivka.db.database, uuid=self.job.uuid)
+        assert_equal(job.state, JobStatus.QUEUED)
+
+
+class NotifiedRunner(MockRunner):
+    """Runner whose jobs are reported finished by a notification
+    while their states are being polled."""
+    scheduler = None
+
+    @classmethod
+    def batch_check_status(cls, jobs):
+        cls.scheduler.apply_job_states(
+            [get_classpath(cls)],
+            {job.job_id: JobStatus.COMPLETED for job in jobs})
+        return [JobStatus.COMPLETED for _ in jobs]
+
+
+class TestConcurrentStateUpdate:
+    def setup(self):
+        slivka.db.mongo.drop_database('slivkadb')
+        self.scheduler = Scheduler()
+        NotifiedRunner.scheduler = self.scheduler
+        self.runner = NotifiedRunner('stub', 'runner1')
+        self.scheduler.add_runner(self.runner)
+        self.scheduler.limiters['stub'] = LimiterStub()
+        self.scheduler.runner_job_limits[self.runner.id] = 2
+        self.requests = [JobRequest(service='stub', inputs={'runner': 1})
+                         for _ in range(2)]
+        insert_many(slivka.db.database, self.requests)
+        self.scheduler.process_new_requests()
+        self.scheduler.start_accepted_requests()
+
+    def test_transition_counted_once(self):
+        assert_equal(self.scheduler.get_free_slots(self.runner.id), 0)
+        self.scheduler.monitor_running_jobs()
+        assert_equal(self.scheduler.get_free_slots(self.runner.id), 2)
+        assert_in('transitions_total{state="completed"} 2',
+                  self.scheduler.metrics.render())
+
+    def test_requests_completed(self):
+        self.scheduler.monitor_running_jobs()
+        for request in self.requests:
+            request = JobRequest.find_one(slivka.db.database,
+                                          uuid=request.uuid)
+            assert_equal(request.state, JobStatus.COMPLETED)
@@ -0,0 +1,109 @@
+import itertools
+from datetime import datetime, timedelta
+from typing import Iterator
+
+import mongomock
+from nose.tools import assert_equal, assert_list_equal
+
+import slivka.db
+from slivka.db.documents import JobRequest, JobMetadata
+from slivka.db.helpers import insert_many, pull_many
+from slivka.scheduler import Scheduler, Runner
+from slivka.scheduler.runners.runner import RunnerID, RunInfo
+from slivka.utils import JobStatus
+from . import LimiterStub
+
+
+def setup_module():
+    slivka.db.mongo = mongomock.MongoClient()
+    slivka.db.database = slivka.db.mongo.slivkadb
+
+
+def teardown_module():
+    del slivka.db.mongo
+    del slivka.db.database
+
+
+class MockRunner(Runner):
+    next_job_id = itertools.count(0).__next__
+
+    def __init__(self, service, name):
+        self.id = RunnerID(service_name=service, runner_name=name)
+        self.submitted = 0
+
+    def batch_run(self, inputs_list) -> Iterator[RunInfo]:
+        self.submitted += len(inputs_list)
+        return [RunInfo(self.submit(None, '/tmp'), '/tmp') for _ in inputs_list]
+
+    def submit(self, cmd, cwd):
+        return self.next_job_id()
+
+    @classmethod
+    def check_status(cls, job_id, cwd) -> JobStatus:
+        return JobStatus.RUNNING
+
+
+def create_scheduler(instance_id):
+    scheduler = Scheduler()
+    scheduler.instance_id = instance_id
+    scheduler.add_runner(MockRunner('stub', 'runner1'))
+    scheduler.limiters['stub'] = LimiterStub()
+    return scheduler
+
+
+class TestLeasedRequests:
+    def setup(self):
+        slivka.db.mongo.drop_database('slivkadb')
+        self.first = create_scheduler('first')
+        self.second = create_scheduler('second')
+        self.requests = [
+            JobRequest(service='stub', inputs={'runner': 1}) for _ in range(4)
+        ]
+        insert_many(slivka.db.database, self.requests)
+
+    def test_requests_submitted_once(self):
+        self.first.run_cycle()
+        self.second.run_cycle()
+        submitted = (self.first.runners['stub', 'runner1'].submitted +
+                     self.second.runners['stub', 'runner1'].submitted)
+        assert_equal(submitted, 4)
+        jobs = list(JobMetadata.find(slivka.db.database))
+        assert_equal(len(jobs), 4)
+
+    def test_jobs_owned_by_submitter(self):
+        self.first.run_cycle()
+        jobs = list(JobMetadata.find(slivka.db.database))
+        assert_list_equal([job['lease_owner'] for job in jobs], ['first'] * 4)
+
+    def test_foreign_requests_not_processed(self):
+        self.first.process_new_requests()
+        self.second.run_cycle()
+        pull_many(slivka.db.database, self.requests)
+        assert_list_equal(
+            [req.state for req in self.requests], [JobStatus.ACCEPTED] * 4
+        )
+
+    def test_expired_requests_taken_over(self):
+        self.first.process_new_requests()
+        JobRequest.collection(slivka.db.database).update_many(
+            {}, {'$set': {'lease_expiry': datetime.now() - timedelta(seconds=1)}}
+        )
+        self.second.run_cycle()
+        pull_many(slivka.db.database, self.requests)
+        assert_list_equal(
+            [req.state for req in self.requests], [JobStatus.RUNNING] * 4
+        )
+        assert_list_equal(
+            [req['lease_owner'] for req in self.requests], ['second'] * 4
+        )
+
+    def test_leases_renewed(self):
+        self.first.lease_duration = 0
+        self.first.process_new_requests()
+        self.first.lease_duration = 60
+        self.first.renew_leases()
+        self.second.run_cycle()
+        pull_many(slivka.db.database, self.requests)
+        assert_list_equal(
+            [req.state for req in self.requests], [JobStatus.ACCEPTED] * 4
+        )
@@ -0,0 +1,115 @@
+import itertools
+from typing import Iterator
+from urllib.request import urlopen
+
+import mongomock
+from nose.tools import assert_equal, assert_in
+
+import slivka.db
+from slivka.db.documents import JobRequest
+from slivka.db.helpers import insert_many
+from slivka.scheduler import Scheduler, Runner
+from slivka.scheduler.metrics import Metrics, MetricsServer
+from slivka.scheduler.runners.runner import RunnerID, RunInfo
+from slivka.utils import JobStatus
+from . import LimiterStub
+
+
+def setup_module():
+    slivka.db.mongo = mongomock.MongoClient()
+    slivka.db.database = slivka.db.mongo.slivkadb
+
+
+def teardown_module():
+    del slivka.db.mongo
+    del slivka.db.database
+
+
+class MockRunner(Runner):
+    next_job_id = itertools.count(0).__next__
+
+    def __init__(self, service, name):
+        self.id = RunnerID(service_name=service, runner_name=name)
+
+    def batch_run(self, inputs_list) -> Iterator[RunInfo]:
+        return [RunInfo(self.submit(None, '/tmp'), '/tmp') for _ in inputs_list]
+
+    def submit(self, cmd, cwd):
+        return self.next_job_id()
+
+    @classmethod
+    def check_status(cls, job_id, cwd) -> JobStatus:
+        return JobStatus.COMPLETED
+
+
+def test_render_counter():
+    metrics = Metrics(prefix='test')
+    metrics.increment('transitions', 2, state='queued')
+    metrics.increment('transitions', state='queued')
+    assert_in('test_transitions_total{state="queued"} 3', metrics.render())
+
+
+def test_render_timing():
+    metrics = Metrics(prefix='test')
+    metrics.observe('submit', 0.5, runner='a/b')
+    metrics.observe('submit', 1.5, runner='a/b')
+    text = metrics.render()
+    assert_in('test_submit_seconds_count{runner="a/b"} 2', text)
+    assert_in('test_submit_seconds_sum{runner="a/b"} 2.0', text)
+
+
+def test_summary_reset():
+    metrics = Metrics()
+    metrics.observe('cycle', 1.0)
+    assert_in('cycle: 1 calls', metrics.summary())
+    assert_equal(metrics.summary(), '')
+    assert_in('_cycle_seconds_count 1', metrics.render())
+
+
+def test_http_endpoint():
+    metrics = Metrics(prefix='test')
+    metrics.set_gauge('backoff_delay', 4, runner='a/b')
+    server = MetricsServer(metrics, ('127.0.0.1', 0))
+    server.start()
+    try:
+        host, port = server.address
+        with urlopen('http://%s:%d/metrics' % (host, port)) as response:
+            text = response.read().decode()
+    finally:
+        server.cancel()
+    assert_in('test_backoff_delay{runner="a/b"} 4', text)
+
+
+class TestSchedulerMetrics:
+    def setup(self):
+        slivka.db.mongo.drop_database('slivkadb')
+        self.scheduler = Scheduler()
+        self.scheduler.add_runner(MockRunner('stub', 'runner1'))
+        self.scheduler.limiters['stub'] = LimiterStub()
+        insert_many(slivka.db.database, [
+            JobRequest(service='stub', inputs={'runner': 1}),
+            JobRequest(service='stub', inputs={'runner': 1}),
+            JobRequest(service='stub', inputs={'runner': None})
+        ])
+
+    def test_transitions_counted(self):
+        self.scheduler.run_cycle()
+        text = self.scheduler.metrics.render()
+        assert_in('transitions_total{state="accepted"} 2', text)
+        assert_in('transitions_total{state="rejected"} 1', text)
+        assert_in('transitions_total{state="queued"} 2', text)
+        assert_in('transitions_total{state="completed"} 2', text)
+
+    def test_stages_timed(self):
+        self.scheduler.run_cycle()
+        text = self.scheduler.metrics.render()
+        assert_in('submit_seconds_count{runner="stub/runner1"} 1', text)
+        assert_in('monitor_seconds_count{runner_class="%s.MockRunner"} 1'
+                  % __name__, text)
+        assert_in('db_write_seconds_count{stage="intake"} 1', text)
+
+    def test_backoff_state_exposed(self):
+        self.scheduler.run_cycle()
+        text = self.scheduler.metrics.render()
+        assert_in('backoff_failures{runner="stub/runner1"} 0', text)
+        assert_in('backoff_delay{runner="stub/runner1"} 0', text)
@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+
+import mongomock
+from nose.tools import assert_list_equal, assert_equal, assert_greater_equal
+
+from slivka.db.documents import JobRequest
+from slivka.db.helpers import insert_many
+from slivka.scheduler import FifoOrdering, PriorityOrdering, FairShareOrdering
+from slivka.utils import JobStatus
+
+
+def make_requests(*clients, priorities=None):
+    start = datetime(2020, 1, 1)
+    priorities = priorities or [0] * len(clients)
+    return [
+        JobRequest(service='stub', inputs={}, client=client, priority=priority,
+                   status=JobStatus.ACCEPTED,
+                   timestamp=start + timedelta(minutes=i))
+        for i, (client, priority) in enumerate(zip(clients, priorities))
+    ]
+
+
+class TestOrdering:
+    def setup(self):
+        self.database = mongomock.MongoClient().slivkadb
+        self.collection = JobRequest.collection(self.database)
+
+    def fetch(self, policy, requests, limit):
+        insert_many(self.database, requests)
+        cursor = policy.fetch(
+            self.collection, {'status': JobStatus.ACCEPTED}, None, limit)
+        return [doc['uuid'] for doc in cursor]
+
+    def test_fifo(self):
+        requests = make_requests('a', 'a', 'b')
+        uuids = self.fetch(FifoOrdering(), requests[::-1], 2)
+        assert_list_equal(uuids, [req.uuid for req in requests[:2]])
+
+    def test_priority(self):
+        requests = make_requests('a', 'a', 'a', priorities=[0, 5, 1])
+        uuids = self.fetch(PriorityOrdering(), requests, 2)
+        assert_list_equal(uuids, [requests[1].uuid, requests[2].uuid])
+
+    def test_fair_share(self):
+        requests = make_requests('a', 'a', 'a', 'a', 'b', 'b')
+        uuids = self.fetch(FairShareOrdering(), requests, 4)
+        assert_list_equal(
+            uuids, [requests[i].uuid for i in (0, 4, 1, 5)]
+        )
+
+    def test_fair_share_weights(self):
+        class WeightedOrdering(FairShareOrdering):
+            weights = {'a': 3}
+        requests = make_requests('a', 'a', 'a', 'a', 'b', 'b')
+        uuids = self.fetch(WeightedOrdering(), requests, 4)
+        clients = {req.uuid: req.client for req in requests}
+        assert_equal([clients[uuid] for uuid in uuids].count('a'), 3)
+
+    def test_fair_share_requests_without_client(self):
+        requests = make_requests('a', 'a', 'a', None, 'b')
+        # stored before the clients were recorded
+        requests[3].pop('client', None)
+        uuids = self.fetch(FairShareOrdering(), requests, 3)
+        assert_list_equal(
+            uuids, [requests[i].uuid for i in (0, 3, 4)]
+        )
+
+    def test_fair_share_unused_shares_redistributed(self):
+        requests = make_requests(
+            'a', 'b', 'c', *['b'] * 6, *['c'] * 12)
+        uuids = self.fetch(FairShareOrdering(), requests, 10)
+        clients = {req.uuid: req.client for req in requests}
+        fetched = [clients[uuid] for uuid in uuids]
+        assert_equal(len(fetched), 10)
+        assert_equal(fetched.count('a'), 1)
+        assert_greater_equal(fetched.count('b'), 4)
+        assert_greater_equal(fetched.count('c'), 4)
@@ -0,0 +1,130 @@
+import itertools
+import threading
+import time
+from typing import Iterator
+
+import mongomock
+from nose.tools import assert_equal
+
+import slivka.db
+from slivka.db.documents import JobRequest, JobMetadata
+from slivka.db.helpers import insert_many, pull_many
+from slivka.scheduler import Scheduler, Runner
+from slivka.scheduler.core import get_classpath
+from slivka.scheduler.runners.runner import RunnerID, RunInfo
+from slivka.utils import JobStatus
+from . import LimiterStub
+
+
+def setup_module():
+    slivka.db.mongo = mongomock.MongoClient()
+    slivka.db.database = slivka.db.mongo.slivkadb
+
+
+def teardown_module():
+    del slivka.db.mongo
+    del slivka.db.database
+
+
+class MockRunner(Runner):
+    next_job_id = itertools.count(0).__next__
+
+    def __init__(self, service, name):
+        self.id = RunnerID(service_name=service, runner_name=name)
+
+    def batch_run(self, inputs_list) -> Iterator[RunInfo]:
+        return [RunInfo(self.submit(None, '/tmp'), '/tmp') for _ in inputs_list]
+
+    def submit(self, cmd, cwd):
+        return self.next_job_id()
+
+    @classmethod
+    def check_status(cls, job_id, cwd) -> JobStatus:
+        return JobStatus.COMPLETED
+
+
+class OtherMockRunner(MockRunner):
+    pass
+
+
+class SlowMockRunner(MockRunner):
+    released = threading.Event()
+
+    @classmethod
+    def check_status(cls, job_id, cwd) -> JobStatus:
+        cls.released.wait(5)
+        return JobStatus.COMPLETED
+
+
+def wait_for(predicate, timeout=5):
+    end_time = time.time() + timeout
+    while time.time() < end_time:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class TestPipelinedScheduler:
+    def setup(self):
+        slivka.db.mongo.drop_database('slivkadb')
+        SlowMockRunner.released.clear()
+        self.scheduler = Scheduler()
+        self.scheduler.pipelined = True
+        self.scheduler.poll_interval = 0.05
+        self.scheduler.monitor_interval = 0.05
+        self.scheduler.limiters['stub'] = LimiterStub()
+        self.thread = threading.Thread(target=self.scheduler.run_forever)
+
+    def teardown(self):
+        SlowMockRunner.released.set()
+        self.scheduler.stop()
+        self.thread.join(5)
+
+    def test_requests_completed(self):
+        self.scheduler.add_runner(MockRunner('stub', 'runner1'))
+        requests = [
+            JobRequest(service='stub', inputs={'runner': 1}),
+            JobRequest(service='stub', inputs={'runner': 1})
+        ]
+        insert_many(slivka.db.database, requests)
+        self.thread.start()
+
+        def completed():
+            pull_many(slivka.db.database, requests)
+            return all(req.state == JobStatus.COMPLETED for req in requests)
+        assert wait_for(completed)
+
+    def test_slow_monitor_does_not_block_submission(self):
+        self.scheduler.add_runner(SlowMockRunner('stub', 'runner1'))
+        self.thread.start()
+        first = JobRequest(service='stub', inputs={'runner': 1})
+        insert_many(slivka.db.database, [first])
+        # wait until the monitoring stage gets stuck on the first job
+        time.sleep(0.2)
+        second = JobRequest(service='stub', inputs={'runner': 1})
+        insert_many(slivka.db.database, [second])
+
+        def queued():
+            pull_many(slivka.db.database, [second])
+            return second.state == JobStatus.QUEUED
+        assert wait_for(queued)
+        pull_many(slivka.db.database, [first])
+        assert_equal(first.state, JobStatus.QUEUED)
+
+    def test_jobs_of_unloaded_runners_monitored(self):
+        self.scheduler.add_runner(MockRunner('stub', 'runner1'))
+        request = JobRequest(service='stub', inputs={},
+                             status=JobStatus.RUNNING)
+        job = JobMetadata(
+            uuid=request.uuid, service='stub', runner='runner2',
+            work_dir='/tmp', runner_class=get_classpath(OtherMockRunner),
+            job_id=0, status=JobStatus.RUNNING)
+        insert_many(slivka.db.database, [request])
+        insert_many(slivka.db.database, [job])
+        self.thread.start()
+
+        def completed():
+            pull_many(slivka.db.database, [job])
+            return job.state == JobStatus.COMPLETED
+        assert wait_for(completed)